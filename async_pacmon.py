@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# asyncio core for Pacmon on zmq.asyncio. Draining the data socket, the
+# periodic Influx flush, a health heartbeat and any extra streams (the
+# PACMAN echo and command ports) each run as their own task, so flushes and
+# heartbeats happen on schedule whether or not data arrives. The counting
+# itself is Pacmon.process; this module only replaces its receive loop.
+
+import argparse
+import asyncio
+import signal
+import socket
+import time
+from typing import Callable, Dict, Optional
+
+import zmq
+import zmq.asyncio
+
+from decode import decode_header
+from flight_recorder import install_trigger_signal
+from monitor_pacman import Pacmon, RCVBUF, RCVHWM, RECORDER_DIR, SHM_NAME, STATUS_PORT
+
+# Messages drained per wakeup before yielding to the other tasks
+DRAIN_BATCH = 1000
+
+
+class AsyncSource:
+    """Pacmon source fed by AsyncPacmon. Its clock is read once per drained
+    batch rather than per message."""
+
+    live = True
+    exhausted = False
+
+    def __init__(self):
+        self.received = 0
+        self.bytes = 0
+        self.streak = 0         # messages drained since the socket was last empty
+        self.t = time.time()
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def now(self) -> float:
+        return self.t
+
+    def backlog(self) -> int:
+        return self.streak
+
+    def stats_line(self, ts: int) -> str:
+        return f'receiver received={self.received}i,bytes={self.bytes}i {ts}'
+
+
+class Stream:
+    "An extra subscription, counted and optionally passed to a handler"
+
+    def __init__(self, name: str, url: str,
+                 handler: Optional[Callable[[memoryview], None]] = None):
+        self.name = name
+        self.url = url
+        self.handler = handler
+        self.messages = 0
+        self.words = 0
+        self.bytes = 0
+
+    def line(self, ts: int) -> str:
+        return (f'stream,name={self.name} messages={self.messages}i,'
+                f'words={self.words}i,bytes={self.bytes}i {ts}')
+
+
+def _subscribe(ctx: zmq.asyncio.Context, url: str) -> zmq.asyncio.Socket:
+    sock = ctx.socket(zmq.SUB)
+    sock.setsockopt(zmq.RCVHWM, RCVHWM)
+    if RCVBUF is not None:
+        sock.setsockopt(zmq.RCVBUF, RCVBUF)
+    sock.setsockopt(zmq.SUBSCRIBE, b'')
+    sock.connect(url)
+    return sock
+
+
+class AsyncPacmon:
+    def __init__(self, url='tcp://pacman32.local:5556', influx_writer=None,
+                 interval=1., heartbeat_interval=10., status_port=None,
+                 shm_name=None, recorder_dir=None):
+        self.url = url
+        self.interval = interval
+        self.heartbeat_interval = heartbeat_interval
+        self.source = AsyncSource()
+        self.pacmon = Pacmon(source=self.source, influx_writer=influx_writer,
+                             status_port=status_port, shm_name=shm_name,
+                             recorder_dir=recorder_dir)
+        self.streams: Dict[str, Stream] = {}
+        self.flushes = 0
+        self.heartbeats = 0
+        self.last_message = None    # wall-clock time
+        self._stop: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def add_stream(self, name: str, url: str,
+                   handler: Optional[Callable[[memoryview], None]] = None):
+        self.streams[name] = Stream(name, url, handler)
+
+    def add_echo(self, url: str):
+        """Count the echo stream and take config round-trip requests from it
+        instead of from the downstream packets in the data stream"""
+        self.add_stream('echo', url, self.pacmon.process_echo)
+        self.pacmon.echo_requests = True
+
+    def stop(self):
+        "Ask main() to shut down; safe to call from any thread"
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def _drain(self, sock: zmq.asyncio.Socket, on_message: Callable,
+                     on_empty: Optional[Callable] = None):
+        while True:
+            await sock.poll(flags=zmq.POLLIN)
+            self.source.t = time.time()
+            for _ in range(DRAIN_BATCH):
+                try:
+                    frame = await sock.recv(flags=zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    if on_empty is not None:
+                        on_empty()
+                    break
+                on_message(frame.buffer)
+            await asyncio.sleep(0)
+
+    def _data_empty(self):
+        self.source.streak = 0
+
+    def _data(self, raw: memoryview):
+        self.source.received += 1
+        self.source.bytes += len(raw)
+        self.source.streak += 1
+        self.last_message = self.source.t
+        self.pacmon.process(raw)
+
+    def _stream_handler(self, stream: Stream) -> Callable:
+        def on_message(raw: memoryview):
+            stream.messages += 1
+            stream.bytes += len(raw)
+            stream.words += int(decode_header(raw)['num_words'])
+            if stream.handler is not None:
+                stream.handler(raw)
+        return on_message
+
+    async def _every(self, period: float, func: Callable):
+        "Call func every `period` seconds on a fixed schedule"
+        loop = asyncio.get_running_loop()
+        due = loop.time() + period
+        while True:
+            await asyncio.sleep(max(0., due - loop.time()))
+            func()
+            due += period
+            if due < loop.time():   # fell behind; skip the missed ticks
+                due = loop.time() + period
+
+    def flush(self):
+        ts = int(time.time() * 1e9)
+        self.source.t = ts / 1e9
+        self.pacmon.write_to_influx(self.source.t, [
+            stream.line(ts) for stream in self.streams.values()])
+        self.flushes += 1
+
+    def heartbeat(self):
+        "Queued only if there is room: a heartbeat never evicts a snapshot"
+        now = time.time()
+        age = now - self.last_message if self.last_message is not None else -1.
+        self.pacmon.influx_writer.submit(None, [
+            f'pacmon_heartbeat,host={socket.gethostname()} '
+            f'seconds_since_message={age:.3f},received={self.source.received}i,'
+            f'flushes={self.flushes}i {int(now * 1e9)}'], evict=False)
+        self.heartbeats += 1
+
+    async def main(self, duration: Optional[float] = None):
+        self._stop = asyncio.Event()
+        self._loop = loop = asyncio.get_running_loop()
+        try:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, self._stop.set)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass                # not on the main thread
+
+        if self.pacmon.pool:
+            self.pacmon.pool.start()
+        ctx = zmq.asyncio.Context()
+        sockets = [_subscribe(ctx, self.url)]
+        tasks = [asyncio.create_task(self._drain(sockets[0], self._data,
+                                                 self._data_empty),
+                                     name='drain-data'),
+                 asyncio.create_task(self._every(self.interval, self.flush),
+                                     name='flush'),
+                 asyncio.create_task(self._every(self.heartbeat_interval,
+                                                 self.heartbeat),
+                                     name='heartbeat')]
+        for stream in self.streams.values():
+            sockets.append(_subscribe(ctx, stream.url))
+            tasks.append(asyncio.create_task(
+                self._drain(sockets[-1], self._stream_handler(stream)),
+                name=f'drain-{stream.name}'))
+
+        waiter = asyncio.create_task(self._stop.wait())
+        try:
+            done, _ = await asyncio.wait(tasks + [waiter], timeout=duration,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not waiter:
+                    task.result()   # a task died: re-raise its error
+        finally:
+            waiter.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.flush()
+            for sock in sockets:
+                sock.close(linger=0)
+            ctx.term()
+            if self.pacmon.pool:
+                self.pacmon.pool.stop()
+
+    def run(self, duration: Optional[float] = None):
+        asyncio.run(self.main(duration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='asyncio PACMAN monitor')
+    parser.add_argument('--url', default='tcp://pacman32.local:5556')
+    parser.add_argument('--echo', help='also count the echo stream, e.g. '
+                                       'tcp://pacman32.local:5554, and track '
+                                       'config round trips from it')
+    parser.add_argument('--command', help='also count the command stream')
+    parser.add_argument('--interval', type=float, default=1.)
+    parser.add_argument('--heartbeat', type=float, default=10.)
+    args = parser.parse_args()
+
+    monitor = AsyncPacmon(args.url, interval=args.interval,
+                          heartbeat_interval=args.heartbeat,
+                          status_port=STATUS_PORT, shm_name=SHM_NAME,
+                          recorder_dir=RECORDER_DIR)
+    if monitor.pacmon.recorder is not None:
+        install_trigger_signal(monitor.pacmon.recorder)
+    if args.echo:
+        monitor.add_echo(args.echo)
+    if args.command:
+        monitor.add_stream('command', args.command)
+    try:
+        monitor.run()
+    finally:
+        monitor.pacmon.save_mirror()
+        if monitor.pacmon.recorder is not None:
+            monitor.pacmon.recorder.flush()
+        monitor.pacmon.influx_writer.stop()
+        if monitor.pacmon.bus is not None:
+            monitor.pacmon.bus.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+# Words/s of the per-word util.parity64 against the bulk kernels.
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import kernels
+from util import parity64
+
+
+def rate(func, num_words, min_time=0.5):
+    calls, start = 0, time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > min_time:
+            return calls * num_words / elapsed
+
+
+def main(num_words=10_000):
+    rng = np.random.default_rng(0)
+    packets = rng.integers(0, 2**64, size=num_words, dtype=np.uint64)
+    packet_bytes = [p.to_bytes(8, 'little') for p in packets.tolist()]
+
+    results = {
+        'util.parity64': rate(lambda: [parity64(p) for p in packet_bytes], num_words),
+        'kernels.parity_ok': rate(lambda: kernels.parity_ok(packets), num_words),
+        'kernels.decode_packets': rate(lambda: kernels.decode_packets(packets), num_words),
+    }
+    base = results['util.parity64']
+    for name, words_per_s in results.items():
+        print(f'{name:24s} {words_per_s:14,.0f} words/s  ({words_per_s / base:6.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# Scaling of pool.DecodePool from 1 to N worker processes: words/s decoded
+# and counted, end to end (parent PUSH -> workers -> merged snapshot).
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from decode import DATA, HEADER_DTYPE, WORD_DTYPE
+from pool import DecodePool
+
+
+def make_msg(num_words: int, rng: np.random.Generator) -> bytes:
+    header = np.zeros(1, HEADER_DTYPE)
+    header['type'] = ord('D')
+    header['num_words'] = num_words
+    words = np.zeros(num_words, WORD_DTYPE)
+    words['type'] = DATA
+    words['io_channel'] = rng.integers(1, 33, num_words)
+    words['packet'] = rng.integers(0, 2**64, num_words, dtype=np.uint64)
+    return header.tobytes() + words.tobytes()
+
+
+def run(num_workers: int, msgs, repeat: int) -> float:
+    pool = DecodePool(num_workers, interval=0.05).start()
+    total = len(msgs) * repeat
+    num_words = sum(len(m) - 8 for m in msgs) // 16 * repeat
+    try:
+        # warm up: make sure every worker is connected before timing
+        for msg in msgs:
+            pool.submit(msg)
+        while pool.snapshot().ingest[0, 0] < len(msgs):
+            pool.collect(timeout=0.05)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for msg in msgs:
+                pool.submit(msg)
+        while pool.snapshot().ingest[0, 0] < len(msgs) + total:
+            pool.collect(timeout=0.01)
+        return num_words / (time.perf_counter() - start)
+    finally:
+        pool.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--words', type=int, default=1000,
+                        help='words per message')
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    msgs = [make_msg(args.words, rng) for _ in range(100)]
+    repeat = max(1, args.messages // len(msgs))
+
+    base = None
+    for num_workers in range(1, args.max_workers + 1):
+        rate = run(num_workers, msgs, repeat)
+        base = base or rate
+        print(f'{num_workers:3d} workers {rate:14,.0f} words/s  ({rate / base:4.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+# Throughput/latency benchmarks for the monitor's hot paths, over message
+# sizes from 1 to 10k words and a data-heavy and a config-heavy packet mix,
+# plus the scaling of pool.DecodePool from 1 to --pool-workers processes
+# (bench_pool.py; keys pool.DecodePool[N]/1000/random).
+#
+#   python benchmarks/suite.py --output results.json
+#   python benchmarks/suite.py --compare benchmarks/baseline.json --tolerance 0.25
+#
+# Results are keyed "path/words/mix" with words_per_s and us_per_msg. In
+# compare mode the exit status is 1 if any path's words/s fell more than
+# `tolerance` below the baseline. Baselines are machine-specific; regenerate
+# them with --output on the machine that runs the comparison.
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+from counters import CounterStore
+from decode import decode_msg
+from emulator import EmulatorConfig, MessageEncoder
+from flight_recorder import FlightRecorder
+from format import Msg
+from influx_writer import snapshot_lines
+import kernels
+from occupancy import OccupancyStore
+from register_mirror import RegisterMirror
+from roundtrip import RoundTripTracker
+from timing import TimingAnalyzer
+from util import parity64
+
+SIZES = (1, 10, 100, 1000, 10_000)
+MIXES = {
+    'data': (0.97, 0.01, 0.01, 0.01),
+    'config': (0.1, 0., 0.45, 0.45),
+}
+
+
+def load_module(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_curses_tool():
+    return load_module('ncurses_pacmon', os.path.join(HERE, '..', 'ncurses', 'pacmon.py'))
+
+
+def time_per_call(func, min_time: float) -> float:
+    func()                      # warm up
+    calls, start = 0, time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def cases(raw: bytes, curses_tool):
+    msg = decode_msg(raw)
+    packets = msg.packet
+    packet_bytes = [p.to_bytes(8, 'little') for p in packets.tolist()]
+    store = CounterStore()
+    store.record(msg)
+    occupancy = OccupancyStore()
+    timing = TimingAnalyzer()
+    roundtrip = RoundTripTracker()
+    mirror = RegisterMirror()
+    recorder = FlightRecorder(os.devnull, capacity_bytes=1 << 24)
+    snap = store.snapshot()
+
+    def curses_path():
+        _, words = curses_tool.parse_msg(raw)
+        curses_tool.record_words(words)
+
+    return {
+        'format.Msg.parse': lambda: Msg.parse(raw),
+        'decode.decode_msg': lambda: decode_msg(raw),
+        'counters.CounterStore.record': lambda: store.record(decode_msg(raw)),
+        'occupancy.OccupancyStore.record': lambda: occupancy.record(msg),
+        'timing.TimingAnalyzer.record': lambda: timing.record(msg, 0.),
+        'roundtrip.RoundTripTracker.record': lambda: roundtrip.record(msg, 0.),
+        'register_mirror.RegisterMirror.record': lambda: mirror.record(msg, 1.),
+        'flight_recorder.FlightRecorder.record': lambda: recorder.record(raw, 0.),
+        'util.parity64': lambda: [parity64(p) for p in packet_bytes],
+        'kernels.parity_ok': lambda: kernels.parity_ok(packets),
+        'kernels.decode_packets': lambda: kernels.decode_packets(packets),
+        'ncurses.parse_msg+record_words': curses_path,
+        'influx_writer.snapshot_lines': lambda: snapshot_lines(snap),
+    }
+
+
+def run(min_time: float, sizes=SIZES, mixes=MIXES, only=None) -> dict:
+    curses_tool = load_curses_tool()
+    results = {}
+    for mix, fractions in mixes.items():
+        encoder = MessageEncoder(EmulatorConfig(packet_type_fractions=fractions,
+                                                sync_interval=None, seed=0,
+                                                bank_words=1 << 14))
+        for num_words in sizes:
+            raw = encoder.encode(encoder.words(num_words, now=0.), now=0.)
+            for path, func in cases(raw, curses_tool).items():
+                if only and not any(name in path for name in only):
+                    continue
+                seconds = time_per_call(func, min_time)
+                key = f'{path}/{num_words}/{mix}'
+                results[key] = {'words_per_s': num_words / seconds,
+                                'us_per_msg': seconds * 1e6}
+                print(f'{key:50s} {num_words / seconds:14,.0f} words/s '
+                      f'{seconds * 1e6:12.1f} us/msg', flush=True)
+    return results
+
+
+def run_pool(max_workers: int, num_words=1000, num_msgs=2000, only=None) -> dict:
+    "words/s through DecodePool for 1..max_workers workers"
+    bench_pool = load_module('bench_pool', os.path.join(HERE, 'bench_pool.py'))
+    rng = np.random.default_rng(0)
+    msgs = [bench_pool.make_msg(num_words, rng) for _ in range(100)]
+    results = {}
+    for num_workers in range(1, max_workers + 1):
+        path = f'pool.DecodePool[{num_workers}]'
+        if only and not any(name in path for name in only):
+            continue
+        rate = bench_pool.run(num_workers, msgs, max(1, num_msgs // len(msgs)))
+        key = f'{path}/{num_words}/random'
+        results[key] = {'words_per_s': rate, 'us_per_msg': num_words / rate * 1e6}
+        print(f'{key:50s} {rate:14,.0f} words/s {num_words / rate * 1e6:12.1f} us/msg',
+              flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for key, base in baseline['results'].items():
+        if key not in results:
+            continue
+        ratio = results[key]['words_per_s'] / base['words_per_s']
+        if ratio < 1 - tolerance:
+            regressions.append((key, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='fail on regressions against this JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed fractional drop in words/s')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds to spend on each case')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--only', nargs='+', help='substrings of paths to run')
+    parser.add_argument('--pool-workers', type=int, default=os.cpu_count(),
+                        help='largest DecodePool to measure (0 to skip)')
+    args = parser.parse_args()
+
+    results = run(args.min_time, args.sizes, only=args.only)
+    results.update(run_pool(args.pool_workers, only=args.only))
+    doc = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'machine': platform.machine(),
+                    'cpus': os.cpu_count(),
+                    'node': platform.node()},
+           'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, ratio in regressions:
+            print(f'REGRESSION {key}: {ratio:.2f}x baseline')
+        if regressions:
+            sys.exit(1)
+        print(f'no regressions beyond {args.tolerance:.0%}')
+
+
+if __name__ == '__main__':
+    main()
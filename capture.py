@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+# Raw message capture. Messages are appended with their receive time to
+# chunked capture files (*.pmcap) alongside a compact chunk index (*.pmidx).
+#
+#   data file:  FILE_MAGIC, then per chunk: CHUNK_MAGIC, CHUNK_DTYPE record,
+#               payload (optionally zlib-compressed)
+#   payload:    num_msgs MSG_DTYPE records, then the raw messages back to back
+#   index file: INDEX_MAGIC, then one CHUNK_DTYPE record per chunk
+#
+# A reader mmaps the data file, binary-searches the index to find the chunk
+# holding a message number or receive time, and only touches (decompresses)
+# that chunk. The index is appended per chunk and can be rebuilt from the
+# chunk headers if the writer died before updating it.
+
+import argparse
+import mmap
+import os
+import time
+from typing import Iterator, Optional, Tuple
+import zlib
+
+import numpy as np
+import zmq
+
+from util import get_data_socket
+
+FILE_MAGIC = b'PACMCAP1'
+INDEX_MAGIC = b'PACMIDX1'
+CHUNK_MAGIC = b'CHNK'
+DATA_SUFFIX = '.pmcap'
+INDEX_SUFFIX = '.pmidx'
+
+FLAG_ZLIB = 1
+
+CHUNK_DTYPE = np.dtype([
+    ('offset', '<u8'),          # of the payload within the data file
+    ('stored_len', '<u4'),
+    ('raw_len', '<u4'),
+    ('first_msg', '<u8'),       # message number within the file
+    ('num_msgs', '<u4'),
+    ('flags', '<u4'),
+    ('t_first', '<i8'),         # receive times, ns since the epoch
+    ('t_last', '<i8'),
+])
+
+MSG_DTYPE = np.dtype([
+    ('recv_ns', '<i8'),
+    ('offset', '<u4'),          # within the chunk's message area
+    ('length', '<u4'),
+])
+
+
+class CaptureWriter:
+    def __init__(self, directory: str, prefix='capture', chunk_bytes=1 << 20,
+                 chunk_seconds=1., max_file_bytes=1 << 30,
+                 compress_level: Optional[int] = None):
+        self.directory = directory
+        self.prefix = prefix
+        self.chunk_bytes = chunk_bytes
+        self.chunk_seconds = chunk_seconds
+        self.max_file_bytes = max_file_bytes
+        self.compress_level = compress_level
+        os.makedirs(directory, exist_ok=True)
+
+        self.paths = []
+        self._data = None
+        self._index = None
+        self._file_msgs = 0
+        self._buf = bytearray()
+        self._times = []
+        self._lengths = []
+        self._chunk_start = 0.
+
+    def _open_file(self):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        base = os.path.join(self.directory, f'{self.prefix}-{stamp}')
+        seq = 0
+        while os.path.exists(f'{base}-{seq:04d}{DATA_SUFFIX}'):
+            seq += 1
+        base = f'{base}-{seq:04d}'
+        self._data = open(base + DATA_SUFFIX, 'wb')
+        self._data.write(FILE_MAGIC)
+        self._index = open(base + INDEX_SUFFIX, 'wb')
+        self._index.write(INDEX_MAGIC)
+        self._file_msgs = 0
+        self.paths.append(base + DATA_SUFFIX)
+
+    def write(self, raw, recv_ns: Optional[int] = None):
+        if not self._times:
+            self._chunk_start = time.monotonic()
+        self._times.append(time.time_ns() if recv_ns is None else recv_ns)
+        self._lengths.append(len(raw))
+        self._buf += raw
+        if (len(self._buf) >= self.chunk_bytes
+                or time.monotonic() - self._chunk_start >= self.chunk_seconds):
+            self.flush()
+
+    def flush(self):
+        if not self._times:
+            return
+        if self._data is None or self._data.tell() >= self.max_file_bytes:
+            self._close_file()
+            self._open_file()
+
+        table = np.zeros(len(self._times), MSG_DTYPE)
+        table['recv_ns'] = self._times
+        table['length'] = self._lengths
+        table['offset'][1:] = np.cumsum(table['length'][:-1])
+        payload = table.tobytes() + self._buf
+        raw_len = len(payload)
+        flags = 0
+        if self.compress_level is not None:
+            payload = zlib.compress(payload, self.compress_level)
+            flags |= FLAG_ZLIB
+
+        chunk = np.zeros(1, CHUNK_DTYPE)
+        chunk['offset'] = self._data.tell() + len(CHUNK_MAGIC) + CHUNK_DTYPE.itemsize
+        chunk['stored_len'] = len(payload)
+        chunk['raw_len'] = raw_len
+        chunk['first_msg'] = self._file_msgs
+        chunk['num_msgs'] = len(table)
+        chunk['flags'] = flags
+        chunk['t_first'] = table['recv_ns'][0]
+        chunk['t_last'] = table['recv_ns'][-1]
+
+        self._data.write(CHUNK_MAGIC + chunk.tobytes())
+        self._data.write(payload)
+        self._data.flush()
+        # Only index chunks that are fully on disk
+        self._index.write(chunk.tobytes())
+        self._index.flush()
+
+        self._file_msgs += len(table)
+        self._buf = bytearray()
+        self._times = []
+        self._lengths = []
+
+    def _close_file(self):
+        if self._data is None:
+            return
+        self._data.close()
+        self._index.close()
+        self._data = self._index = None
+
+    def close(self):
+        self.flush()
+        self._close_file()
+
+
+def _scan_chunks(mm: mmap.mmap) -> np.ndarray:
+    "Rebuild the chunk index from the chunk headers in a data file"
+    chunks = []
+    pos = len(FILE_MAGIC)
+    header_len = len(CHUNK_MAGIC) + CHUNK_DTYPE.itemsize
+    while pos + header_len <= len(mm) and mm[pos:pos + 4] == CHUNK_MAGIC:
+        chunk = np.frombuffer(mm, CHUNK_DTYPE, count=1, offset=pos + 4)[0]
+        end = int(chunk['offset']) + int(chunk['stored_len'])
+        if end > len(mm):
+            break               # partially written
+        chunks.append(chunk)
+        pos = end
+    return np.array(chunks, dtype=CHUNK_DTYPE)
+
+
+class CaptureReader:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError(f'{path} is not a capture file')
+
+        index_path = path[:-len(DATA_SUFFIX)] + INDEX_SUFFIX
+        self.chunks = None
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) == INDEX_MAGIC:
+                    data = f.read()
+                    usable = len(data) - len(data) % CHUNK_DTYPE.itemsize
+                    self.chunks = np.frombuffer(data[:usable], CHUNK_DTYPE)
+        if self.chunks is None:
+            self.chunks = _scan_chunks(self.mm)
+
+        self._cached = (None, None, None)
+
+    def close(self):
+        self._cached = (None, None, None)
+        try:
+            self.mm.close()
+        except BufferError:
+            pass                # views still held by the caller; closed on GC
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        if not len(self.chunks):
+            return 0
+        last = self.chunks[-1]
+        return int(last['first_msg']) + int(last['num_msgs'])
+
+    def chunk(self, k: int) -> Tuple[np.ndarray, memoryview]:
+        "Message table and message area of chunk k"
+        if self._cached[0] == k:
+            return self._cached[1], self._cached[2]
+        info = self.chunks[k]
+        start = int(info['offset'])
+        payload = memoryview(self.mm)[start:start + int(info['stored_len'])]
+        if info['flags'] & FLAG_ZLIB:
+            payload = memoryview(zlib.decompress(payload))
+        num_msgs = int(info['num_msgs'])
+        table = np.frombuffer(payload, MSG_DTYPE, count=num_msgs)
+        area = payload[num_msgs * MSG_DTYPE.itemsize:]
+        self._cached = (k, table, area)
+        return table, area
+
+    def _locate(self, i: int) -> Tuple[int, int]:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        k = int(np.searchsorted(self.chunks['first_msg'], i, side='right')) - 1
+        return k, i - int(self.chunks[k]['first_msg'])
+
+    def __getitem__(self, i: int) -> memoryview:
+        k, j = self._locate(i)
+        table, area = self.chunk(k)
+        offset = int(table['offset'][j])
+        return area[offset:offset + int(table['length'][j])]
+
+    def recv_ns(self, i: int) -> int:
+        k, j = self._locate(i)
+        return int(self.chunk(k)[0]['recv_ns'][j])
+
+    def find_time(self, t_ns: int) -> int:
+        "Number of the first message received at or after t_ns"
+        k = int(np.searchsorted(self.chunks['t_last'], t_ns, side='left'))
+        if k == len(self.chunks):
+            return len(self)
+        table, _ = self.chunk(k)
+        j = int(np.searchsorted(table['recv_ns'], t_ns, side='left'))
+        return int(self.chunks[k]['first_msg']) + j
+
+    def messages(self, start_ns: Optional[int] = None,
+                 stop_ns: Optional[int] = None) -> Iterator[Tuple[int, memoryview]]:
+        "(recv_ns, raw) for messages received in [start_ns, stop_ns)"
+        first = 0 if start_ns is None else self.find_time(start_ns)
+        k0 = self._locate(first)[0] if first < len(self) else len(self.chunks)
+        for k in range(k0, len(self.chunks)):
+            table, area = self.chunk(k)
+            j0 = first - int(self.chunks[k]['first_msg']) if k == k0 else 0
+            for recv_ns, offset, length in table[j0:].tolist():
+                if stop_ns is not None and recv_ns >= stop_ns:
+                    return
+                yield recv_ns, area[offset:offset + length]
+
+
+def capture(url: str, directory: str, **kwargs):
+    socket = get_data_socket(url)
+    writer = CaptureWriter(directory, **kwargs)
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+    try:
+        while True:
+            if not poller.poll(timeout=100):
+                writer.flush()
+                continue
+            while True:
+                try:
+                    frame = socket.recv(flags=zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
+                writer.write(frame.buffer)
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Capture raw PACMAN messages')
+    parser.add_argument('directory')
+    parser.add_argument('--url', default='tcp://pacman32.local:5556')
+    parser.add_argument('--prefix', default='capture')
+    parser.add_argument('--compress', type=int, metavar='LEVEL',
+                        help='zlib-compress each chunk')
+    parser.add_argument('--chunk-kb', type=int, default=1024)
+    parser.add_argument('--max-file-mb', type=int, default=1024)
+    args = parser.parse_args()
+
+    capture(args.url, args.directory, prefix=args.prefix,
+            chunk_bytes=args.chunk_kb << 10,
+            max_file_bytes=args.max_file_mb << 20,
+            compress_level=args.compress)
+
+
+if __name__ == '__main__':
+    main()
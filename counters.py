@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# Fixed-shape counter arrays indexed by [tile, io_channel, field], filled in
+# bulk from decoded messages. Every counter is a plain sum, so a batch of
+# words reduces to one bincount over a small "combination" code per
+# io_channel. Only at snapshot time is a matrix product used to spread each
+# combination over the fields it increments.
+#
+# Under overload the work splits in two tiers: record_header() keeps the word
+# type and ingest totals exact from a strided scan of two bytes per word,
+# while record_packets() runs only on the messages a DecodeSampler picks and
+# scales their counts by the number of messages each one stands for. The
+# ingest field `undecoded` counts the messages that only had the header
+# scan; wherever it grew between two snapshots, the data and config counts
+# added in between are estimates.
+
+from dataclasses import dataclass
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from decode import DecodedMsg, HEADER_LEN, WORD_LEN, decode_header
+from decode import DATA, TRIG, SYNC, PING, WRITE, READ, ERROR
+import kernels
+
+NUM_IO_CHANNELS = 256           # io_channel is a single byte
+PACMAN_IO_CHANNELS = 33         # a PACMAN's io_channels are 1-32
+
+DATA_FIELDS = ('total', 'valid_parity', 'invalid_parity', 'downstream',
+               'upstream')
+CONFIG_FIELDS = ('total', 'invalid_parity', 'ds_read', 'ds_write', 'us_read',
+                 'us_write')
+INGEST_FIELDS = ('messages', 'words', 'bytes', 'undecoded')
+WORD_TYPES = ('Data', 'Trig', 'Sync', 'Ping', 'Write', 'Read', 'Error')
+WORD_TYPE_CODES = np.array([DATA, TRIG, SYNC, PING, WRITE, READ, ERROR])
+
+# Vectorized counterpart of format.PACKET_TYPE_MAP, indexed by packet & 3
+PACKET_TYPE_CODES = np.array([DATA, ERROR, WRITE, READ], dtype=np.uint8)
+
+# A Data word is summarized by packet_type (2 bits), valid parity (1 bit) and
+# downstream (1 bit)
+NUM_COMBOS = 16
+
+
+def combo_code(packet_type, valid_parity, downstream):
+    return packet_type | (valid_parity << 2) | (downstream << 3)
+
+
+def _field_matrices():
+    data = np.zeros((NUM_COMBOS, len(DATA_FIELDS)), dtype=np.int64)
+    config = np.zeros((NUM_COMBOS, len(CONFIG_FIELDS)), dtype=np.int64)
+    for combo in range(NUM_COMBOS):
+        packet_type, valid, ds = combo & 3, (combo >> 2) & 1, (combo >> 3) & 1
+        is_read = PACKET_TYPE_CODES[packet_type] == READ
+        is_write = PACKET_TYPE_CODES[packet_type] == WRITE
+        is_config = is_read or is_write
+
+        data[combo] = [1, valid, not valid, ds, not ds]
+        config[combo] = [is_config, is_config and not valid,
+                         is_read and ds, is_write and ds,
+                         is_read and not ds, is_write and not ds]
+    return data, config
+
+DATA_MATRIX, CONFIG_MATRIX = _field_matrices()
+
+
+@dataclass
+class CounterSnapshot:
+    time: float
+    word_types: np.ndarray      # [tile, word type]
+    data: np.ndarray            # [tile, io_channel, DATA_FIELDS]
+    config: np.ndarray          # [tile, io_channel, CONFIG_FIELDS]
+    ingest: np.ndarray          # [tile, INGEST_FIELDS]
+
+    def active_channels(self, tile: int) -> np.ndarray:
+        "io_channels that have seen at least one Data word"
+        return np.flatnonzero(self.data[tile, :, 0])
+
+    def estimated(self, tile: int, prev: Optional['CounterSnapshot'] = None) -> bool:
+        """Whether the data and config counts of `tile` added since `prev` (or
+        ever, without it) include scaled estimates"""
+        field = INGEST_FIELDS.index('undecoded')
+        undecoded = int(self.ingest[tile, field])
+        if prev is not None and tile < len(prev.ingest):
+            before = int(prev.ingest[tile, field])
+            # a restarted source starts from zero
+            undecoded -= before if before <= undecoded else 0
+        return bool(undecoded)
+
+
+def merge_snapshots(snaps: List[CounterSnapshot]) -> CounterSnapshot:
+    "Sum of snapshots taken over disjoint sets of messages"
+    return CounterSnapshot(time=max(snap.time for snap in snaps),
+                           word_types=sum(snap.word_types for snap in snaps),
+                           data=sum(snap.data for snap in snaps),
+                           config=sum(snap.config for snap in snaps),
+                           ingest=sum(snap.ingest for snap in snaps))
+
+
+class CounterStore:
+    def __init__(self, num_tiles=1, num_io_channels=NUM_IO_CHANNELS):
+        self.num_tiles = num_tiles
+        self.num_io_channels = num_io_channels
+        self.word_types = np.zeros((num_tiles, len(WORD_TYPES)), dtype=np.int64)
+        self.combos = np.zeros((num_tiles, num_io_channels * NUM_COMBOS),
+                               dtype=np.int64)
+        self.ingest = np.zeros((num_tiles, len(INGEST_FIELDS)), dtype=np.int64)
+        self.lock = threading.Lock()
+
+    def _combos(self, msg: DecodedMsg, is_data: np.ndarray,
+                packet_type: np.ndarray) -> np.ndarray:
+        chans = msg.io_channel[is_data].astype(np.intp)
+        packets = msg.packet[is_data]
+        valid = kernels.parity_ok(packets).astype(np.intp)
+        downstream = kernels.downstream(packets).astype(np.intp)
+        codes = chans * NUM_COMBOS + combo_code(packet_type, valid, downstream)
+        return np.bincount(codes, minlength=self.num_io_channels * NUM_COMBOS)
+
+    def record(self, msg: DecodedMsg, tile=0):
+        is_data = msg.word_type == DATA
+        packet_type = kernels.packet_type(msg.packet[is_data]).astype(np.intp)
+
+        # Reclassify Data words according to the LArPix packet type
+        word_type = msg.word_type.astype(np.intp)
+        word_type[is_data] = PACKET_TYPE_CODES[packet_type]
+        type_counts = np.bincount(word_type, minlength=256)[WORD_TYPE_CODES]
+
+        combos = self._combos(msg, is_data, packet_type)
+
+        with self.lock:
+            self.word_types[tile] += type_counts
+            self.combos[tile] += combos
+            self.ingest[tile] += (1, msg.num_words,
+                                  HEADER_LEN + WORD_LEN * msg.num_words, 0)
+
+    def record_header(self, raw, tile=0, decoded=True) -> np.void:
+        """Exact word type and ingest counts from the header and the type and
+        packet-type bytes of each word, without decoding the words. Pass
+        decoded=False for messages that will not also go to record_packets."""
+        header = decode_header(raw)
+        num_words = int(header['num_words'])
+        if len(raw) < HEADER_LEN + WORD_LEN * num_words:
+            raise ValueError(f'message truncated: header says {num_words} words, '
+                             f'got {len(raw)} bytes')
+        words = np.frombuffer(raw, np.uint8, count=WORD_LEN * num_words,
+                              offset=HEADER_LEN).reshape(num_words, WORD_LEN)
+        word_type = words[:, 0].astype(np.intp)
+        is_data = word_type == DATA
+        # the LArPix packet type is the low two bits of the packet's first byte
+        word_type[is_data] = PACKET_TYPE_CODES[words[is_data, 8] & 3]
+        type_counts = np.bincount(word_type, minlength=256)[WORD_TYPE_CODES]
+
+        with self.lock:
+            self.word_types[tile] += type_counts
+            self.ingest[tile] += (1, num_words, HEADER_LEN + WORD_LEN * num_words,
+                                  not decoded)
+        return header
+
+    def record_packets(self, msg: DecodedMsg, tile=0, weight=1):
+        """Data and config counts of a message that went through
+        record_header, multiplied by `weight`, the number of messages it
+        stands for"""
+        is_data = msg.word_type == DATA
+        packet_type = kernels.packet_type(msg.packet[is_data]).astype(np.intp)
+        combos = self._combos(msg, is_data, packet_type)
+        with self.lock:
+            self.combos[tile] += combos * weight
+
+    def snapshot(self, t: Optional[float] = None) -> CounterSnapshot:
+        "Consistent copy of all counters, stamped with `t` or the current time"
+        with self.lock:
+            word_types = self.word_types.copy()
+            combos = self.combos.copy()
+            ingest = self.ingest.copy()
+        combos = combos.reshape(self.num_tiles, self.num_io_channels, NUM_COMBOS)
+        return CounterSnapshot(time=time.time() if t is None else t,
+                               word_types=word_types,
+                               data=combos @ DATA_MATRIX,
+                               config=combos @ CONFIG_MATRIX,
+                               ingest=ingest)
+
+
+class DecodeSampler:
+    """Chooses which messages get the full per-word decode. Every
+    `adjust_every` messages the ratio doubles (up to max_ratio) if the backlog
+    is above `threshold`, or halves back towards 1 if it is below a quarter of
+    it. Message n is decoded when n % ratio == 0, and then stands for itself
+    and every message skipped since the previous decoded one."""
+
+    def __init__(self, threshold: int, max_ratio=64, adjust_every=100):
+        self.threshold = threshold
+        self.max_ratio = max_ratio
+        self.adjust_every = adjust_every
+        self.ratio = 1
+        self.seen = 0
+        self.decoded = 0
+        self._pending = 0
+
+    def weight(self, backlog: int) -> int:
+        "0 to skip the deep decode of this message, else its weight"
+        self.seen += 1
+        if self.seen % self.adjust_every == 0:
+            if backlog > self.threshold:
+                self.ratio = min(self.ratio * 2, self.max_ratio)
+            elif backlog < self.threshold // 4:
+                self.ratio = max(self.ratio // 2, 1)
+        self._pending += 1
+        if self.seen % self.ratio:
+            return 0
+        weight, self._pending = self._pending, 0
+        self.decoded += 1
+        return weight
+
+    def stats_line(self, ts: int, backlog: int) -> str:
+        return (f'sampling ratio={self.ratio}i,messages={self.seen}i,'
+                f'decoded={self.decoded}i,backlog={backlog}i {ts}')
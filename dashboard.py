@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+# Terminal dashboard for Pacmon. It renders counter snapshots from the
+# running pipeline on its own thread at a fixed frame rate, so a slow
+# terminal or SSH link can never hold up the receive/count loop. Each frame
+# is built as a dict of (row, col) -> text and only cells whose text changed
+# since the previous frame are written to the screen.
+#
+#   d  data table    c  config table    t  next tile    q  quit
+#
+# With --attach it runs no pipeline of its own and shows the snapshots a
+# running monitor publishes to shared memory.
+
+import _thread
+import argparse
+import curses
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from counters import CounterSnapshot, WORD_TYPES
+from monitor_pacman import Pacmon, SHM_NAME, STATUS_PORT
+from snapshot_bus import SnapshotReader
+
+Cells = Dict[Tuple[int, int], str]
+
+DATA_HEADERS = ('I/O Chan', 'Total', 'Valid Parity', 'Inval Parity',
+                'Downstream', 'Upstream')
+CONFIG_HEADERS = ('I/O Chan', 'Total', 'Inval Par', 'DS READ', 'DS WRITE',
+                  'US READ', 'US WRITE')
+COLUMN_WIDTH = 15
+VALUE_WIDTH = COLUMN_WIDTH - 2  # after the '| ' of each cell
+
+
+def _abbrev(value: int, width: int) -> str:
+    "`value`, or if that does not fit in `width` e.g. 123.5T"
+    text = str(value)
+    if len(text) <= width:
+        return text
+    for exp, suffix in enumerate('kMGTPE', 1):
+        scaled = value / 1000 ** exp
+        if abs(scaled) < 1000:
+            break
+    text = f'{scaled:.1f}{suffix}'
+    if len(text) > width:
+        text = f'{scaled:.0f}{suffix}'
+    return text[:width]
+
+
+def _count(value: int, total: int) -> str:
+    if not total:
+        return _abbrev(value, VALUE_WIDTH)
+    percent = f' ({100. * value / total:.0f}%)'
+    return _abbrev(value, VALUE_WIDTH - len(percent)) + percent
+
+
+def table_cells(row: int, title: str, headers: Sequence[str],
+                rows: Sequence[Sequence[str]]) -> Tuple[Cells, int]:
+    """Cells of a titled table starting at `row`, and the row after it.
+    Values are cut to the column width: the renderer only rewrites cells that
+    changed, so one running into its neighbour would never be repaired."""
+    cells = {(row, 1): title}
+    rule = '-' * (COLUMN_WIDTH * len(headers) + 1)
+    cells[(row + 1, 1)] = rule
+    for i, header in enumerate(headers):
+        cells[(row + 2, 1 + i * COLUMN_WIDTH)] = f'| {header}'
+    cells[(row + 2, 1 + len(headers) * COLUMN_WIDTH)] = '|'
+    cells[(row + 3, 1)] = rule
+    row += 4
+    for values in rows:
+        for i, value in enumerate(values):
+            text = _abbrev(value, VALUE_WIDTH) if isinstance(value, int) else str(value)
+            cells[(row, 1 + i * COLUMN_WIDTH)] = f'| {text[:VALUE_WIDTH]}'
+        cells[(row, 1 + len(values) * COLUMN_WIDTH)] = '|'
+        row += 1
+    cells[(row, 1)] = rule
+    return cells, row + 1
+
+
+def frame_cells(snap: Optional[CounterSnapshot], start: float, tile=0,
+                tile_ids: Optional[Sequence[int]] = None, show_data=True,
+                show_config=False, status='',
+                prev: Optional[CounterSnapshot] = None) -> Cells:
+    tile_id = tile if tile_ids is None else tile_ids[tile]
+    cells = {(0, 0): f'Packet monitoring on {socket.gethostname()} beginning: '
+                     f'{time.strftime("%B %e, %Y at %H:%M:%S", time.localtime(start))}.',
+             (1, 0): f'tile {tile_id}  {status}'}
+    if snap is None:
+        cells[(3, 1)] = 'waiting for the first snapshot...'
+        return cells
+    cells[(1, 40)] = ('last updated: '
+                      f'{time.strftime("%H:%M:%S", time.localtime(snap.time))}'
+                      + ('  (estimated)' if snap.estimated(tile, prev) else ''))
+
+    word_types = snap.word_types[tile].tolist()
+    table, row = table_cells(3, 'Pacman packet counts:', ('Type', 'Count'),
+                             list(zip(WORD_TYPES, word_types)))
+    cells.update(table)
+
+    channels = snap.active_channels(tile).tolist()
+    if show_data:
+        rows = []
+        for chan in channels:
+            total, *rest = snap.data[tile, chan].tolist()
+            rows.append([chan, total] + [_count(value, total) for value in rest])
+        table, row = table_cells(row + 1, 'Data packets per I/O channel:',
+                                 DATA_HEADERS, rows)
+        cells.update(table)
+    if show_config:
+        rows = []
+        for chan in channels:
+            total, *rest = snap.config[tile, chan].tolist()
+            rows.append([chan, total] + [_count(value, total) for value in rest])
+        table, row = table_cells(row + 1, 'Config packets per I/O channel:',
+                                 CONFIG_HEADERS, rows)
+        cells.update(table)
+    return cells
+
+
+class CellRenderer:
+    "Writes only the cells that differ from the previous frame"
+
+    def __init__(self, window):
+        self.window = window
+        self.cells: Cells = {}
+        self.writes = 0
+
+    def _put(self, row: int, col: int, text: str):
+        height, width = self.window.getmaxyx()
+        if row >= height or col >= width - 1:
+            return
+        try:
+            self.window.addstr(row, col, text[:width - 1 - col])
+        except curses.error:
+            pass                # the bottom-right cell cannot be written
+        self.writes += 1
+
+    def render(self, cells: Cells):
+        for key, old in self.cells.items():
+            if key not in cells:
+                self._put(*key, ' ' * len(old))
+        for key, text in cells.items():
+            old = self.cells.get(key)
+            if old != text:
+                self._put(*key, text.ljust(len(old)) if old else text)
+        self.cells = cells
+        self.window.noutrefresh()
+        curses.doupdate()
+
+    def reset(self):
+        "Forget what is on screen, e.g. after a resize"
+        self.window.erase()
+        self.cells = {}
+
+
+class Dashboard:
+    def __init__(self, snapshot: Callable[[], Optional[CounterSnapshot]],
+                 tile_ids: Optional[Sequence[int]] = None, fps=4.,
+                 status: Optional[Callable[[], str]] = None):
+        self.snapshot = snapshot
+        self.tile_ids = tile_ids
+        self.fps = fps
+        self.status = status or (lambda: '')
+        self.start_time = time.time()
+        self.show_data = True
+        self.show_config = False
+        self.tile = 0
+        self._last: Optional[CounterSnapshot] = None
+        self._prev: Optional[CounterSnapshot] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=curses.wrapper, args=(self._run,),
+                                        name='pacmon-dashboard', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def join(self):
+        self._thread.join()
+
+    def stop(self, timeout=2.):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def key(self, ch: int) -> bool:
+        "Handle a keystroke; False means quit"
+        if ch == ord('d'):
+            self.show_data = not self.show_data
+        elif ch == ord('c'):
+            self.show_config = not self.show_config
+        elif ch == ord('t'):
+            num_tiles = len(self.tile_ids) if self.tile_ids else 1
+            self.tile = (self.tile + 1) % num_tiles
+        elif ch == ord('q'):
+            return False
+        return True
+
+    def frame(self) -> Cells:
+        snap = self.snapshot()
+        if snap is not None and (self._last is None or snap.time != self._last.time):
+            self._prev, self._last = self._last, snap
+        return frame_cells(snap, self.start_time, self.tile, self.tile_ids,
+                           self.show_data, self.show_config, self.status(),
+                           self._prev)
+
+    def _run(self, stdscr):
+        curses.curs_set(0)
+        stdscr.nodelay(True)
+        renderer = CellRenderer(stdscr)
+        period = 1. / self.fps
+        next_frame = time.monotonic()
+        while not self._stop.is_set():
+            ch = stdscr.getch()
+            while ch != -1:
+                if ch == curses.KEY_RESIZE:
+                    renderer.reset()
+                elif not self.key(ch):
+                    _thread.interrupt_main()
+                    return
+                ch = stdscr.getch()
+            renderer.render(self.frame())
+            next_frame += period
+            self._stop.wait(max(0., next_frame - time.monotonic()))
+
+
+def attach(name: str):
+    reader = SnapshotReader(name)
+    dashboard = Dashboard(reader.read, tile_ids=range(reader.num_tiles),
+                          status=lambda: f'shared memory {name!r}').start()
+    try:
+        dashboard.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dashboard.stop()
+        reader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PACMAN monitor dashboard')
+    parser.add_argument('--attach', nargs='?', const=SHM_NAME, metavar='NAME',
+                        help='show the snapshots a running monitor publishes '
+                             'to shared memory instead of reading the PACMAN')
+    args = parser.parse_args()
+    if args.attach:
+        attach(args.attach)
+        return
+
+    pacmon = Pacmon(status_port=STATUS_PORT)
+    inst = pacmon.instruments
+
+    def status():
+        msgs, words, _ = inst.rates
+        return (f'{msgs:.0f} msg/s  {words:.0f} words/s  '
+                f'sampling 1/{pacmon.sampler.ratio}')
+
+    dashboard = Dashboard(pacmon.live_snapshot, status=status).start()
+    try:
+        pacmon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dashboard.stop()
+
+
+if __name__ == '__main__':
+    main()
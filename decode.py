@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Vectorized decoding of PACMAN messages. The construct definitions in format.py
+# remain the reference; here we view the same bytes through NumPy structured
+# dtypes so that a whole message is decoded without per-word Python objects.
+
+from dataclasses import dataclass
+
+import numpy as np
+
+HEADER_LEN = 8
+WORD_LEN = 16
+
+# Data/Trig/Sync word timestamps count this clock and roll over at 2**32
+PACMAN_CLOCK_HZ = 10_000_000
+
+# Word type codes (see format.WordType)
+DATA = ord('D')
+TRIG = ord('T')
+SYNC = ord('S')
+PING = ord('P')
+WRITE = ord('W')
+READ = ord('R')
+ERROR = ord('E')
+
+WORD_TYPE_NAMES = {
+    DATA: 'Data',
+    TRIG: 'Trig',
+    SYNC: 'Sync',
+    PING: 'Ping',
+    WRITE: 'Write',
+    READ: 'Read',
+    ERROR: 'Error',
+}
+
+# Msg header: type, timestamp, 1 byte padding, num_words
+HEADER_DTYPE = np.dtype({
+    'names': ['type', 'timestamp', 'num_words'],
+    'formats': ['u1', '<u4', '<u2'],
+    'offsets': [0, 1, 6],
+    'itemsize': HEADER_LEN,
+})
+
+# The Pac* payloads overlap, so the fields below are only meaningful for the
+# word types noted alongside them.
+WORD_DTYPE = np.dtype({
+    'names': ['type',
+              'io_channel', 'data_timestamp', 'packet',  # Data
+              'sub_type', 'clk_source', 'trig_timestamp',  # Trig, Sync
+              'value1', 'value2',  # Write, Read
+              'err'],  # Error
+    'formats': ['u1',
+                'u1', '<u4', '<u8',
+                'u1', 'u1', '<u4',
+                '<u4', '<u4',
+                'u1'],
+    'offsets': [0,
+                1, 2, 8,
+                1, 2, 4,
+                4, 12,
+                1],
+    'itemsize': WORD_LEN,
+})
+
+
+@dataclass
+class DecodedMsg:
+    type: int
+    timestamp: int
+    num_words: int
+    words: np.ndarray           # raw structured view (WORD_DTYPE)
+    word_type: np.ndarray       # uint8 word type codes
+    io_channel: np.ndarray      # uint8, 0 for non-Data words
+    word_timestamp: np.ndarray  # uint32, Data/Trig/Sync timestamps, else 0
+    packet: np.ndarray          # uint64 LArPix packet, 0 for non-Data words
+
+
+def decode_header(raw: bytes) -> np.void:
+    if len(raw) < HEADER_LEN:
+        raise ValueError(f'message too short for header: {len(raw)} bytes')
+    return np.frombuffer(raw, HEADER_DTYPE, count=1)[0]
+
+
+def decode_msg(raw: bytes) -> DecodedMsg:
+    header = decode_header(raw)
+    num_words = int(header['num_words'])
+    if len(raw) < HEADER_LEN + WORD_LEN * num_words:
+        raise ValueError(f'message truncated: header says {num_words} words, '
+                         f'got {len(raw)} bytes')
+
+    words = np.frombuffer(raw, WORD_DTYPE, count=num_words, offset=HEADER_LEN)
+    word_type = words['type']
+    is_data = word_type == DATA
+    is_trig_sync = (word_type == TRIG) | (word_type == SYNC)
+
+    io_channel = np.where(is_data, words['io_channel'], 0).astype(np.uint8)
+    packet = np.where(is_data, words['packet'], 0).astype(np.uint64)
+    word_timestamp = np.where(is_data, words['data_timestamp'],
+                              np.where(is_trig_sync, words['trig_timestamp'], 0))
+    word_timestamp = word_timestamp.astype(np.uint32)
+
+    return DecodedMsg(type=int(header['type']),
+                      timestamp=int(header['timestamp']),
+                      num_words=num_words,
+                      words=words,
+                      word_type=word_type,
+                      io_channel=io_channel,
+                      word_timestamp=word_timestamp,
+                      packet=packet)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+# Filtering dump of PACMAN words from the live data socket or capture files.
+# The filter is a Python-like expression over word fields, compiled once into
+# a function that evaluates it as a NumPy mask over each decoded message, so
+# only matching words are ever formatted.
+#
+#   python dump.py -f 'io_channel == 7 and not parity_ok'
+#   python dump.py --capture a.pmcap -f 'packet_type in (Write, Read) and downstream'
+#   python dump.py -f 'word_type == Sync' --format json
+#
+# Fields: word_type, io_channel, timestamp (word timestamp, clock ticks),
+# msg_timestamp (header, unix seconds) and packet, plus the LArPix fields of
+# Data words: packet_type (reclassified as Data/Error/Write/Read), parity_ok,
+# downstream, chip_id, channel_id, adc, packet_timestamp, register_address and
+# register_data. Conditions on io_channel, packet or a LArPix field are
+# neither true nor false for other word types (like SQL NULL), so
+# 'not parity_ok' matches only Data words while
+# 'io_channel == 7 or word_type == Sync' also matches Sync words.
+# Word types are named Data, Trig, Sync, Ping, Write, Read and Error.
+
+import argparse
+import ast
+import json
+import sys
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import zmq
+
+from counters import PACKET_TYPE_CODES
+from decode import DATA, ERROR, WORD_TYPE_NAMES, DecodedMsg, decode_msg
+import kernels
+from replay import read_captures
+from util import get_data_socket
+
+WORD_FIELDS = {
+    'word_type': lambda msg: msg.word_type,
+    'io_channel': lambda msg: msg.io_channel,
+    'timestamp': lambda msg: msg.word_timestamp,
+    'msg_timestamp': lambda msg: msg.timestamp,
+    'packet': lambda msg: msg.packet,
+}
+PACKET_FIELDS = {
+    'packet_type': lambda p: PACKET_TYPE_CODES[kernels.packet_type(p)],
+    'parity_ok': kernels.parity_ok,
+    'downstream': kernels.downstream,
+    'chip_id': kernels.chip_id,
+    'channel_id': kernels.channel_id,
+    'adc': kernels.adc,
+    'packet_timestamp': kernels.timestamp,
+    'register_address': kernels.register_address,
+    'register_data': kernels.register_data,
+}
+DATA_ONLY = {'io_channel', 'packet'} | PACKET_FIELDS.keys()
+CONSTANTS = {name: code for code, name in WORD_TYPE_NAMES.items()}
+
+Mask = Callable[[DecodedMsg], np.ndarray]
+
+
+class _Fields(dict):
+    "Word field arrays of one message, computed on first use"
+
+    def __init__(self, msg: DecodedMsg):
+        super().__init__()
+        self.msg = msg
+
+    def __missing__(self, name):
+        if name in WORD_FIELDS:
+            value = WORD_FIELDS[name](self.msg)
+        elif name in PACKET_FIELDS:
+            value = PACKET_FIELDS[name](self.msg.packet)
+        elif name == '_is_data':
+            value = self.msg.word_type == DATA
+        else:
+            raise KeyError(name)    # a constant: look it up in the globals
+        self[name] = value
+        return value
+
+
+class _Rewriter(ast.NodeTransformer):
+    """Rewrites a filter into calls of the three-valued logic helpers below
+    and rejects anything that is not a field, a constant, arithmetic or a
+    comparison"""
+
+    ALLOWED = (ast.Expression, ast.Name, ast.Load, ast.Constant, ast.Tuple,
+               ast.List, ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.FloorDiv,
+               ast.Mod, ast.Pow, ast.BitAnd, ast.BitOr, ast.BitXor, ast.LShift,
+               ast.RShift, ast.UnaryOp, ast.USub, ast.Invert)
+    COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+                   ast.In, ast.NotIn)
+
+    def __init__(self):
+        self.names = set()
+
+    @staticmethod
+    def _call(func: str, *args) -> ast.Call:
+        return ast.Call(func=ast.Name(func, ast.Load()), args=list(args),
+                        keywords=[])
+
+    def condition(self, node) -> ast.Call:
+        "Rewrite `node`, used as a condition, into a (true, known) pair"
+        if isinstance(node, ast.BoolOp):
+            func = '_and' if isinstance(node.op, ast.And) else '_or'
+            values = [self.condition(value) for value in node.values]
+            result = values[0]
+            for value in values[1:]:
+                result = self._call(func, result, value)
+            return result
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return self._call('_not', self.condition(node.operand))
+        outer, self.names = self.names, set()
+        value = self.visit(node)
+        data_only = bool(self.names & DATA_ONLY)
+        self.names |= outer
+        known = (ast.Name('_is_data', ast.Load()) if data_only
+                 else ast.Constant(True))
+        return self._call('_leaf', value, known)
+
+    def visit_BoolOp(self, node):
+        raise ValueError('and/or can only combine conditions')
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            raise ValueError('not can only negate a condition')
+        return self.generic_visit(node)
+
+    def visit_Compare(self, node):
+        terms = []
+        left = self.visit(node.left)
+        for op, right in zip(node.ops, node.comparators):
+            if not isinstance(op, self.COMPARISONS):
+                raise ValueError(f'{type(op).__name__} is not allowed in a filter')
+            right = self.visit(right)
+            if isinstance(op, (ast.In, ast.NotIn)):
+                if not isinstance(right, (ast.Tuple, ast.List)):
+                    raise ValueError('`in` needs a literal tuple or list')
+                term = self._call('_isin', left, right)
+                if isinstance(op, ast.NotIn):
+                    term = self._call('_logical_not', term)
+            else:
+                term = ast.Compare(left=left, ops=[op], comparators=[right])
+            terms.append(term)
+            left = right
+        result = terms[0]
+        for term in terms[1:]:
+            result = self._call('_logical_and', result, term)
+        return result
+
+    def visit_Name(self, node):
+        if (node.id not in WORD_FIELDS and node.id not in PACKET_FIELDS
+                and node.id not in CONSTANTS):
+            raise ValueError(f'unknown name {node.id!r} in filter')
+        self.names.add(node.id)
+        return node
+
+    def generic_visit(self, node):
+        if not isinstance(node, self.ALLOWED):
+            raise ValueError(f'{type(node).__name__} is not allowed in a filter')
+        return super().generic_visit(node)
+
+
+# Conditions evaluate to (true, known) masks; `true` is only set where known
+def _leaf(value, known):
+    known = np.asarray(known, dtype=bool)
+    return np.asarray(value, dtype=bool) & known, known
+
+
+def _and(a, b):
+    true = a[0] & b[0]
+    return true, true | (a[1] & ~a[0]) | (b[1] & ~b[0])
+
+
+def _or(a, b):
+    true = a[0] | b[0]
+    return true, true | (a[1] & ~a[0] & b[1] & ~b[0])
+
+
+def _not(a):
+    return a[1] & ~a[0], a[1]
+
+
+_GLOBALS = {'__builtins__': {}, '_leaf': _leaf, '_and': _and, '_or': _or,
+            '_not': _not, '_isin': np.isin, '_logical_and': np.logical_and,
+            '_logical_not': np.logical_not, **CONSTANTS}
+
+
+def compile_filter(expression: str) -> Mask:
+    "A function returning the boolean mask of the words matching `expression`"
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f'bad filter {expression!r}: {e.msg}') from None
+    tree.body = _Rewriter().condition(tree.body)
+    code = compile(ast.fix_missing_locations(tree), '<filter>', 'eval')
+
+    def mask(msg: DecodedMsg) -> np.ndarray:
+        true, _ = eval(code, _GLOBALS, _Fields(msg))
+        return np.broadcast_to(true, msg.num_words)
+    return mask
+
+
+def _packet_fields(packets: np.ndarray) -> Dict[str, List]:
+    return {name: PACKET_FIELDS[name](packets).tolist()
+            for name in ('packet_type', 'parity_ok', 'downstream', 'chip_id',
+                         'channel_id', 'adc', 'packet_timestamp',
+                         'register_address', 'register_data')}
+
+
+def format_words(msg: DecodedMsg, selected: np.ndarray, fmt='line') -> List[str]:
+    "Lines for the words of `msg` at indices `selected`"
+    if fmt == 'hex':
+        return [word.hex(' ') for word in
+                (msg.words[i:i + 1].tobytes() for i in selected.tolist())]
+
+    word_type = msg.word_type[selected].tolist()
+    io_channel = msg.io_channel[selected].tolist()
+    timestamp = msg.word_timestamp[selected].tolist()
+    packets = msg.packet[selected]
+    packet = packets.tolist()
+    fields = _packet_fields(packets)
+    lines = []
+    for k, code in enumerate(word_type):
+        name = WORD_TYPE_NAMES.get(code, chr(code))
+        if fmt == 'json':
+            record = {'msg_timestamp': msg.timestamp, 'word_type': name}
+            if code == DATA:
+                record.update(io_channel=io_channel[k], timestamp=timestamp[k],
+                              packet=f'{packet[k]:016x}')
+                record.update({key: values[k] for key, values in fields.items()})
+                record['packet_type'] = WORD_TYPE_NAMES[record['packet_type']]
+            else:
+                record['timestamp'] = timestamp[k]
+            lines.append(json.dumps(record))
+            continue
+
+        line = f'{msg.timestamp} {name:<5} ts={timestamp[k]}'
+        if code == DATA:
+            packet_type = fields['packet_type'][k]
+            line += (f' io={io_channel[k]} {packet[k]:016x} '
+                     f'{WORD_TYPE_NAMES[packet_type]:<5} chip={fields["chip_id"][k]}')
+            if packet_type == DATA:
+                line += (f' ch={fields["channel_id"][k]} adc={fields["adc"][k]}'
+                         f' t={fields["packet_timestamp"][k]}')
+            elif packet_type != ERROR:
+                line += (f' reg={fields["register_address"][k]}'
+                         f' val={fields["register_data"][k]}')
+            line += (' parity=' + ('ok' if fields['parity_ok'][k] else 'BAD')
+                     + (' ds' if fields['downstream'][k] else ' us'))
+        lines.append(line)
+    return lines
+
+
+def dump(messages: Iterable[memoryview], mask: Optional[Mask] = None,
+         fmt='line', limit: Optional[int] = None, out=sys.stdout) -> Tuple[int, int]:
+    "Write matching words to `out`; returns (messages read, words written)"
+    count = written = 0
+    for raw in messages:
+        count += 1
+        msg = decode_msg(raw)
+        if mask is None:
+            selected = np.arange(msg.num_words)
+        else:
+            selected = np.flatnonzero(mask(msg))
+        if not len(selected):
+            continue
+        if limit is not None:
+            selected = selected[:limit - written]
+        lines = format_words(msg, selected, fmt)
+        out.write('\n'.join(lines) + '\n')
+        written += len(lines)
+        if limit is not None and written >= limit:
+            break
+    return count, written
+
+
+def live_messages(url: str) -> Iterator[memoryview]:
+    socket = get_data_socket(url)
+    while True:
+        try:
+            yield socket.recv(copy=False).buffer
+        except zmq.Again:       # RCVTIMEO
+            continue
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Dump PACMAN words matching a filter',
+        epilog='see the top of dump.py for the filter fields')
+    parser.add_argument('-f', '--filter', help="e.g. 'io_channel == 7 and not parity_ok'")
+    parser.add_argument('--format', choices=('line', 'hex', 'json'), default='line')
+    parser.add_argument('--url', default='tcp://pacman32.local:5556')
+    parser.add_argument('--capture', nargs='+', metavar='PATH',
+                        help='read .pmcap files instead of the live socket')
+    parser.add_argument('--limit', type=int, help='stop after LIMIT words')
+    args = parser.parse_args()
+
+    try:
+        mask = compile_filter(args.filter) if args.filter else None
+    except ValueError as e:
+        parser.error(str(e))
+    messages = ((raw for _, raw in read_captures(args.capture)) if args.capture
+                else live_messages(args.url))
+    try:
+        dump(messages, mask, args.format, args.limit)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
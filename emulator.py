@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# Local PACMAN stand-in. MessageEncoder builds whole messages (header + Word
+# array) directly as NumPy structured arrays; Emulator publishes them on the
+# data port, and optionally the downstream config words as Request messages on
+# the echo port, at a configured word rate.
+
+import argparse
+from dataclasses import dataclass
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+import zmq
+
+from decode import DATA, SYNC, TRIG, HEADER_DTYPE, WORD_DTYPE, PACMAN_CLOCK_HZ
+import kernels
+
+_U64 = np.uint64
+_PARITY_BIT = _U64(1 << 63)
+_DOWNSTREAM_BIT = _U64(1 << 62)
+
+
+@dataclass
+class EmulatorConfig:
+    words_per_s: float = 100_000
+    words_per_msg: int = 1000
+    io_channels: Sequence[int] = tuple(range(1, 33))
+    io_channel_weights: Optional[Sequence[float]] = None
+    # LArPix packet types: data, test/error, config write, config read
+    packet_type_fractions: Sequence[float] = (0.97, 0.01, 0.01, 0.01)
+    parity_error_fraction: float = 0.001
+    downstream_fraction: float = 0.02
+    trig_interval: Optional[float] = None   # seconds between Trig words
+    sync_interval: Optional[float] = 1.     # seconds between Sync words
+    seed: Optional[int] = None
+    # Packets and io_channels are drawn once into a bank of this many words
+    # and messages are cut from it at random offsets, so encoding is little
+    # more than a copy
+    bank_words: int = 1 << 18
+
+
+def _field(values: np.ndarray, lo: int) -> np.ndarray:
+    return values.astype(_U64) << _U64(lo)
+
+
+class MessageEncoder:
+    def __init__(self, config: EmulatorConfig):
+        self.config = config
+        self.rng = np.random.default_rng(config.seed)
+        self.io_channels = np.asarray(config.io_channels, dtype=np.uint8)
+        weights = config.io_channel_weights
+        self.io_channel_p = (None if weights is None
+                             else np.asarray(weights) / np.sum(weights))
+        types = np.asarray(config.packet_type_fractions, dtype=float)
+        self.packet_type_p = types / types.sum()
+        self._next_trig = None
+        self._next_sync = None
+
+        n = config.bank_words
+        self._bank_packets = np.tile(self.packets(n), 2)
+        self._bank_channels = np.tile(self.rng.choice(self.io_channels, size=n,
+                                                      p=self.io_channel_p), 2)
+
+    def packets(self, n: int) -> np.ndarray:
+        "Random LArPix packets with the configured type, direction and parity mix"
+        cfg, rng = self.config, self.rng
+        packet_type = rng.choice(4, size=n, p=self.packet_type_p)
+        packets = (_field(packet_type, 0)
+                   | _field(rng.integers(0, 256, n), 2))          # chip id
+        is_config = packet_type >= 2
+        # data: channel, timestamp, ADC; config: register address and data
+        body = np.where(
+            is_config,
+            _field(rng.integers(0, 256, n), 10) | _field(rng.integers(0, 256, n), 18),
+            _field(rng.integers(0, 64, n), 10)
+            | _field(rng.integers(0, 1 << 31, n), 16)
+            | _field(rng.integers(0, 256, n), 48))
+        packets |= body
+        packets[rng.random(n) < cfg.downstream_fraction] |= _DOWNSTREAM_BIT
+
+        # Odd parity, then corrupt the requested fraction
+        packets[~kernels.parity_ok(packets)] |= _PARITY_BIT
+        packets[rng.random(n) < cfg.parity_error_fraction] ^= _PARITY_BIT
+        return packets
+
+    def words(self, n: int, now: float) -> np.ndarray:
+        cfg = self.config
+        extra = []
+        if cfg.trig_interval and (self._next_trig is None or now >= self._next_trig):
+            extra.append(TRIG)
+            self._next_trig = now + cfg.trig_interval
+        if cfg.sync_interval and (self._next_sync is None or now >= self._next_sync):
+            extra.append(SYNC)
+            self._next_sync = now + cfg.sync_interval
+
+        clock = np.uint32(int(now * PACMAN_CLOCK_HZ) & 0xffffffff)
+        words = np.zeros(n + len(extra), WORD_DTYPE)
+        data = words[:n]
+        data['type'] = DATA
+        data['data_timestamp'] = clock
+        # the banks are stored twice over, so any slice of up to bank_words
+        # is contiguous
+        bank = self.config.bank_words
+        for start in range(0, n, bank):
+            count = min(bank, n - start)
+            offset = int(self.rng.integers(0, bank))
+            chunk = data[start:start + count]
+            chunk['io_channel'] = self._bank_channels[offset:offset + count]
+            chunk['packet'] = self._bank_packets[offset:offset + count]
+        for i, word_type in enumerate(extra):
+            word = words[n + i:n + i + 1]
+            word['type'] = word_type
+            word['sub_type'] = word_type
+            word['trig_timestamp'] = clock
+        return words
+
+    @staticmethod
+    def encode(words: np.ndarray, now: float, msg_type=ord('D')) -> bytes:
+        header = np.zeros(1, HEADER_DTYPE)
+        header['type'] = msg_type
+        header['timestamp'] = int(now) & 0xffffffff
+        header['num_words'] = len(words)
+        return header.tobytes() + words.tobytes()
+
+    def message(self, now: Optional[float] = None) -> bytes:
+        now = time.time() if now is None else now
+        return self.encode(self.words(self.config.words_per_msg, now), now)
+
+
+def echo_message(raw: bytes) -> Optional[bytes]:
+    "Downstream config words of a data message, as a Request on the echo port"
+    words = np.frombuffer(raw, WORD_DTYPE, offset=HEADER_DTYPE.itemsize)
+    packets = words['packet']
+    is_ds_config = ((words['type'] == DATA) & kernels.downstream(packets)
+                    & (kernels.packet_type(packets) >= 2))
+    if not is_ds_config.any():
+        return None
+    header = np.frombuffer(raw, HEADER_DTYPE, count=1)[0]
+    return MessageEncoder.encode(words[is_ds_config], float(header['timestamp']),
+                                 msg_type=ord('?'))
+
+
+class Emulator:
+    def __init__(self, config: EmulatorConfig, data_bind='tcp://*:5556',
+                 echo_bind: Optional[str] = None):
+        self.config = config
+        self.encoder = MessageEncoder(config)
+        self.ctx = zmq.Context()
+        self.data_socket = self.ctx.socket(zmq.PUB)
+        self.data_socket.bind(data_bind)
+        self.echo_socket = None
+        if echo_bind:
+            self.echo_socket = self.ctx.socket(zmq.PUB)
+            self.echo_socket.bind(echo_bind)
+        self.sent_msgs = 0
+        self.sent_words = 0
+
+    def close(self):
+        self.data_socket.close(linger=0)
+        if self.echo_socket:
+            self.echo_socket.close(linger=0)
+        self.ctx.term()
+
+    def send(self, now: Optional[float] = None):
+        raw = self.encoder.message(now)
+        self.data_socket.send(raw, copy=False)
+        if self.echo_socket:
+            echo = echo_message(raw)
+            if echo:
+                self.echo_socket.send(echo, copy=False)
+        self.sent_msgs += 1
+        self.sent_words += (len(raw) - HEADER_DTYPE.itemsize) // WORD_DTYPE.itemsize
+
+    def run(self, duration: Optional[float] = None):
+        msgs_per_s = self.config.words_per_s / self.config.words_per_msg
+        start = time.monotonic()
+        sent = 0
+        while duration is None or time.monotonic() - start < duration:
+            due = int((time.monotonic() - start) * msgs_per_s) + 1
+            if sent >= due:
+                time.sleep(max(0., min(0.01, (sent + 1) / msgs_per_s
+                                       - (time.monotonic() - start))))
+                continue
+            for _ in range(due - sent):
+                self.send()
+            sent = due
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulate a PACMAN data stream')
+    parser.add_argument('--data-bind', default='tcp://*:5556')
+    parser.add_argument('--echo-bind', help='e.g. tcp://*:5554')
+    parser.add_argument('--words-per-s', type=float, default=100_000)
+    parser.add_argument('--words-per-msg', type=int, default=1000)
+    parser.add_argument('--io-channels', type=int, nargs='+',
+                        default=list(range(1, 33)))
+    parser.add_argument('--io-channel-weights', type=float, nargs='+')
+    parser.add_argument('--packet-types', type=float, nargs=4,
+                        default=(0.97, 0.01, 0.01, 0.01),
+                        metavar=('DATA', 'TEST', 'WRITE', 'READ'))
+    parser.add_argument('--parity-errors', type=float, default=0.001,
+                        help='fraction of packets with bad parity')
+    parser.add_argument('--downstream', type=float, default=0.02,
+                        help='fraction of downstream packets')
+    parser.add_argument('--trig-interval', type=float)
+    parser.add_argument('--sync-interval', type=float, default=1.)
+    parser.add_argument('--duration', type=float)
+    args = parser.parse_args()
+
+    config = EmulatorConfig(words_per_s=args.words_per_s,
+                            words_per_msg=args.words_per_msg,
+                            io_channels=args.io_channels,
+                            io_channel_weights=args.io_channel_weights,
+                            packet_type_fractions=args.packet_types,
+                            parity_error_fraction=args.parity_errors,
+                            downstream_fraction=args.downstream,
+                            trig_interval=args.trig_interval,
+                            sync_interval=args.sync_interval)
+    emulator = Emulator(config, args.data_bind, args.echo_bind)
+    try:
+        emulator.run(args.duration)
+    finally:
+        print(f'sent {emulator.sent_msgs} messages, {emulator.sent_words} words')
+        emulator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+# Columnar export of decoded words for offline analysis. Words from capture
+# files or the live data socket are decoded in bulk and appended to a
+# preallocated, fixed-size column batch; each full batch becomes one Arrow
+# record batch (one Parquet row group), so memory stays bounded however much
+# is exported. Output is rotated into files of at most `file_rows` rows.
+#
+#   python export.py OUT_DIR --capture a.pmcap b.pmcap     from captures
+#   python export.py OUT_DIR --url tcp://pacman32.local:5556
+#
+# Writing needs pyarrow; building the column batches does not.
+
+import argparse
+import os
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import zmq
+
+from decode import DATA, DecodedMsg, decode_msg
+import kernels
+from replay import read_captures
+from util import get_data_socket
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:             # optional: only needed to write files
+    pa = pq = None
+
+# name -> dtype. word_type is the PACMAN word type code (ord('D') etc);
+# packet_type, parity_ok and downstream are only meaningful for Data words
+COLUMNS = (
+    ('recv_ns', np.int64),          # receive time, ns since the epoch
+    ('msg', np.uint64),             # message number within the export
+    ('msg_timestamp', np.uint32),   # PACMAN header timestamp, seconds
+    ('word_type', np.uint8),
+    ('io_channel', np.uint8),
+    ('word_timestamp', np.uint32),
+    ('packet', np.uint64),          # raw LArPix packet
+    ('packet_type', np.uint8),
+    ('parity_ok', np.bool_),
+    ('downstream', np.bool_),
+)
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+Batch = Dict[str, np.ndarray]
+
+
+def word_columns(msg: DecodedMsg, recv_ns: int, msg_number: int) -> Batch:
+    "One row per word of `msg`"
+    n = msg.num_words
+    is_data = msg.word_type == DATA
+    packet = msg.packet
+    return {'recv_ns': np.full(n, recv_ns, dtype=np.int64),
+            'msg': np.full(n, msg_number, dtype=np.uint64),
+            'msg_timestamp': np.full(n, msg.timestamp, dtype=np.uint32),
+            'word_type': msg.word_type,
+            'io_channel': msg.io_channel,
+            'word_timestamp': msg.word_timestamp,
+            'packet': packet,
+            'packet_type': np.where(is_data, kernels.packet_type(packet), 0),
+            'parity_ok': is_data & kernels.parity_ok(packet),
+            'downstream': is_data & kernels.downstream(packet)}
+
+
+class ColumnBatcher:
+    """Appends word columns into preallocated arrays of `batch_rows` rows and
+    passes each full batch to `emit`. The arrays are reused, so `emit` must
+    be done with a batch before it returns."""
+
+    def __init__(self, emit: Callable[[Batch], None], batch_rows=1 << 16):
+        self.emit = emit
+        self.batch_rows = batch_rows
+        self.columns = {name: np.empty(batch_rows, dtype=dtype)
+                        for name, dtype in COLUMNS}
+        self.rows = 0
+        self.messages = 0
+
+    def add(self, msg: DecodedMsg, recv_ns: int):
+        if msg.num_words:
+            words = word_columns(msg, recv_ns, self.messages)
+            start, n = 0, msg.num_words
+            while start < n:
+                take = min(n - start, self.batch_rows - self.rows)
+                for name, column in self.columns.items():
+                    column[self.rows:self.rows + take] = words[name][start:start + take]
+                self.rows += take
+                start += take
+                if self.rows == self.batch_rows:
+                    self.flush()
+        self.messages += 1
+
+    def flush(self):
+        if self.rows:
+            self.emit({name: column[:self.rows]
+                       for name, column in self.columns.items()})
+            self.rows = 0
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('writing Arrow/Parquet files needs pyarrow '
+                          '(pip install pyarrow)')
+
+
+def arrow_schema():
+    _require_pyarrow()
+    return pa.schema([(name, pa.from_numpy_dtype(np.dtype(dtype)))
+                      for name, dtype in COLUMNS])
+
+
+class ColumnFileWriter:
+    """Writes batches to OUT_DIR/<prefix>-<time>-<seq>.parquet (or .arrow, an
+    Arrow IPC file), starting a new file after `file_rows` rows"""
+
+    def __init__(self, directory: str, prefix='words', fmt='parquet',
+                 compression='zstd', file_rows=1 << 26):
+        _require_pyarrow()
+        if fmt not in FORMATS:
+            raise ValueError(f'unknown format {fmt!r}, expected one of {list(FORMATS)}')
+        self.directory = directory
+        self.prefix = prefix
+        self.fmt = fmt
+        self.compression = compression
+        self.file_rows = file_rows
+        self.schema = arrow_schema()
+        os.makedirs(directory, exist_ok=True)
+        self.paths = []
+        self.rows = 0
+        self._writer = None
+        self._file_rows = 0
+
+    def _open_file(self):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        seq = len(self.paths)
+        path = os.path.join(self.directory,
+                            f'{self.prefix}-{stamp}-{seq:04d}{FORMATS[self.fmt]}')
+        if self.fmt == 'parquet':
+            self._writer = pq.ParquetWriter(path, self.schema,
+                                            compression=self.compression)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=self.compression)
+            self._writer = pa.ipc.new_file(path, self.schema, options=options)
+        self._file_rows = 0
+        self.paths.append(path)
+
+    def write(self, batch: Batch):
+        if self._writer is None or self._file_rows >= self.file_rows:
+            self._close_file()
+            self._open_file()
+        # numeric columns are wrapped without a copy; the writer is done
+        # with them once write_batch returns
+        record_batch = pa.RecordBatch.from_arrays(
+            [pa.array(batch[name]) for name in self.schema.names],
+            schema=self.schema)
+        self._writer.write_batch(record_batch)
+        n = len(batch['msg'])
+        self._file_rows += n
+        self.rows += n
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def close(self):
+        self._close_file()
+
+
+def export(messages: Iterable[Tuple[int, memoryview]], writer: ColumnFileWriter,
+           batch_rows=1 << 16) -> int:
+    "Export (recv_ns, raw) messages; returns the number of messages"
+    batcher = ColumnBatcher(writer.write, batch_rows)
+    try:
+        for recv_ns, raw in messages:
+            batcher.add(decode_msg(raw), recv_ns)
+    finally:
+        batcher.flush()
+        writer.close()
+    return batcher.messages
+
+
+def live_messages(url: str, duration: Optional[float] = None
+                  ) -> Iterable[Tuple[int, memoryview]]:
+    socket = get_data_socket(url)
+    stop = None if duration is None else time.monotonic() + duration
+    while stop is None or time.monotonic() < stop:
+        try:
+            frame = socket.recv(copy=False)
+        except zmq.Again:       # RCVTIMEO
+            continue
+        yield time.time_ns(), frame.buffer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export decoded PACMAN words '
+                                                 'to Parquet or Arrow files')
+    parser.add_argument('directory')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--capture', nargs='+', metavar='PATH',
+                        help='.pmcap files, in order')
+    source.add_argument('--url', help='live data socket, e.g. '
+                                      'tcp://pacman32.local:5556')
+    parser.add_argument('--duration', type=float,
+                        help='stop a live export after DURATION seconds')
+    parser.add_argument('--format', choices=list(FORMATS), default='parquet')
+    parser.add_argument('--compression', default='zstd')
+    parser.add_argument('--prefix', default='words')
+    parser.add_argument('--batch-rows', type=int, default=1 << 16)
+    parser.add_argument('--file-rows', type=int, default=1 << 26)
+    args = parser.parse_args()
+
+    writer = ColumnFileWriter(args.directory, args.prefix, args.format,
+                              args.compression, args.file_rows)
+    messages = (read_captures(args.capture) if args.capture
+                else live_messages(args.url, args.duration))
+    try:
+        count = export(messages, writer, args.batch_rows)
+    except KeyboardInterrupt:
+        count = None
+    print(f'exported {writer.rows} words'
+          + (f' from {count} messages' if count is not None else '')
+          + f' to {len(writer.paths)} file(s)')
+
+
+if __name__ == '__main__':
+    main()
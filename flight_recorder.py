@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# Flight recorder: the most recent raw messages kept in a preallocated byte
+# ring, bounded by bytes and by age, so that when something goes wrong the
+# traffic around it can be written out as a capture file (see capture.py)
+# and replayed. Messages are copied into the ring back to back and wrap to
+# its start when they no longer fit; a parallel ring of (receive time,
+# offset, length) records says where each one is. Nothing is allocated per
+# message. The record ring holds `max_messages` (by default one per
+# MEAN_MSG_BYTES of buffer); when messages are smaller than that on average
+# it, rather than the buffer, limits what is kept.
+#
+# A trigger (bad parity, Error words, timestamp gaps, a signal or an HTTP
+# poke) starts a post-trigger window; when it ends the ring is frozen and
+# everything from `seconds` before the trigger to the end of the window is
+# written by a background thread, after which recording resumes. A manual
+# trigger that arrives meanwhile is held and starts the next dump; automatic
+# ones are counted as suppressed, as are those within the cooldown. Only the
+# newest `max_dumps` dumps are kept in the directory.
+
+import glob
+import os
+import signal
+import threading
+from typing import Optional
+
+import numpy as np
+
+from capture import DATA_SUFFIX, INDEX_SUFFIX, CaptureWriter
+
+MEAN_MSG_BYTES = 128            # a header and 7.5 words
+
+
+class FlightRecorder:
+    def __init__(self, directory: str, capacity_bytes=32 << 20, seconds=10.,
+                 post_seconds=2., cooldown=60., parity_threshold=0.05,
+                 min_words=100, error_threshold=1000, gap_trigger=True,
+                 max_dumps=20, max_messages: Optional[int] = None):
+        if capacity_bytes >= 1 << 32:
+            raise ValueError('capacity_bytes must be below 4 GiB')
+        self.directory = directory
+        self.capacity = capacity_bytes
+        self.seconds = seconds
+        self.post_seconds = post_seconds
+        self.cooldown = cooldown
+        self.parity_threshold = parity_threshold
+        self.min_words = min_words
+        self.error_threshold = error_threshold     # 0 disables
+        self.gap_trigger = gap_trigger
+        self.max_dumps = max_dumps
+
+        self.buf = bytearray(capacity_bytes)
+        self._view = memoryview(self.buf)
+        if max_messages is None:
+            max_messages = max(capacity_bytes // MEAN_MSG_BYTES, 1)
+        self.recv_ns = np.zeros(max_messages, dtype=np.int64)
+        # the buffer is indexed with 32 bits
+        self.offset = np.zeros(max_messages, dtype=np.uint32)
+        self.length = np.zeros(max_messages, dtype=np.uint32)
+        self.first = 0              # oldest record
+        self.count = 0              # records held
+        self.bytes = 0              # ... and their total length
+        self.pos = 0                # where the next message goes
+
+        self.frozen = False
+        self.recorded = 0
+        self.skipped = 0            # arrived while a dump was being written
+        self.suppressed = 0         # automatic triggers not acted on
+        self.too_big = 0
+        self.dumps = 0
+        self.last_path: Optional[str] = None
+        self.pending = None         # (reason, trigger time, dump time)
+        self._requested: Optional[str] = None
+        self._last_trigger = None
+        self._prev_errors = None
+        self._prev_gaps = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _drop_oldest(self):
+        self.bytes -= int(self.length[self.first])
+        self.first = (self.first + 1) % len(self.recv_ns)
+        self.count -= 1
+
+    def record(self, raw, now: float):
+        if self.pending is not None and now >= self.pending[2]:
+            self._dump()
+        if self.frozen:
+            self.skipped += 1
+            return
+        n = len(raw)
+        if n > self.capacity:
+            self.too_big += 1
+            return
+        if self.pos + n > self.capacity:
+            # the tail end of the buffer only holds messages older than any
+            # at its start
+            while self.count and self.offset[self.first] >= self.pos:
+                self._drop_oldest()
+            self.pos = 0
+        end = self.pos + n
+        size = len(self.recv_ns)
+        while self.count and (self.count == size
+                              or self.pos <= self.offset[self.first] < end):
+            self._drop_oldest()
+        # keep what precedes a pending trigger until it is written
+        start = now if self.pending is None else min(now, self.pending[1])
+        limit = int((start - self.seconds) * 1e9)
+        while self.count and self.recv_ns[self.first] < limit:
+            self._drop_oldest()
+
+        self._view[self.pos:end] = raw
+        k = (self.first + self.count) % size
+        self.recv_ns[k] = int(now * 1e9)
+        self.offset[k] = self.pos
+        self.length[k] = n
+        self.count += 1
+        self.bytes += n
+        self.pos = end
+        self.recorded += 1
+
+    def trigger(self, reason: str):
+        "Request a dump; safe to call from other threads and signal handlers"
+        self._requested = reason
+
+    def check(self, now: float, invalid_parity: Optional[np.ndarray] = None,
+              words: Optional[np.ndarray] = None, errors: Optional[int] = None,
+              gaps: Optional[int] = None) -> Optional[str]:
+        """Evaluate the triggers once per interval: `invalid_parity` and
+        `words` are per-channel fractions and Data word counts over the last
+        interval, `errors` and `gaps` running totals. Returns the reason of a
+        trigger that started a post-trigger window. Automatic triggers are
+        ignored while a dump is pending or being written and within
+        `cooldown` seconds of the previous one; trigger() is not, and waits
+        for the current dump instead."""
+        reason, self._requested = self._requested, None
+        manual = reason is not None
+        if reason is None and invalid_parity is not None and words is not None:
+            bad = (words >= self.min_words) & (invalid_parity > self.parity_threshold)
+            if bad.any():
+                reason = 'parity'
+        if errors is not None:
+            if (reason is None and self.error_threshold and self._prev_errors is not None
+                    and errors - self._prev_errors >= self.error_threshold):
+                reason = 'errors'
+            self._prev_errors = errors
+        if gaps is not None:
+            if (reason is None and self.gap_trigger and self._prev_gaps is not None
+                    and gaps > self._prev_gaps):
+                reason = 'gaps'
+            self._prev_gaps = gaps
+
+        if self.pending is not None and now >= self.pending[2]:
+            self._dump()
+        if reason is None:
+            return None
+        if self.pending is not None or self.frozen:
+            if manual:
+                if self._requested is None:
+                    self._requested = reason
+            else:
+                self.suppressed += 1
+            return None
+        if (not manual and self._last_trigger is not None
+                and now - self._last_trigger < self.cooldown):
+            self.suppressed += 1
+            return None
+        self._last_trigger = now
+        self.pending = (reason, now, now + self.post_seconds)
+        return reason
+
+    def _messages(self, start_ns: int):
+        size = len(self.recv_ns)
+        for i in range(self.count):
+            k = (self.first + i) % size
+            if self.recv_ns[k] >= start_ns:
+                offset = int(self.offset[k])
+                yield int(self.recv_ns[k]), self._view[offset:offset + int(self.length[k])]
+
+    def _dump(self):
+        reason, t, _ = self.pending
+        self.pending = None
+        self.frozen = True
+        writer = CaptureWriter(self.directory, prefix=f'trigger-{reason}')
+        start_ns = int((t - self.seconds) * 1e9)
+
+        def write():
+            try:
+                for recv_ns, raw in self._messages(start_ns):
+                    writer.write(raw, recv_ns)
+                writer.close()
+                self.last_path = writer.paths[-1] if writer.paths else None
+                self.dumps += 1
+                self._prune()
+                print(f'flight recorder ({reason}): wrote {self.last_path}')
+            finally:
+                self.frozen = False
+
+        self._thread = threading.Thread(target=write, name='pacmon-recorder',
+                                        daemon=True)
+        self._thread.start()
+
+    def _prune(self):
+        "Delete all but the newest `max_dumps` dumps"
+        paths = sorted(glob.glob(os.path.join(self.directory, f'trigger-*{DATA_SUFFIX}')),
+                       key=os.path.getmtime)
+        for path in paths[:max(len(paths) - self.max_dumps, 0)]:
+            for name in (path, path[:-len(DATA_SUFFIX)] + INDEX_SUFFIX):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+
+    def flush(self):
+        "Write a pending dump now, e.g. on shutdown, and wait for it"
+        if self.pending is not None:
+            self._dump()
+        self.wait()
+
+    def wait(self, timeout: Optional[float] = None):
+        "Wait for a dump in progress to be written"
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats_line(self, ts: int) -> str:
+        return (f'flight_recorder messages={self.count}i,bytes={self.bytes}i,'
+                f'recorded={self.recorded}i,skipped={self.skipped}i,'
+                f'dumps={self.dumps}i,suppressed={self.suppressed}i,'
+                f'frozen={str(self.frozen).lower()},'
+                f'pending={str(self.pending is not None).lower()} {ts}')
+
+
+def install_trigger_signal(recorder: FlightRecorder, signum=signal.SIGUSR2):
+    "`kill -USR2 <pid>` triggers a dump. Must be called from the main thread."
+    signal.signal(signum, lambda signum, frame: recorder.trigger('signal'))
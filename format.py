@@ -18,13 +18,16 @@ PacData = Struct(
 PacTrig = Struct(
     'type' / Byte,
     Padding(2),
-    'timestamp' / Int32ul
+    'timestamp' / Int32ul,
+    Padding(8)
 )
 
 PacSync = Struct(
     'type' / Byte,
     'clk_source' / Byte,
-    'timestamp' / Int32ul
+    Padding(1),
+    'timestamp' / Int32ul,
+    Padding(8)
 )
 
 PacPing = Struct(
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+# Background InfluxDB writer. The receive loop hands over counter snapshots
+# through a bounded queue; a worker thread serializes each snapshot into a
+# single line-protocol batch and sends it in one request. Batches that fail
+# are spilled to an optional on-disk Spool and backfilled, rate-limited, in
+# the gaps between live writes once Influx accepts writes again.
+
+from dataclasses import dataclass
+import queue
+import threading
+import time
+from typing import List, Optional, Sequence
+
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+from counters import CounterSnapshot, DATA_FIELDS, CONFIG_FIELDS, INGEST_FIELDS
+from counters import WORD_TYPES
+from spool import Backfill, Spool
+
+
+def _fields(names, values) -> str:
+    return ','.join(f'{name}={value}i' for name, value in zip(names, values))
+
+
+def snapshot_lines(snap: CounterSnapshot,
+                   tile_ids: Optional[Sequence[int]] = None,
+                   prev: Optional[CounterSnapshot] = None) -> List[str]:
+    """Line protocol for every measurement in a snapshot, stamped with
+    snap.time; `prev` is the snapshot written before it"""
+    ts = int(snap.time * 1e9)
+    if tile_ids is None:
+        tile_ids = range(len(snap.word_types))
+
+    lines = []
+    for tile, tile_id in enumerate(tile_ids):
+        fields = _fields(WORD_TYPES, snap.word_types[tile].tolist())
+        lines.append(f'word_types,tile_id={tile_id} {fields} {ts}')
+        fields = _fields(INGEST_FIELDS, snap.ingest[tile].tolist())
+        lines.append(f'ingest,tile_id={tile_id} {fields} {ts}')
+
+        # whether sampling kicked in since the previous snapshot
+        estimated = f'estimated={str(snap.estimated(tile, prev)).lower()}'
+        for chan in snap.active_channels(tile).tolist():
+            tags = f'io_channel={chan},tile_id={tile_id}'
+            fields = _fields(DATA_FIELDS, snap.data[tile, chan].tolist())
+            lines.append(f'data_statuses,{tags} {fields},{estimated} {ts}')
+            fields = _fields(CONFIG_FIELDS, snap.config[tile, chan].tolist())
+            lines.append(f'config_statuses,{tags} {fields},{estimated} {ts}')
+    return lines
+
+
+@dataclass
+class WriterStats:
+    submitted: int = 0
+    dropped: int = 0            # snapshots discarded because the queue was full
+    skipped: int = 0            # evict=False batches not queued because it was full
+    written: int = 0
+    failed: int = 0
+    lines: int = 0
+    last_latency: float = 0.    # seconds, serialize + send
+    max_latency: float = 0.
+    queue_depth: int = 0
+    spooled_lines: int = 0
+    backfilled_lines: int = 0
+    spool_bytes: int = 0
+
+
+class InfluxWriter:
+    def __init__(self, url: str, token: str, org: str, bucket: str,
+                 tile_ids: Optional[Sequence[int]] = None,
+                 max_queue=8, timeout_ms=5000,
+                 spool: Optional[Spool] = None, backfill_lines_per_s=50_000):
+        self.org = org
+        self.bucket = bucket
+        self.tile_ids = tile_ids
+        self.client = InfluxDBClient(url=url, token=token, org=org,
+                                     timeout=timeout_ms)
+        self.api = self.client.write_api(write_options=SYNCHRONOUS)
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = WriterStats()
+        self.last_error: Optional[Exception] = None
+
+        self.spool = spool
+        self.backfill = (Backfill(spool, self.write_lines,
+                                  max_lines_per_s=backfill_lines_per_s)
+                         if spool is not None else None)
+        self.healthy = True     # whether the last write succeeded
+        self._prev_snap: Optional[CounterSnapshot] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='influx-writer',
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.):
+        self._stop.set()
+        self._thread.join(timeout)
+        self.client.close()
+        if self.spool is not None:
+            self.spool.close()
+
+    def submit(self, snap: Optional[CounterSnapshot],
+               extra_lines: Sequence[str] = (), block=False, evict=True) -> bool:
+        """Unless `block` is set (for replays, where every snapshot matters),
+        never blocks; when the queue is full the oldest snapshot is dropped,
+        or with evict=False (for batches less important than any queued one,
+        like heartbeats) this one is skipped. `extra_lines` are sent in the
+        same batch as the snapshot; with snap=None they are sent on their own.
+        Returns whether the batch was queued."""
+        self.stats.submitted += 1
+        if block:
+            self.queue.put((snap, extra_lines))
+            return True
+        while True:
+            try:
+                self.queue.put_nowait((snap, extra_lines))
+                return True
+            except queue.Full:
+                if not evict:
+                    self.stats.skipped += 1
+                    return False
+                try:
+                    self.queue.get_nowait()
+                    self.stats.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def stats_line(self, ts: int) -> str:
+        s = self.stats
+        s.queue_depth = self.queue.qsize()
+        fields = ','.join([f'queue_depth={s.queue_depth}i',
+                           f'submitted={s.submitted}i',
+                           f'dropped={s.dropped}i',
+                           f'skipped={s.skipped}i',
+                           f'written={s.written}i',
+                           f'failed={s.failed}i',
+                           f'last_latency={s.last_latency}',
+                           f'max_latency={s.max_latency}',
+                           f'spooled_lines={s.spooled_lines}i',
+                           f'backfilled_lines={s.backfilled_lines}i',
+                           f'spool_bytes={s.spool_bytes}i'])
+        return f'influx_writer {fields} {ts}'
+
+    def write_lines(self, lines: List[str]):
+        self.api.write(bucket=self.bucket, org=self.org, record='\n'.join(lines),
+                       write_precision=WritePrecision.NS)
+
+    def _run(self):
+        while not (self._stop.is_set() and self.queue.empty()):
+            backfilling = (self.healthy and self.backfill is not None
+                           and self.backfill.pending)
+            timeout = 0.01 if backfilling else 0.1
+            try:
+                snap, extra_lines = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                # Live snapshots always go first; backfill only when idle
+                if backfilling:
+                    self._backfill_step()
+                continue
+            self._write_snapshot(snap, extra_lines)
+
+    def _write_snapshot(self, snap: Optional[CounterSnapshot],
+                        extra_lines: Sequence[str]):
+        start = time.perf_counter()
+        lines = []
+        if snap is not None:
+            lines = snapshot_lines(snap, self.tile_ids, self._prev_snap)
+            self._prev_snap = snap
+        lines.extend(extra_lines)
+        if snap is not None:
+            lines.append(self.stats_line(int(snap.time * 1e9)))
+        try:
+            self.write_lines(lines)
+        except Exception as err: # pylint: disable=broad-except
+            self._failed(err)
+            if self.spool is not None:
+                self.spool.append(lines)
+                self.stats.spooled_lines += len(lines)
+                self.stats.spool_bytes = self.spool.size_bytes
+            return
+        latency = time.perf_counter() - start
+
+        self.healthy = True
+        self.stats.written += 1
+        self.stats.lines += len(lines)
+        self.stats.last_latency = latency
+        self.stats.max_latency = max(self.stats.max_latency, latency)
+
+    def _backfill_step(self):
+        try:
+            self.stats.backfilled_lines += self.backfill.step()
+        except Exception as err: # pylint: disable=broad-except
+            self._failed(err)
+        self.stats.spool_bytes = self.spool.size_bytes
+
+    def _failed(self, err: Exception):
+        self.healthy = False
+        self.stats.failed += 1
+        self.last_error = err
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# Self-instrumentation for the monitor: per-stage timing histograms, ingest
+# rates and the lag between the PACMAN header timestamp and receive time,
+# exported as Influx lines and as plain text over a local HTTP endpoint. A
+# signal handler samples the main thread's stack for a few seconds and dumps
+# the collapsed stacks (flamegraph input) without restarting the process.
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+NUM_BUCKETS = 64                # bucket k holds values in [2**(k-1), 2**k)
+
+
+class Histogram:
+    """Log2-bucketed histogram of non-negative integers (nanoseconds). add()
+    is a handful of integer operations, cheap enough for every message."""
+
+    def __init__(self):
+        self.buckets = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value: int):
+        value = max(value, 0)
+        self.buckets[min(value.bit_length(), NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float, since: Optional[Sequence[int]] = None) -> int:
+        """Upper bound of the bucket holding quantile q, over all values or
+        those added after the bucket counts in `since` were taken"""
+        buckets = self.buckets
+        if since is not None:
+            buckets = [now - then for now, then in zip(buckets, since)]
+        count = sum(buckets)
+        if not count:
+            return 0
+        rank, seen = q * count, 0
+        for k, n in enumerate(buckets):
+            seen += n
+            if seen >= rank and n:
+                return (1 << k) - 1
+        return self.max
+
+
+STAGES = ('wait', 'recv', 'record', 'scan', 'parse', 'count', 'occupancy',
+          'timing', 'roundtrip', 'mirror', 'submit', 'flush')
+
+
+class Instruments:
+    """Stage histograms and ingest totals for one Pacmon. Each histogram has a
+    single writer thread; readers only take copies."""
+
+    def __init__(self, stages: Sequence[str] = STAGES):
+        self.stages: Dict[str, Histogram] = {name: Histogram() for name in stages}
+        self.lag = Histogram()          # receive time - header timestamp, ns
+        self.last_lag = 0.              # seconds, may be negative
+        self.messages = 0
+        self.words = 0
+        self.bytes = 0
+        self.start = time.time()
+        self._prev_time = None
+        self._prev_totals = (0, 0, 0)
+        self._prev_buckets = {name: list(h.buckets) for name, h in self.stages.items()}
+        self.rates = (0., 0., 0.)       # messages, words, bytes per second
+
+    def message(self, num_words: int, num_bytes: int, lag: float):
+        self.messages += 1
+        self.words += num_words
+        self.bytes += num_bytes
+        self.last_lag = lag
+        self.lag.add(int(lag * 1e9))
+
+    def update_rates(self, t: Optional[float] = None):
+        "Rates since the previous call, and interval quantiles from here on"
+        t = time.time() if t is None else t
+        totals = (self.messages, self.words, self.bytes)
+        if self._prev_time is not None and t > self._prev_time:
+            dt = t - self._prev_time
+            self.rates = tuple((now - then) / dt
+                               for now, then in zip(totals, self._prev_totals))
+        self._prev_time, self._prev_totals = t, totals
+
+    def stage_summary(self, name: str) -> Dict[str, int]:
+        h = self.stages[name]
+        since = self._prev_buckets[name]
+        return {'count': h.count, 'total_ns': h.total, 'max_ns': h.max,
+                'p50_ns': h.quantile(0.5, since), 'p99_ns': h.quantile(0.99, since)}
+
+    def lines(self, ts: int) -> List[str]:
+        "pacmon_stage and pacmon_health measurements; starts a new interval"
+        self.update_rates(ts / 1e9)
+        lines = []
+        for name, h in self.stages.items():
+            if not h.count:
+                continue
+            fields = ','.join(f'{key}={value}i'
+                              for key, value in self.stage_summary(name).items())
+            lines.append(f'pacmon_stage,stage={name} {fields} {ts}')
+            self._prev_buckets[name] = list(h.buckets)
+        msgs, words, nbytes = self.rates
+        lines.append(f'pacmon_health messages={self.messages}i,words={self.words}i,'
+                     f'bytes={self.bytes}i,messages_per_s={msgs},words_per_s={words},'
+                     f'bytes_per_s={nbytes},lag={self.last_lag},'
+                     f'max_lag_ns={self.lag.max}i {ts}')
+        return lines
+
+    def text(self) -> str:
+        "Human-readable status for the HTTP endpoint"
+        msgs, words, nbytes = self.rates
+        out = [f'uptime_s {time.time() - self.start:.0f}',
+               f'messages {self.messages}',
+               f'words {self.words}',
+               f'bytes {self.bytes}',
+               f'messages_per_s {msgs:.1f}',
+               f'words_per_s {words:.1f}',
+               f'bytes_per_s {nbytes:.1f}',
+               f'lag_s {self.last_lag:.3f}',
+               f'lag_max_s {self.lag.max / 1e9:.3f}']
+        for name, h in self.stages.items():
+            if not h.count:
+                continue
+            summary = self.stage_summary(name)
+            out.append(f'stage {name} ' + ' '.join(f'{key}={value}'
+                                                   for key, value in summary.items()))
+        return '\n'.join(out) + '\n'
+
+
+class StatusServer:
+    """Serves Instruments.text() on http://host:port/ from a daemon thread.
+    A POST to a path in `actions` calls it and returns the text it returns."""
+
+    def __init__(self, instruments: Instruments, port: int, host='127.0.0.1',
+                 actions: Optional[Dict[str, Callable[[], str]]] = None):
+        actions = actions or {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code: int, text: str):
+                body = text.encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._reply(200, instruments.text())
+
+            def do_POST(self):
+                action = actions.get(self.path)
+                if action is None:
+                    self._reply(404, f'no action {self.path}\n')
+                else:
+                    self._reply(200, action())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name='pacmon-status', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def sample_stacks(thread_id: int, duration: float, interval=0.001) -> Counter:
+    "Collapsed stacks ('outer;...;inner' -> samples) of one thread"
+    stacks = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id) # pylint: disable=protected-access
+        if frame is None:
+            break
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        stacks[';'.join(reversed(names))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def install_profile_signal(directory: str, signum=signal.SIGUSR1, duration=5.,
+                           interval=0.001):
+    """On `signum`, sample the calling (main) thread for `duration` seconds
+    and write the collapsed stacks to pacmon-profile-<pid>-<time>.txt in
+    `directory`. Must be called from the main thread."""
+    target = threading.get_ident()
+    busy = threading.Lock()
+
+    def profile():
+        try:
+            stacks = sample_stacks(target, duration, interval)
+            path = os.path.join(directory, f'pacmon-profile-{os.getpid()}-'
+                                           f'{time.strftime("%Y%m%d-%H%M%S")}.txt')
+            with open(path, 'w') as f:
+                for stack, samples in stacks.most_common():
+                    f.write(f'{stack} {samples}\n')
+            print(f'wrote profile to {path}')
+        finally:
+            busy.release()
+
+    def handler(signum, frame):
+        if busy.acquire(blocking=False):
+            threading.Thread(target=profile, name='pacmon-profile',
+                             daemon=True).start()
+
+    signal.signal(signum, handler)
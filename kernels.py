@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Bulk bitfield and parity kernels for LArPix (v2) packets held in uint64
+# arrays, as returned by decode.decode_msg. Bit 0 of the packet is the LSB of
+# the first byte on the wire:
+#
+#   [0:2]   packet type (0 data, 1 test/error, 2 config write, 3 config read)
+#   [2:10]  chip id
+#   [10:16] channel id              (data)
+#   [16:47] timestamp               (data)
+#   [48:56] ADC dataword            (data)
+#   [10:18] register address        (config)
+#   [18:26] register data           (config)
+#   [62]    downstream marker
+#   [63]    odd parity over all 64 bits
+
+from dataclasses import dataclass
+
+import numpy as np
+
+# Parity of each byte value
+PARITY8 = np.array([bin(i).count('1') & 1 for i in range(256)], dtype=np.uint8)
+
+_U64 = np.uint64
+
+
+def _bits(packets: np.ndarray, lo: int, width: int) -> np.ndarray:
+    return (packets >> _U64(lo)) & _U64((1 << width) - 1)
+
+
+def parity_ok(packets: np.ndarray) -> np.ndarray:
+    "True where the packet has odd parity, like util.parity64"
+    x = packets ^ (packets >> _U64(32))
+    x ^= x >> _U64(16)
+    x ^= x >> _U64(8)
+    return PARITY8[(x & _U64(0xff)).astype(np.uint8)].astype(bool)
+
+
+def packet_type(packets: np.ndarray) -> np.ndarray:
+    return _bits(packets, 0, 2).astype(np.uint8)
+
+
+def downstream(packets: np.ndarray) -> np.ndarray:
+    return _bits(packets, 62, 1).astype(bool)
+
+
+def chip_id(packets: np.ndarray) -> np.ndarray:
+    return _bits(packets, 2, 8).astype(np.uint8)
+
+
+def channel_id(packets: np.ndarray) -> np.ndarray:
+    return _bits(packets, 10, 6).astype(np.uint8)
+
+
+def timestamp(packets: np.ndarray) -> np.ndarray:
+    return _bits(packets, 16, 31).astype(np.uint32)
+
+
+def adc(packets: np.ndarray) -> np.ndarray:
+    return _bits(packets, 48, 8).astype(np.uint8)
+
+
+def register_address(packets: np.ndarray) -> np.ndarray:
+    return _bits(packets, 10, 8).astype(np.uint8)
+
+
+def register_data(packets: np.ndarray) -> np.ndarray:
+    return _bits(packets, 18, 8).astype(np.uint8)
+
+
+@dataclass
+class PacketFields:
+    packet_type: np.ndarray
+    downstream: np.ndarray
+    parity_ok: np.ndarray
+    chip_id: np.ndarray
+    channel_id: np.ndarray
+    adc: np.ndarray
+    timestamp: np.ndarray
+
+
+def decode_packets(packets: np.ndarray) -> PacketFields:
+    packets = np.asarray(packets, dtype=_U64)
+    return PacketFields(packet_type=packet_type(packets),
+                        downstream=downstream(packets),
+                        parity_ok=parity_ok(packets),
+                        chip_id=chip_id(packets),
+                        channel_id=channel_id(packets),
+                        adc=adc(packets),
+                        timestamp=timestamp(packets))
@@ -1,164 +1,344 @@
 #!/usr/bin/env python3
 
-from collections import defaultdict
-from dataclasses import dataclass
 import os
-from typing import Dict
 import time
 
-from construct import Container
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
-import zmq
-
-from format import Msg, WordType # , WordType_t
-from format import PACKET_TYPE_MAP
-from util import parity64, get_data_socket
-
-
-@dataclass
-class DataCountsPerStatus:
-    total: int = 0
-    valid_parity: int = 0
-    invalid_parity: int = 0
-    downstream: int = 0
-    upstream: int = 0
-
-
-@dataclass
-class ConfigCountsPerStatus:
-    total: int = 0
-    invalid_parity: int = 0
-    ds_read: int = 0
-    ds_write: int = 0
-    us_read: int = 0
-    us_write: int = 0
-
-
-def DataCountsPerStatusPerIOChan() -> Dict[int, DataCountsPerStatus]:
-    return defaultdict(lambda: DataCountsPerStatus())
-
-def ConfigCountsPerStatusPerIOChan() -> Dict[int, ConfigCountsPerStatus]:
-    return defaultdict(lambda: ConfigCountsPerStatus())
-
-# def CountsPerType() -> Dict[WordType_t, int]:
-def CountsPerType() -> Dict[str, int]:
-    return defaultdict(lambda: 0)
+from counters import CounterStore, DecodeSampler, DATA_FIELDS, CONFIG_FIELDS
+from counters import INGEST_FIELDS, WORD_TYPES
+from decode import decode_header, decode_msg
+from flight_recorder import FlightRecorder, install_trigger_signal
+from influx_writer import InfluxWriter
+from instrument import Instruments, StatusServer, install_profile_signal
+from occupancy import OccupancyStore
+from pool import DecodePool
+from rates import RollingRates
+from receiver import Receiver
+from register_mirror import RegisterMirror
+from roundtrip import RoundTripTracker
+from snapshot_bus import SnapshotWriter
+from spool import Spool
+from timing import TIMING_FIELDS, TimingAnalyzer
+
+SPOOL_DIR = os.environ.get('PACMON_SPOOL_DIR', '/var/tmp/pacmon-spool')
+
+# Receive stage tuning: raw messages buffered between the receive thread and
+# the decoder, and the SUB socket's own queue (messages) and kernel buffer
+# (bytes, None for the OS default)
+RING_CAPACITY = int(os.environ.get('PACMON_RING_CAPACITY', 4096))
+RCVHWM = int(os.environ.get('PACMON_RCVHWM', 100_000))
+RCVBUF = (int(os.environ['PACMON_RCVBUF']) if 'PACMON_RCVBUF' in os.environ
+          else None)
+
+# Number of decode worker processes; 0 decodes on the main thread
+DECODE_WORKERS = int(os.environ.get('PACMON_DECODE_WORKERS', 0))
+
+# Overload: once more than SAMPLE_BACKLOG messages are waiting, only 1 in N
+# messages (N up to SAMPLE_MAX_RATIO) get the full decode; word type totals
+# stay exact
+SAMPLE_BACKLOG = int(os.environ.get('PACMON_SAMPLE_BACKLOG', RING_CAPACITY // 4))
+SAMPLE_MAX_RATIO = int(os.environ.get('PACMON_SAMPLE_MAX_RATIO', 64))
+
+# Per-chip/channel occupancy histograms (main-thread decoding only), and how
+# many of the hottest pixel channels to publish per interval
+OCCUPANCY = os.environ.get('PACMON_OCCUPANCY', '1') != '0'
+OCCUPANCY_TOP_N = int(os.environ.get('PACMON_OCCUPANCY_TOP_N', 20))
+
+# Timestamp continuity checks (main-thread decoding only): word timestamp
+# differences above GAP_TICKS count as gaps, and io_channels silent for
+# STALL_AFTER seconds as stalled
+TIMING = os.environ.get('PACMON_TIMING', '1') != '0'
+GAP_TICKS = int(os.environ.get('PACMON_GAP_TICKS', 10_000_000))
+STALL_AFTER = float(os.environ.get('PACMON_STALL_AFTER', 10.))
+
+# Config round trips (main-thread decoding only): downstream config requests
+# unanswered after CONFIG_TIMEOUT seconds count as timeouts, and at most
+# CONFIG_MAX_OUTSTANDING requests are tracked at once
+ROUNDTRIP = os.environ.get('PACMON_ROUNDTRIP', '1') != '0'
+CONFIG_TIMEOUT = float(os.environ.get('PACMON_CONFIG_TIMEOUT', 1.))
+CONFIG_MAX_OUTSTANDING = int(os.environ.get('PACMON_CONFIG_MAX_OUTSTANDING', 1 << 16))
+
+# Register mirror from config-read replies (main-thread decoding only),
+# diffed against EXPECTED_CONFIG if set (see register_mirror.py for the
+# format), and saved to MIRROR_FILE every MIRROR_SAVE_INTERVAL seconds and
+# on exit, and reloaded from it on start, if set
+MIRROR = os.environ.get('PACMON_MIRROR', '1') != '0'
+EXPECTED_CONFIG = os.environ.get('PACMON_EXPECTED_CONFIG')
+MIRROR_FILE = os.environ.get('PACMON_MIRROR_FILE')
+MIRROR_SAVE_INTERVAL = float(os.environ.get('PACMON_MIRROR_SAVE_INTERVAL', 60.))
+
+# Self-monitoring: plain-text status on http://127.0.0.1:STATUS_PORT/ (0 to
+# disable), and `kill -USR1 <pid>` writes a stack-sample profile to
+# PROFILE_DIR
+STATUS_PORT = int(os.environ.get('PACMON_STATUS_PORT', 8765))
+PROFILE_DIR = os.environ.get('PACMON_PROFILE_DIR', '/var/tmp')
+
+# Flight recorder, off unless RECORDER_DIR is set: the last RECORDER_SECONDS
+# (and at most RECORDER_BYTES) of raw messages, written to RECORDER_DIR as a
+# capture file RECORDER_POST seconds after a trigger, keeping the newest
+# RECORDER_MAX_DUMPS files there. Triggers: a Data invalid-parity fraction above
+# TRIGGER_PARITY on an io_channel with at least TRIGGER_MIN_WORDS words in the
+# last second, TRIGGER_ERRORS or more Error words in an interval (0 to
+# disable; LArPix test packets count as Error words, so set it above the
+# test-pulse rate when those are expected), any timestamp gap (TRIGGER_GAPS),
+# `kill -USR2 <pid>` or `curl -X POST http://127.0.0.1:STATUS_PORT/trigger`
+RECORDER_DIR = os.environ.get('PACMON_RECORDER_DIR', '')
+RECORDER_BYTES = int(os.environ.get('PACMON_RECORDER_BYTES', 32 << 20))
+RECORDER_SECONDS = float(os.environ.get('PACMON_RECORDER_SECONDS', 10.))
+RECORDER_POST = float(os.environ.get('PACMON_RECORDER_POST', 2.))
+RECORDER_COOLDOWN = float(os.environ.get('PACMON_RECORDER_COOLDOWN', 60.))
+RECORDER_MAX_DUMPS = int(os.environ.get('PACMON_RECORDER_MAX_DUMPS', 20))
+TRIGGER_PARITY = float(os.environ.get('PACMON_TRIGGER_PARITY', 0.05))
+TRIGGER_MIN_WORDS = int(os.environ.get('PACMON_TRIGGER_MIN_WORDS', 100))
+TRIGGER_ERRORS = int(os.environ.get('PACMON_TRIGGER_ERRORS', 1000))
+TRIGGER_GAPS = os.environ.get('PACMON_TRIGGER_GAPS', '1') != '0'
+
+# Shared-memory segment each flushed snapshot is published to for local
+# readers (see snapshot_bus.py); empty to disable. Only one monitor can
+# publish to a name at a time; give concurrent monitors different names
+SHM_NAME = os.environ.get('PACMON_SHM_NAME', 'pacmon')
+
+
+def default_influx_writer() -> InfluxWriter:
+    return InfluxWriter(url='http://localhost:18086',
+                        token=os.environ['INFLUXDB_TOKEN'],
+                        org='lbl-neutrino',
+                        bucket='pacman',
+                        spool=Spool(SPOOL_DIR))
 
 
 class Pacmon:
-    def __init__(self):
-        self.word_types = CountsPerType()
-        self.data_statuses = DataCountsPerStatusPerIOChan()
-        self.config_statuses = ConfigCountsPerStatusPerIOChan()
-
-        self.data_socket = get_data_socket()
-
-        self.poller = zmq.Poller()
-        self.poller.register(self.data_socket, zmq.POLLIN)
-
-        self.influx_org = 'lbl-neutrino'
-        self.influx_bucket = 'pacman'
-        self.influx_client = InfluxDBClient(url='http://localhost:18086',
-                                            token=os.environ['INFLUXDB_TOKEN'],
-                                            org=self.influx_org)
-
-    def record_type(self, word: Container):
-        # Reclassify Data words according to the LArPix packet type
-        if word.type is WordType.Data:
-            packet_type = word.content.packet[0] & 3
-            # Data, Write, Read, Error
-            word_type_reclass = PACKET_TYPE_MAP[packet_type]
-        else:
-            word_type_reclass = word.type
-        self.word_types[word_type_reclass] += 1
-
-    def record_statuses(self, word: Container):
-        if word.type is WordType.Data:
-            chan = word.content.io_channel
-            valid_parity = parity64(word.content.packet)
-            downstream = word.content.packet[7] & 0x40 == 0x40
-
-            packet_type = word.content.packet[0] & 3
-            is_config_read = PACKET_TYPE_MAP[packet_type] == WordType.Read
-            is_config_write = PACKET_TYPE_MAP[packet_type] == WordType.Write
-            is_config = is_config_read or is_config_write
-
-            data = self.data_statuses[chan]
-            config = self.config_statuses[chan]
-
-            data.total += 1
-            if is_config:
-                config.total += 1
-
-            if valid_parity:
-                data.valid_parity += 1
-            else:
-                data.invalid_parity += 1
-                if is_config:
-                    config.invalid_parity += 1
-
-            if downstream:
-                data.downstream += 1
-                if is_config_read:
-                    config.ds_read += 1
-                elif is_config_write:
-                    config.ds_write += 1
-            else:
-                data.upstream += 1
-                if is_config_read:
-                    config.us_read += 1
-                elif is_config_write:
-                    config.us_write += 1
+    """Counts messages from `source` (by default a live Receiver on the data
+    socket; see replay.ReplaySource) and flushes once per second of source
+    time to `influx_writer`. With `shm_name`, every flushed snapshot is also
+    published to that shared-memory segment, and with `recorder_dir` a
+    flight recorder writes the traffic around anomalies there."""
+
+    def __init__(self, source=None, influx_writer=None, status_port=None,
+                 shm_name=None, recorder_dir=None):
+        self.counters = CounterStore()
+        self.sampler = DecodeSampler(SAMPLE_BACKLOG, SAMPLE_MAX_RATIO)
+        self.rolling = RollingRates()
+        self.pool = DecodePool(DECODE_WORKERS) if DECODE_WORKERS else None
+        self.occupancy = (OccupancyStore(top_n=OCCUPANCY_TOP_N)
+                          if OCCUPANCY and not self.pool else None)
+        self.timing = (TimingAnalyzer(gap_ticks=GAP_TICKS, stall_after=STALL_AFTER)
+                       if TIMING and not self.pool else None)
+        self.roundtrip = (RoundTripTracker(CONFIG_TIMEOUT,
+                                           max_outstanding=CONFIG_MAX_OUTSTANDING)
+                          if ROUNDTRIP and not self.pool else None)
+        # set when requests come from the echo stream (process_echo) rather
+        # than the downstream packets in the data stream
+        self.echo_requests = False
+        self.mirror = self.expected_config = None
+        if MIRROR and not self.pool:
+            self.mirror = (RegisterMirror.load(MIRROR_FILE)
+                           if MIRROR_FILE and os.path.exists(MIRROR_FILE)
+                           else RegisterMirror())
+            if EXPECTED_CONFIG:
+                self.expected_config = self.mirror.load_expected(EXPECTED_CONFIG)
+        self._last_mirror_save = None
+        self._last_flush = None
+        self.latest = None          # last flushed snapshot
+
+        self.source = source or Receiver(capacity=RING_CAPACITY, rcvhwm=RCVHWM,
+                                         rcvbuf=RCVBUF)
+
+        self.recorder = (FlightRecorder(recorder_dir, RECORDER_BYTES, RECORDER_SECONDS,
+                                        RECORDER_POST, RECORDER_COOLDOWN,
+                                        TRIGGER_PARITY, TRIGGER_MIN_WORDS,
+                                        TRIGGER_ERRORS, TRIGGER_GAPS,
+                                        max_dumps=RECORDER_MAX_DUMPS)
+                         if recorder_dir else None)
+
+        self.instruments = Instruments()
+        if hasattr(self.source, 'recv_time'):
+            self.instruments.stages['recv'] = self.source.recv_time
+        actions = {'/trigger': self.poke} if self.recorder else None
+        self.status_server = (StatusServer(self.instruments, status_port,
+                                           actions=actions).start()
+                              if status_port else None)
+        self.bus = SnapshotWriter(shm_name) if shm_name else None
+
+        self.influx_writer = influx_writer or default_influx_writer()
+        self.influx_writer.start()
+        # tile_id tag of the lines not written by the InfluxWriter itself
+        self.tile_ids = getattr(self.influx_writer, 'tile_ids', None)
+        self.tile_id = self.tile_ids[0] if self.tile_ids else 0
 
     def print_stats(self):
-        print(self.word_types)
-        print(self.data_statuses)
-        print(self.config_statuses)
+        snap = self.snapshot()
+        print(dict(zip(WORD_TYPES, snap.word_types[0].tolist())))
+        for chan in snap.active_channels(0):
+            print(chan, dict(zip(DATA_FIELDS, snap.data[0, chan].tolist())),
+                  dict(zip(CONFIG_FIELDS, snap.config[0, chan].tolist())))
         print()
 
-    def write_to_influx(self, tile_id = 0):
-        api = self.influx_client.write_api(write_options=SYNCHRONOUS)
-
-        point = Point('word_types')
-        point.tag('tile_id', tile_id)
-        for word_type, count in self.word_types.items():
-            point.field(word_type, count)
-        api.write(bucket=self.influx_bucket, org=self.influx_org, record=point)
-
-        for chan, counts in self.data_statuses.items():
-            point = Point('data_statuses')
-            point.tag('tile_id', tile_id)
-            point.tag('io_channel', chan)
-            for field, value in counts.__dict__.items():
-                point.field(field, value)
-            api.write(bucket=self.influx_bucket, org=self.influx_org, record=point)
-
-        for chan, counts in self.config_statuses.items():
-            point = Point('config_statuses')
-            point.tag('tile_id', tile_id)
-            point.tag('io_channel', chan)
-            for field, value in counts.__dict__.items():
-                point.field(field, value)
-            api.write(bucket=self.influx_bucket, org=self.influx_org, record=point)
+    def snapshot(self, t=None):
+        if self.pool:
+            snap = self.pool.snapshot()
+            snap.time = snap.time if t is None else t
+            return snap
+        return self.counters.snapshot(t)
+
+    def live_snapshot(self):
+        """Snapshot that is safe to take from another thread: current counts
+        when decoding on this thread, else the last flushed snapshot"""
+        if self.pool:
+            return self.latest
+        return self.counters.snapshot()
+
+    def write_to_influx(self, t=None, extra_lines=()):
+        start = time.perf_counter_ns()
+        snap = self.snapshot(t)
+        self.latest = snap
+        if self.bus is not None:
+            self.bus.publish(snap)
+        ts = int(snap.time * 1e9)
+        self.rolling.update(snap)
+        lines = [self.source.stats_line(ts)] + self.instruments.lines(ts)
+        if self.recorder is not None:
+            self.check_triggers(snap)
+            lines.append(self.recorder.stats_line(ts))
+        if not self.pool:
+            lines.append(self.sampler.stats_line(ts, self.source.backlog()))
+        lines += self.rolling.lines(ts, self.tile_ids)
+        lines += extra_lines
+        # messages skipped by the sampler were not seen by the analyzers below
+        estimated = bool(self.rolling.counts('ingest', 0)[0, INGEST_FIELDS.index('undecoded')])
+        ratio = self.sampler.ratio
+        if self.occupancy is not None:
+            dt = snap.time - self._last_flush if self._last_flush is not None else None
+            lines += self.occupancy.lines(ts, dt, self.tile_id, estimated)
+        if self.timing is not None:
+            lines += self.timing.lines(ts, self.tile_id, estimated, ratio)
+        if self.roundtrip is not None:
+            lines += self.roundtrip.lines(ts, self.tile_id, estimated, ratio)
+        if self.mirror is not None:
+            lines += self.mirror.lines(ts, self.expected_config, self.tile_id,
+                                       estimated, ratio)
+            if self._last_mirror_save is None:
+                self._last_mirror_save = snap.time
+            elif snap.time - self._last_mirror_save >= MIRROR_SAVE_INTERVAL:
+                self.save_mirror()
+                self._last_mirror_save = snap.time
+        self._last_flush = snap.time
+        # Live data may skip a snapshot under backpressure; replays must not
+        self.influx_writer.submit(snap, lines, block=not self.source.live)
+        self.instruments.stages['flush'].add(time.perf_counter_ns() - start)
+
+    def check_triggers(self, snap):
+        data = self.rolling.counts('data', 0)
+        gaps = (int(self.timing.counts[:, TIMING_FIELDS.index('gaps')].sum())
+                if self.timing is not None else None)
+        self.recorder.check(snap.time, self.rolling.invalid_parity_fraction('data', 0),
+                            data[..., DATA_FIELDS.index('total')],
+                            int(snap.word_types[:, WORD_TYPES.index('Error')].sum()),
+                            gaps)
+
+    def poke(self) -> str:
+        "Trigger a flight recorder dump (the status server's POST /trigger)"
+        self.recorder.trigger('http')
+        return 'flight recorder triggered\n'
+
+    def process(self, raw):
+        "Count one raw message, deep-decoding it unless sampled out; timed per stage"
+        stages, clock = self.instruments.stages, time.perf_counter_ns
+        t0 = clock()
+        if self.recorder is not None:
+            self.recorder.record(raw, self.source.now())
+            t1 = clock()
+            stages['record'].add(t1 - t0)
+            t0 = t1
+        if self.pool:
+            header = decode_header(raw)
+            self.pool.submit(raw)
+            stages['submit'].add(clock() - t0)
+        else:
+            weight = self.sampler.weight(self.source.backlog())
+            header = self.counters.record_header(raw, decoded=weight > 0)
+            t1 = clock()
+            stages['scan'].add(t1 - t0)
+            if weight:
+                msg = decode_msg(raw)
+                t2 = clock()
+                self.counters.record_packets(msg, weight=weight)
+                t3 = clock()
+                stages['parse'].add(t2 - t1)
+                stages['count'].add(t3 - t2)
+                t4 = t3
+                if self.occupancy is not None:
+                    self.occupancy.record(msg, weight)
+                    t4 = clock()
+                    stages['occupancy'].add(t4 - t3)
+                if self.timing is not None:
+                    self.timing.record(msg, self.source.now())
+                    t5 = clock()
+                    stages['timing'].add(t5 - t4)
+                    t4 = t5
+                if self.roundtrip is not None:
+                    self.roundtrip.record(msg, self.source.now(),
+                                          requests=not self.echo_requests)
+                    t5 = clock()
+                    stages['roundtrip'].add(t5 - t4)
+                    t4 = t5
+                if self.mirror is not None:
+                    self.mirror.record(msg, self.source.now())
+                    stages['mirror'].add(clock() - t4)
+            else:
+                if self.timing is not None:
+                    self.timing.discontinuity()
+                if self.roundtrip is not None:
+                    self.roundtrip.discontinuity()
+        lag = self.source.now() - int(header['timestamp'])
+        self.instruments.message(int(header['num_words']), len(raw), lag)
+
+    def save_mirror(self):
+        if self.mirror is not None and MIRROR_FILE:
+            self.mirror.save(MIRROR_FILE)
+
+    def process_echo(self, raw):
+        "Track the downstream config requests in an echo stream message"
+        if self.roundtrip is not None:
+            self.roundtrip.record(decode_msg(raw), self.source.now(),
+                                  replies=False)
 
     def run(self):
-        last = time.time()
-        while True:
-            for socket, _ in self.poller.poll():
-                raw = socket.recv()
-                msg = Msg.parse(raw)
-
-                for word in msg.words:
-                    self.record_type(word)
-                    self.record_statuses(word)
-
-                if time.time() - last > 1:
-                    # self.print_stats()
-                    self.write_to_influx()
-                    last = time.time()
+        if self.pool:
+            self.pool.start()
+        self.source.start()
+        last = None
+        wait = self.instruments.stages['wait']
+        while not self.source.exhausted:
+            start = time.perf_counter_ns()
+            raw = self.source.get(timeout=1.)
+            wait.add(time.perf_counter_ns() - start)
+            if raw is not None:
+                self.process(raw)
+
+            now = self.source.now()
+            if last is None:
+                last = now
+            elif now - last > 1:
+                # self.print_stats()
+                self.write_to_influx(now)
+                last = now
+        self.write_to_influx(self.source.now())
+        self.save_mirror()
+        if self.recorder is not None:
+            self.recorder.flush()
 
 
 if __name__ == '__main__':
-    pacmon = Pacmon()
-    pacmon.run()
+    install_profile_signal(PROFILE_DIR)
+    pacmon = Pacmon(status_port=STATUS_PORT, shm_name=SHM_NAME,
+                    recorder_dir=RECORDER_DIR)
+    if pacmon.recorder is not None:
+        install_trigger_signal(pacmon.recorder)
+    try:
+        pacmon.run()
+    finally:
+        pacmon.save_mirror()
+        if pacmon.recorder is not None:
+            pacmon.recorder.flush()
+        if pacmon.bus is not None:
+            pacmon.bus.close()
@@ -1,19 +1,25 @@
-#!/usr/bin/python2
+#!/usr/bin/env python3
 '''
 A lightweight, standalone python script to interface with the pacman servers
 See help text for more details::
 
-    python2 pacman_util.py --help
+    python3 pacman_util.py --help
 
 '''
 import zmq
 import struct
 import time
 import argparse
+import os
 import sys
 import socket
 import curses
 
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import kernels
+
 _SERVERS = dict(
     ECHO_SERVER = 'tcp://{ip}:5554',
     CMD_SERVER = 'tcp://{ip}:5555',
@@ -95,6 +101,48 @@ def parse_msg(msg):
     ]
     return header, words
 
+# LArPix packet type (packet bits 0:2) -> word type
+_LARPIX_PACKET_TYPES = ['DATA', 'ERROR', 'WRITE', 'READ']
+
+def record_words(msg_words):
+    packets, iocs = list(), list()
+    for word in msg_words:
+        if word[0] not in _packet_type_count:
+            print('unknown packet type!')
+            continue
+        if word[0] == 'DATA':
+            iocs.append(word[1])
+            packets.append(word[-1])
+        else:
+            _packet_type_count[word[0]] += 1
+
+    if not packets:
+        return
+    packets = np.array(packets, dtype=np.uint64)
+    iocs = np.array(iocs)
+    fields = kernels.decode_packets(packets)
+    is_write = fields.packet_type == 2
+    is_read = fields.packet_type == 3
+    is_config = is_write | is_read
+    valid, ds = fields.parity_ok, fields.downstream
+
+    for packet_type, count in enumerate(np.bincount(fields.packet_type, minlength=4)):
+        _packet_type_count[_LARPIX_PACKET_TYPES[packet_type]] += int(count)
+
+    for ioc in np.unique(iocs).tolist():
+        if ioc not in _data_packet_count_per_ioc:
+            continue
+        sel = iocs == ioc
+        data_counts = [sel, sel & valid, sel & ~valid, sel & ds, sel & ~ds]
+        for i, mask in enumerate(data_counts):
+            _data_packet_count_per_ioc[ioc][i] += int(mask.sum())
+        cfg = sel & is_config
+        config_counts = [cfg, cfg & ~valid,
+                         sel & is_read & ds, sel & is_write & ds,
+                         sel & is_read & ~ds, sel & is_write & ~ds]
+        for i, mask in enumerate(config_counts):
+            _config_packet_count_per_ioc[ioc][i] += int(mask.sum())
+
 def print_larpix_bits(word):
     if word[-1] == 'L': word = word[:-1]
     word_int = _int_parser(word)
@@ -350,56 +398,7 @@ def main(stdscr):
             msg_header, msg_words = parse_msg(msg)
 
             # modify counters based on message content:
-            for word in msg_words:
-                is_config_read_packet = False
-                is_config_write_packet = False
-                if word[0] in _packet_type_count.keys():
-                    larpix_bits = print_larpix_bits(hex(word[-1]))
-                    if word[0] == 'DATA' and larpix_bits[slice(0,2)] == ['0','0']:
-                        _packet_type_count['DATA'] += 1
-                    elif word[0] == 'DATA' and larpix_bits[slice(0,2)] == ['1','0']:
-                        _packet_type_count['WRITE'] += 1
-                        is_config_write_packet = True
-                    elif word[0] == 'DATA' and larpix_bits[slice(0,2)] == ['1','1']:
-                        _packet_type_count['READ'] += 1
-                        is_config_read_packet = True
-                    elif word[0] == 'DATA' and larpix_bits[slice(0,2)] == ['0','1']:
-                        _packet_type_count['ERROR'] += 1
-                    else:
-                        _packet_type_count[word[0]] += 1
-                else:
-                    print('unknown packet type!')
-                    exit
-                if word[0] == 'DATA' and word[1] in _data_packet_count_per_ioc.keys():
-                    _data_packet_count_per_ioc[word[1]][0] += 1 # total packets per channel
-                    larpix_bits = print_larpix_bits(hex(word[-1]))
-                    parity = 1 - (larpix_bits[slice(0,63)].count('1')%2)
-                    valid_parity = parity == int(larpix_bits[63])
-                    if valid_parity: # valid parity packets per channel
-                        _data_packet_count_per_ioc[word[1]][1] += 1
-                        if is_config_read_packet:   # read config packet
-                            _config_packet_count_per_ioc[word[1]][1] += 1
- 
-                    else:  # invalid parity packets per channel
-                        _data_packet_count_per_ioc[word[1]][2] += 1
-                        if is_config_read_packet or is_config_write_packet: # invalid_pary config
-                            _config_packet_count_per_ioc[word[1]][1] += 1
-                    if larpix_bits[62] == '1':   # downstream packet
-                        _data_packet_count_per_ioc[word[1]][3] += 1
-                        if is_config_read_packet:    # DS read config packet
-                            _config_packet_count_per_ioc[word[1]][2] += 1
-                        elif is_config_write_packet: # DS write config packet
-                            _config_packet_count_per_ioc[word[1]][3] += 1
-                    elif larpix_bits[62] == '0': # upstream packet
-                        _data_packet_count_per_ioc[word[1]][4] += 1
-                        if is_config_read_packet:    # US read config packet
-                            _config_packet_count_per_ioc[word[1]][4] += 1
-                        elif is_config_write_packet: # US write config packet
-                            _config_packet_count_per_ioc[word[1]][5] += 1
-                    if is_config_read_packet:   # read config packet
-                        _config_packet_count_per_ioc[word[1]][2] += 1
-                    if is_config_write_packet:   # write config packet
-                        _config_packet_count_per_ioc[word[1]][3] += 1
+            record_words(msg_words)
             # update information printed to screen
             if time.time() - last > 1:
                 run_console(stdscr, start_time, msg)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Sharded decoding across worker processes. Every counter is a plain sum, so
+# raw messages can be spread over N workers (ZMQ PUSH/PULL round-robin), each
+# accumulating into its own CounterStore. Workers send their cumulative
+# snapshots back once per interval and the parent adds up the latest one from
+# each worker.
+
+import multiprocessing as mp
+import queue
+import time
+from typing import Dict
+
+import zmq
+
+from counters import CounterSnapshot, CounterStore, merge_snapshots
+from decode import decode_msg
+from util import stop_processes
+
+
+def worker_main(index: int, url: str, num_tiles: int, out_queue: mp.Queue,
+                stop: mp.Event, interval: float):
+    ctx = zmq.Context()
+    pull = ctx.socket(zmq.PULL)
+    pull.connect(url)
+    store = CounterStore(num_tiles=num_tiles)
+
+    last = time.monotonic()
+    while not stop.is_set():
+        if pull.poll(timeout=int(interval * 1000)):
+            # Drain what is queued, then report
+            while True:
+                try:
+                    tile, raw = pull.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
+                store.record(decode_msg(raw.buffer), tile=tile.bytes[0])
+                if time.monotonic() - last >= interval:
+                    break
+
+        now = time.monotonic()
+        if now - last >= interval:
+            out_queue.put((index, store.snapshot()))
+            last = now
+    out_queue.put((index, store.snapshot()))
+    pull.close(linger=0)
+    ctx.term()
+
+
+class DecodePool:
+    def __init__(self, num_workers: int, num_tiles=1, interval=1., sndhwm=10_000):
+        self.num_workers = num_workers
+        self.num_tiles = num_tiles
+        self.interval = interval
+
+        self.zmq_ctx = zmq.Context()
+        self.push = self.zmq_ctx.socket(zmq.PUSH)
+        self.push.setsockopt(zmq.SNDHWM, sndhwm)
+        self.push.setsockopt(zmq.LINGER, 0)
+        port = self.push.bind_to_random_port('tcp://127.0.0.1')
+        self.url = f'tcp://127.0.0.1:{port}'
+
+        # spawn, not fork: by the time the pool starts the parent has
+        # threads (receiver, Influx writer) and ZMQ contexts, which a forked
+        # child would inherit in whatever state they were in
+        self.ctx = mp.get_context('spawn')
+        self.queue = self.ctx.Queue()
+        self.stop_event = self.ctx.Event()
+        self.processes = []
+        self.latest: Dict[int, CounterSnapshot] = {}
+        self.submitted = 0
+
+    def start(self):
+        for index in range(self.num_workers):
+            proc = self.ctx.Process(
+                target=worker_main, name=f'pacmon-decode-{index}',
+                args=(index, self.url, self.num_tiles, self.queue,
+                      self.stop_event, self.interval),
+                daemon=True)
+            proc.start()
+            self.processes.append(proc)
+        return self
+
+    def stop(self, timeout=2.):
+        self.stop_event.set()
+        stop_processes(self.processes, self.collect, timeout)
+        self.push.close()
+        self.zmq_ctx.term()
+
+    def submit(self, raw, tile=0):
+        "Blocks only when every worker's queue is full (SNDHWM)"
+        self.push.send_multipart([bytes([tile]), raw], copy=False)
+        self.submitted += 1
+
+    def collect(self, timeout=0.):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                index, snap = self.queue.get(
+                    timeout=max(0., deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            self.latest[index] = snap
+
+    def snapshot(self) -> CounterSnapshot:
+        self.collect()
+        snaps = list(self.latest.values())
+        if not snaps:
+            return CounterStore(num_tiles=self.num_tiles).snapshot()
+        return merge_snapshots(snaps)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Rolling-window rates over counter snapshots. Each update stores the
+# per-interval delta of every counter in a fixed-size ring and adjusts one
+# running sum per window (add the new delta, subtract the one that fell out),
+# so the cost per interval depends only on the counter shapes, never on how
+# many words arrived. A tile whose counters go backwards (a restarted worker
+# or process) is treated as having restarted from zero.
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from counters import CounterSnapshot, DATA_FIELDS, CONFIG_FIELDS, INGEST_FIELDS
+from counters import WORD_TYPES
+
+COUNTERS = ('word_types', 'data', 'config', 'ingest')
+
+
+def _fields(names, values) -> str:
+    return ','.join(f'{name}={value:.6g}' for name, value in zip(names, values.tolist()))
+
+
+class RollingRates:
+    def __init__(self, windows: Sequence[float] = (1, 10, 60), interval=1.):
+        self.windows = tuple(windows)
+        # window lengths in intervals
+        self.spans = [max(1, round(w / interval)) for w in self.windows]
+        self.size = max(self.spans)
+        self.intervals = 0
+        self._prev: Optional[CounterSnapshot] = None
+        self._ring: Dict[str, np.ndarray] = {}
+        self._sums: Dict[str, np.ndarray] = {}
+        self._dt_ring = np.zeros(self.size, dtype=np.int64)     # ns
+        self._dt_sums = np.zeros(len(self.windows), dtype=np.int64)
+
+    def update(self, snap: CounterSnapshot):
+        prev, self._prev = self._prev, snap
+        if prev is None:
+            for name in COUNTERS:
+                shape = getattr(snap, name).shape
+                self._ring[name] = np.zeros((self.size,) + shape, dtype=np.int64)
+                self._sums[name] = np.zeros((len(self.windows),) + shape,
+                                            dtype=np.int64)
+            return
+
+        n, slot = self.intervals, self.intervals % self.size
+        dt = int(round((snap.time - prev.time) * 1e9))
+        deltas = {}
+        for name in COUNTERS:
+            now = getattr(snap, name)
+            delta = now - getattr(prev, name)
+            # any counter of a tile going backwards means its source restarted
+            reset = (delta < 0).reshape(len(delta), -1).any(axis=1)
+            delta[reset] = now[reset]
+            deltas[name] = delta
+
+        for i, span in enumerate(self.spans):
+            self._dt_sums[i] += dt
+            for name in COUNTERS:
+                self._sums[name][i] += deltas[name]
+            if n >= span:
+                # the interval that just left this window
+                expired = (n - span) % self.size
+                self._dt_sums[i] -= self._dt_ring[expired]
+                for name in COUNTERS:
+                    self._sums[name][i] -= self._ring[name][expired]
+        self._dt_ring[slot] = dt
+        for name in COUNTERS:
+            self._ring[name][slot] = deltas[name]
+        self.intervals += 1
+
+    def counts(self, name: str, window: int) -> np.ndarray:
+        "Counts of `name` within window number `window`"
+        return self._sums[name][window]
+
+    def rates(self, name: str, window: int) -> np.ndarray:
+        "Per-second rates of `name` over window number `window`"
+        counts = self._sums[name][window]
+        dt = self._dt_sums[window] / 1e9
+        return counts / dt if dt > 0 else np.zeros(counts.shape)
+
+    def invalid_parity_fraction(self, name: str, window: int) -> np.ndarray:
+        "Fraction of data or config packets with bad parity, per tile and channel"
+        fields = DATA_FIELDS if name == 'data' else CONFIG_FIELDS
+        counts = self._sums[name][window]
+        total = counts[..., fields.index('total')]
+        bad = counts[..., fields.index('invalid_parity')]
+        return np.divide(bad, total, out=np.zeros(total.shape), where=total > 0)
+
+    def lines(self, ts: int, tile_ids: Optional[Sequence[int]] = None) -> List[str]:
+        """Line protocol with a window=<seconds>s tag: word_type_rates,
+        ingest_rates, data_rates and config_rates (per second, plus
+        invalid_parity_fraction and whether the window includes sampled
+        estimates) for channels active in the window"""
+        if not self.intervals:
+            return []
+        if tile_ids is None:
+            tile_ids = range(self._sums['word_types'].shape[1])
+
+        lines = []
+        for i, window in enumerate(self.windows):
+            tag = f'window={window:g}s'
+            word_types = self.rates('word_types', i)
+            ingest = self.rates('ingest', i)
+            data, config = self.rates('data', i), self.rates('config', i)
+            data_bad = self.invalid_parity_fraction('data', i)
+            config_bad = self.invalid_parity_fraction('config', i)
+            active = (self.counts('data', i)[..., DATA_FIELDS.index('total')]
+                      + self.counts('config', i)[..., CONFIG_FIELDS.index('total')])
+            undecoded = self.counts('ingest', i)[:, INGEST_FIELDS.index('undecoded')]
+            for tile, tile_id in enumerate(tile_ids):
+                estimated = f'estimated={str(bool(undecoded[tile])).lower()}'
+                lines.append(f'word_type_rates,tile_id={tile_id},{tag} '
+                             f'{_fields(WORD_TYPES, word_types[tile])} {ts}')
+                lines.append(f'ingest_rates,tile_id={tile_id},{tag} '
+                             f'{_fields(INGEST_FIELDS, ingest[tile])} {ts}')
+                for chan in np.flatnonzero(active[tile]).tolist():
+                    tags = f'io_channel={chan},tile_id={tile_id},{tag}'
+                    lines.append(f'data_rates,{tags} '
+                                 f'{_fields(DATA_FIELDS, data[tile, chan])},'
+                                 f'invalid_parity_fraction={data_bad[tile, chan]:.6g},'
+                                 f'{estimated} {ts}')
+                    lines.append(f'config_rates,{tags} '
+                                 f'{_fields(CONFIG_FIELDS, config[tile, chan])},'
+                                 f'invalid_parity_fraction={config_bad[tile, chan]:.6g},'
+                                 f'{estimated} {ts}')
+        return lines
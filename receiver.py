@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# Receive stage: a thread that only drains the SUB socket into a bounded ring
+# of zero-copy ZMQ frames, so that a slow decode/count/flush stage shows up as
+# ring occupancy and counted overflows rather than as silent drops at the
+# socket's high-water mark.
+
+from dataclasses import dataclass
+import threading
+import time
+from typing import Optional
+
+import zmq
+
+from instrument import Histogram
+from util import get_data_socket
+
+
+class Ring:
+    """Fixed-capacity single-producer/single-consumer ring. put() never blocks;
+    when the ring is full the new item is discarded and counted."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.head = 0           # total items written
+        self.tail = 0           # total items read
+        self.overflows = 0
+        self.max_occupancy = 0
+        self._ready = threading.Event()
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def put(self, item) -> bool:
+        occupancy = self.head - self.tail
+        if occupancy >= self.capacity:
+            self.overflows += 1
+            return False
+        self.slots[self.head % self.capacity] = item
+        self.head += 1
+        self.max_occupancy = max(self.max_occupancy, occupancy + 1)
+        self._ready.set()
+        return True
+
+    def get(self, timeout: Optional[float] = None):
+        "Oldest item, or None if nothing arrived within `timeout`"
+        if self.head == self.tail:
+            self._ready.clear()
+            # re-check, put() may have happened before the clear
+            if self.head == self.tail and not self._ready.wait(timeout):
+                return None
+        index = self.tail % self.capacity
+        item = self.slots[index]
+        self.slots[index] = None
+        self.tail += 1
+        return item
+
+
+@dataclass
+class ReceiverStats:
+    received: int = 0
+    processed: int = 0
+    bytes: int = 0
+    overflows: int = 0
+    occupancy: int = 0
+    max_occupancy: int = 0
+
+
+class Receiver:
+    live = True                 # see replay.ReplaySource
+    exhausted = False
+
+    def __init__(self, url='tcp://pacman32.local:5556', capacity=4096,
+                 rcvhwm: Optional[int] = None, rcvbuf: Optional[int] = None,
+                 socket: Optional[zmq.Socket] = None):
+        self.socket = socket or get_data_socket(url, rcvhwm=rcvhwm, rcvbuf=rcvbuf)
+        self.ring = Ring(capacity)
+        self.received = 0
+        self.processed = 0
+        self.bytes = 0
+        self.recv_time = Histogram()    # ns per successful recv
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='pacmon-recv',
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=2.):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        while not self._stop.is_set():
+            if not poller.poll(timeout=100):
+                continue
+            # Drain everything that is queued before polling again
+            while True:
+                start = time.perf_counter_ns()
+                try:
+                    frame = self.socket.recv(flags=zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
+                self.recv_time.add(time.perf_counter_ns() - start)
+                self.received += 1
+                self.bytes += len(frame)
+                self.ring.put(frame)
+
+    def now(self) -> float:
+        return time.time()
+
+    def backlog(self) -> int:
+        "Messages received but not yet taken with get()"
+        return len(self.ring)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[memoryview]:
+        "Next raw message, or None on timeout. Counts it as processed."
+        frame = self.ring.get(timeout)
+        if frame is None:
+            return None
+        self.processed += 1
+        return frame.buffer
+
+    def stats(self) -> ReceiverStats:
+        return ReceiverStats(received=self.received,
+                             processed=self.processed,
+                             bytes=self.bytes,
+                             overflows=self.ring.overflows,
+                             occupancy=len(self.ring),
+                             max_occupancy=self.ring.max_occupancy)
+
+    def stats_line(self, ts: int) -> str:
+        s = self.stats()
+        fields = ','.join(f'{name}={value}i' for name, value in s.__dict__.items())
+        return f'receiver {fields} {ts}'
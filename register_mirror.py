@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+# Mirror of LArPix configuration registers as seen in upstream config-read
+# replies: a dense, preallocated table over io_channel x chip x register
+# holding the last value read and when (unix seconds, 0 = never read),
+# updated in bulk per message. An expected configuration is diffed against
+# it with one fancy-indexed comparison. The table saves to and loads from
+# an uncompressed .npz file, replaced atomically on every save.
+#
+# Expected-config files have one register per line, `io_channel chip
+# register value`, separated by spaces or commas; `#` starts a comment.
+#
+#   python register_mirror.py MIRROR.npz EXPECTED.txt     print the diff
+
+from dataclasses import dataclass
+import os
+import sys
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from counters import PACMAN_IO_CHANNELS
+from decode import DATA, DecodedMsg
+import kernels
+
+NUM_CHIPS = 256
+NUM_REGISTERS = 256
+
+_READ = 3                       # LArPix config read packet type
+
+
+@dataclass
+class ExpectedConfig:
+    index: np.ndarray           # flat index into the mirror table
+    value: np.ndarray           # uint8
+
+
+@dataclass
+class ConfigDiff:
+    mismatched: np.ndarray      # flat indices read with a different value
+    expected: np.ndarray        # ... their expected values
+    actual: np.ndarray          # ... and the values read
+    never_read: np.ndarray      # flat indices never read
+    checked: int
+
+    @property
+    def ok(self) -> bool:
+        return not len(self.mismatched) and not len(self.never_read)
+
+
+class RegisterMirror:
+    """Last value and time read of each register. Replies on io_channels >=
+    num_io_channels are only counted in `out_of_range`."""
+
+    def __init__(self, num_io_channels=PACMAN_IO_CHANNELS):
+        self.num_io_channels = num_io_channels
+        self.shape = (num_io_channels, NUM_CHIPS, NUM_REGISTERS)
+        size = num_io_channels * NUM_CHIPS * NUM_REGISTERS
+        self.value = np.zeros(size, dtype=np.uint8)
+        self.last_seen = np.zeros(size, dtype=np.float64)
+        self.reads = 0
+        self.registers = 0          # distinct registers read at least once
+        self.out_of_range = 0
+        self.lock = threading.Lock()
+
+    def index(self, io_channel, chip, register) -> np.ndarray:
+        return ((np.asarray(io_channel, dtype=np.intp) * NUM_CHIPS
+                 + np.asarray(chip, dtype=np.intp)) * NUM_REGISTERS
+                + np.asarray(register, dtype=np.intp))
+
+    def record(self, msg: DecodedMsg, now: float):
+        "Take the valid-parity upstream config reads of `msg`"
+        is_data = msg.word_type == DATA
+        packets, io_channel = msg.packet[is_data], msg.io_channel[is_data]
+        keep = ((kernels.packet_type(packets) == _READ)
+                & ~kernels.downstream(packets) & kernels.parity_ok(packets))
+        if not keep.any():
+            return
+        in_range = io_channel < self.num_io_channels
+        out_of_range = int(np.count_nonzero(keep & ~in_range))
+        keep &= in_range
+        packets = packets[keep]
+        index = self.index(io_channel[keep], kernels.chip_id(packets),
+                           kernels.register_address(packets))
+        value = kernels.register_data(packets)
+        # the last read of a register within the message wins
+        index, last = np.unique(index[::-1], return_index=True)
+        with self.lock:
+            self.registers += int(np.count_nonzero(self.last_seen[index] == 0))
+            self.value[index] = value[::-1][last]
+            self.last_seen[index] = now
+            self.reads += len(packets)
+            self.out_of_range += out_of_range
+
+    def diff(self, expected: ExpectedConfig) -> ConfigDiff:
+        with self.lock:
+            actual = self.value[expected.index]
+            read = self.last_seen[expected.index] > 0
+        wrong = read & (actual != expected.value)
+        return ConfigDiff(mismatched=expected.index[wrong],
+                          expected=expected.value[wrong], actual=actual[wrong],
+                          never_read=expected.index[~read],
+                          checked=len(expected.index))
+
+    def unravel(self, index: np.ndarray):
+        "(io_channel, chip, register) arrays of flat indices"
+        return np.unravel_index(index, self.shape)
+
+    def save(self, path: str):
+        """Write to `path` as is (np.savez would append .npz to a bare path),
+        through a temporary file so a crash never leaves a partial one"""
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            with self.lock:
+                np.savez(f, value=self.value, last_seen=self.last_seen,
+                         num_io_channels=self.num_io_channels)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'RegisterMirror':
+        with np.load(path) as f:
+            mirror = cls(int(f['num_io_channels']))
+            mirror.value[:] = f['value']
+            mirror.last_seen[:] = f['last_seen']
+        mirror.registers = int(np.count_nonzero(mirror.last_seen))
+        return mirror
+
+    def load_expected(self, path: str) -> ExpectedConfig:
+        with open(path) as f:
+            text = f.read().replace(',', ' ')
+        rows = np.loadtxt(text.splitlines(), dtype=np.int64, comments='#',
+                          ndmin=2)
+        if not rows.size:
+            rows = rows.reshape(0, 4)
+        if rows.shape[1] != 4:
+            raise ValueError(f'{path}: expected 4 columns (io_channel chip '
+                             f'register value), got {rows.shape[1]}')
+        limits = (self.num_io_channels, NUM_CHIPS, NUM_REGISTERS, 256)
+        for column, (name, limit) in enumerate(zip(
+                ('io_channel', 'chip', 'register', 'value'), limits)):
+            bad = (rows[:, column] < 0) | (rows[:, column] >= limit)
+            if bad.any():
+                raise ValueError(f'{path}: {name} out of range [0, {limit}) '
+                                 f'in row {int(np.argmax(bad)) + 1}')
+        return ExpectedConfig(index=self.index(rows[:, 0], rows[:, 1], rows[:, 2]),
+                              value=rows[:, 3].astype(np.uint8))
+
+    def lines(self, ts: int, expected: Optional[ExpectedConfig] = None,
+              tile_id=0, estimated=False, ratio=1) -> List[str]:
+        """config_mirror totals (with whether messages went undecoded in the
+        interval and the decode sampling ratio) and, with an expected config,
+        a config_diff line per io_channel in it"""
+        lines = [f'config_mirror,tile_id={tile_id} reads={self.reads}i,'
+                 f'registers={self.registers}i,'
+                 f'out_of_range={self.out_of_range}i,'
+                 f'estimated={str(estimated).lower()},sample_ratio={ratio}i {ts}']
+        if expected is None:
+            return lines
+        diff = self.diff(expected)
+        per_channel = NUM_CHIPS * NUM_REGISTERS
+        checked = np.bincount(expected.index // per_channel,
+                              minlength=self.num_io_channels)
+        mismatched = np.bincount(diff.mismatched // per_channel,
+                                 minlength=self.num_io_channels)
+        never_read = np.bincount(diff.never_read // per_channel,
+                                 minlength=self.num_io_channels)
+        for chan in np.flatnonzero(checked).tolist():
+            lines.append(f'config_diff,io_channel={chan},tile_id={tile_id} '
+                         f'checked={checked[chan]}i,mismatched={mismatched[chan]}i,'
+                         f'never_read={never_read[chan]}i {ts}')
+        return lines
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit(f'usage: {sys.argv[0]} MIRROR.npz EXPECTED.txt')
+    mirror = RegisterMirror.load(sys.argv[1])
+    diff = mirror.diff(mirror.load_expected(sys.argv[2]))
+    print(f'{diff.checked} registers checked, {len(diff.mismatched)} mismatched, '
+          f'{len(diff.never_read)} never read')
+    chan, chip, reg = (a.tolist() for a in mirror.unravel(diff.mismatched))
+    for k, (want, got) in enumerate(zip(diff.expected.tolist(), diff.actual.tolist())):
+        print(f'mismatch io_channel={chan[k]} chip={chip[k]} register={reg[k]} '
+              f'expected={want} read={got}')
+    for chan, chip, reg in zip(*(a.tolist() for a in mirror.unravel(diff.never_read))):
+        print(f'never read io_channel={chan} chip={chip} register={reg}')
+    sys.exit(0 if diff.ok else 1)
+
+
+if __name__ == '__main__':
+    main()
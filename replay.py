@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Offline replay of capture files (see capture.py). Messages can be fed
+# straight into the counting pipeline (ReplaySource as a Pacmon source), as
+# fast as possible or paced against their original receive times, or
+# re-published on a local ZMQ PUB socket so the unchanged live tools can
+# consume recorded traffic.
+
+import argparse
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+import zmq
+
+from capture import CaptureReader
+from monitor_pacman import Pacmon
+
+
+def read_captures(paths: Iterable[str], start_ns: Optional[int] = None,
+                  stop_ns: Optional[int] = None) -> Iterator[Tuple[int, memoryview]]:
+    for path in paths:
+        with CaptureReader(path) as reader:
+            yield from reader.messages(start_ns, stop_ns)
+
+
+def paced(messages: Iterable[Tuple[int, memoryview]],
+          speed: Optional[float] = None) -> Iterator[Tuple[int, memoryview]]:
+    """Yield messages no faster than their receive times allow, scaled by
+    `speed` (2 = twice real time). speed=None does not wait at all."""
+    t0_data = t0_wall = None
+    for recv_ns, raw in messages:
+        if speed:
+            if t0_data is None:
+                t0_data, t0_wall = recv_ns, time.monotonic()
+            delay = t0_wall + (recv_ns - t0_data) / 1e9 / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        yield recv_ns, raw
+
+
+class ReplaySource:
+    """Message source for Pacmon. Its clock is the receive time of the last
+    message, so flushes and Influx timestamps follow the recorded data."""
+
+    live = False
+
+    def __init__(self, paths: Iterable[str], speed: Optional[float] = None,
+                 start_ns: Optional[int] = None, stop_ns: Optional[int] = None):
+        self._messages = paced(read_captures(paths, start_ns, stop_ns), speed)
+        self.exhausted = False
+        self.replayed = 0
+        self.bytes = 0
+        self._t = None
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def now(self) -> float:
+        return self._t if self._t is not None else time.time()
+
+    def backlog(self) -> int:
+        return 0                # never falls behind, so never sampled
+
+    def get(self, timeout: Optional[float] = None) -> Optional[memoryview]:
+        try:
+            recv_ns, raw = next(self._messages)
+        except StopIteration:
+            self.exhausted = True
+            return None
+        self._t = recv_ns / 1e9
+        self.replayed += 1
+        self.bytes += len(raw)
+        return raw
+
+    def stats_line(self, ts: int) -> str:
+        return f'replay replayed={self.replayed}i,bytes={self.bytes}i {ts}'
+
+
+def republish(paths: Iterable[str], bind='tcp://127.0.0.1:5556',
+              speed: Optional[float] = 1., wait=0.5) -> int:
+    "Send recorded messages on a PUB socket; returns the number sent"
+    ctx = zmq.Context()
+    pub = ctx.socket(zmq.PUB)
+    pub.setsockopt(zmq.SNDHWM, 0)
+    pub.bind(bind)
+    time.sleep(wait)            # let subscribers (re)connect
+    sent = 0
+    try:
+        for _, raw in paced(read_captures(paths), speed):
+            pub.send(raw, copy=False)
+            sent += 1
+    finally:
+        pub.close(linger=1000)
+        ctx.term()
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured PACMAN messages')
+    parser.add_argument('paths', nargs='+', help='.pmcap files, in order')
+    parser.add_argument('--speed', type=float,
+                        help='pace at SPEED x real time (default: as fast as possible)')
+    parser.add_argument('--publish', metavar='ENDPOINT',
+                        help='re-publish on a PUB socket, e.g. tcp://127.0.0.1:5556, '
+                        'instead of counting into Influx')
+    args = parser.parse_args()
+
+    if args.publish:
+        sent = republish(args.paths, args.publish, args.speed)
+        print(f'published {sent} messages')
+    else:
+        pacmon = Pacmon(source=ReplaySource(args.paths, args.speed))
+        pacmon.run()
+        pacmon.influx_writer.stop(timeout=None)
+
+
+if __name__ == '__main__':
+    main()
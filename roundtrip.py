@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# Config round trips: each downstream config read or write is paired with
+# the upstream reply from the same chip and register. Outstanding requests
+# live in a dict keyed by (packet type, io_channel, chip_id, register), so a
+# reply is matched in O(1), with a FIFO per key for repeated requests.
+# Expiry uses a time wheel: a request is also filed in the wheel slot of its
+# deadline and every advance only visits the slots that have come due. A
+# matched reply removes its request from the slot too, so the wheel never
+# holds more than the outstanding requests.
+# Latencies go into per-io_channel log2 histograms (microseconds). Every
+# array is fixed-size and at most `max_outstanding` requests are tracked;
+# beyond that new requests are only counted as dropped.
+
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+import numpy as np
+
+from counters import NUM_IO_CHANNELS
+from decode import DATA, DecodedMsg
+import kernels
+
+ROUNDTRIP_FIELDS = ('requests', 'replies', 'timeouts', 'unsolicited', 'dropped')
+NUM_LATENCY_BUCKETS = 32        # bucket k: latencies in [2**(k-1), 2**k) us
+
+_WRITE, _READ = 2, 3            # LArPix config packet types
+
+
+class RoundTripTracker:
+    def __init__(self, timeout=1., tick=0.01, max_outstanding=1 << 16,
+                 num_io_channels=NUM_IO_CHANNELS):
+        self.timeout = timeout
+        self.tick = tick
+        self.max_outstanding = max_outstanding
+        self.num_io_channels = num_io_channels
+        self.num_slots = int(np.ceil(timeout / tick)) + 2
+
+        # key -> FIFO of (sequence number, request time, wheel slot)
+        self.pending: Dict[int, Deque[Tuple[int, float, int]]] = {}
+        self.outstanding = 0
+        # slot -> {sequence number: key}
+        self.wheel: List[Dict[int, int]] = [{} for _ in range(self.num_slots)]
+        self.current_tick = None
+        self._seq = 0
+
+        self.counts = np.zeros((num_io_channels, len(ROUNDTRIP_FIELDS)), dtype=np.int64)
+        self.latency_hist = np.zeros((num_io_channels, NUM_LATENCY_BUCKETS),
+                                     dtype=np.int64)
+        self.max_latency = np.zeros(num_io_channels)    # this interval, seconds
+        self._prev_counts = self.counts.copy()
+        self._prev_hist = self.latency_hist.copy()
+
+    def discontinuity(self):
+        "Forget outstanding requests, e.g. after messages were skipped"
+        self.pending.clear()
+        self.outstanding = 0
+        for slot in self.wheel:
+            slot.clear()
+
+    def record(self, msg: DecodedMsg, now: float, requests=True, replies=True):
+        """Track the config packets of `msg`: downstream ones as requests (if
+        `requests`) and upstream ones as replies (if `replies`)"""
+        self.advance(now)
+        is_data = msg.word_type == DATA
+        packets = msg.packet[is_data]
+        packet_type = kernels.packet_type(packets)
+        is_config = packet_type >= _WRITE
+        if not is_config.any():
+            return
+        packets = packets[is_config]
+        downstream = kernels.downstream(packets)
+        io_channel = msg.io_channel[is_data][is_config].astype(np.int64)
+        keys = ((packet_type[is_config].astype(np.int64) << 24) | (io_channel << 16)
+                | (kernels.chip_id(packets).astype(np.int64) << 8)
+                | kernels.register_address(packets))
+        if requests:
+            self._requests(keys[downstream], io_channel[downstream], now)
+        if replies:
+            self._replies(keys[~downstream], io_channel[~downstream], now)
+
+    def _requests(self, keys: np.ndarray, io_channel: np.ndarray, now: float):
+        np.add.at(self.counts[:, 0], io_channel, 1)
+        room = max(self.max_outstanding - self.outstanding, 0)
+        if len(keys) > room:
+            np.add.at(self.counts[:, 4], io_channel[room:], 1)
+            keys = keys[:room]
+        deadline = int((now + self.timeout) / self.tick) + 1
+        if self.current_tick is not None:
+            deadline = max(deadline, self.current_tick + 1)
+        index = deadline % self.num_slots
+        slot = self.wheel[index]
+        pending = self.pending
+        seq = self._seq
+        for key in keys.tolist():
+            seq += 1
+            fifo = pending.get(key)
+            if fifo is None:
+                fifo = pending[key] = deque()
+            fifo.append((seq, now, index))
+            slot[seq] = key
+        self._seq = seq
+        self.outstanding += len(keys)
+
+    def _replies(self, keys: np.ndarray, io_channel: np.ndarray, now: float):
+        if not len(keys):
+            return
+        pending, wheel = self.pending, self.wheel
+        sent = []
+        matched = []
+        for key in keys.tolist():
+            fifo = pending.get(key)
+            if fifo:
+                seq, t, index = fifo.popleft()
+                del wheel[index][seq]
+                sent.append(t)
+                matched.append(True)
+                if not fifo:
+                    del pending[key]
+            else:
+                matched.append(False)
+        matched = np.array(matched)
+        np.add.at(self.counts[:, 3], io_channel[~matched], 1)
+        io_channel = io_channel[matched]
+        self.outstanding -= len(io_channel)
+        np.add.at(self.counts[:, 1], io_channel, 1)
+        latency = np.maximum(now - np.array(sent), 0.)
+        _, bucket = np.frexp(np.floor(latency * 1e6))
+        np.add.at(self.latency_hist,
+                  (io_channel, np.minimum(bucket, NUM_LATENCY_BUCKETS - 1)), 1)
+        np.maximum.at(self.max_latency, io_channel, latency)
+
+    def advance(self, now: float):
+        "Expire the requests whose deadline has passed"
+        tick = int(now / self.tick)
+        if self.current_tick is None:
+            self.current_tick = tick
+            return
+        # a jump of a whole revolution or more visits each slot once
+        for t in range(self.current_tick + 1,
+                       min(tick, self.current_tick + self.num_slots) + 1):
+            slot = self.wheel[t % self.num_slots]
+            for seq, key in slot.items():
+                fifo = self.pending[key]
+                # FIFOs are in sequence order and deadlines only grow, so this
+                # is the front unless the clock went backwards
+                if fifo[0][0] == seq:
+                    fifo.popleft()
+                else:
+                    fifo.remove(next(item for item in fifo if item[0] == seq))
+                if not fifo:
+                    del self.pending[key]
+                self.outstanding -= 1
+                self.counts[(key >> 16) & 0xff, 2] += 1
+            slot.clear()
+        self.current_tick = max(self.current_tick, tick)
+
+    def lines(self, ts: int, tile_id=0, estimated=False, ratio=1) -> List[str]:
+        """config_roundtrip lines per io_channel with requests or replies
+        since the previous call, with latency quantiles (upper bounds of
+        log2 buckets, microseconds), the largest latency, whether messages
+        went undecoded in the interval and the decode sampling ratio"""
+        self.advance(ts / 1e9)
+        counts = self.counts - self._prev_counts
+        hist = self.latency_hist - self._prev_hist
+        self._prev_counts = self.counts.copy()
+        self._prev_hist = self.latency_hist.copy()
+
+        lines = []
+        for chan in np.flatnonzero(counts.any(axis=1)).tolist():
+            fields = [f'{name}={value}i' for name, value
+                      in zip(ROUNDTRIP_FIELDS, counts[chan].tolist())]
+            cumulative = np.cumsum(hist[chan])
+            if cumulative[-1]:
+                for label, q in (('p50', 0.5), ('p99', 0.99)):
+                    k = int(np.searchsorted(cumulative, q * cumulative[-1]))
+                    fields.append(f'{label}_us={(1 << k) - 1}i')
+                fields.append(f'max_us={int(self.max_latency[chan] * 1e6)}i')
+            fields += [f'estimated={str(estimated).lower()}', f'sample_ratio={ratio}i']
+            lines.append(f'config_roundtrip,io_channel={chan},tile_id={tile_id} '
+                         f'{",".join(fields)} {ts}')
+        lines.append(f'config_outstanding,tile_id={tile_id} '
+                     f'outstanding={self.outstanding}i {ts}')
+        self.max_latency[:] = 0
+        return lines
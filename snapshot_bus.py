@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# Counter snapshots published through a POSIX shared-memory segment, so any
+# number of local dashboards, CLIs and exporters can follow one ingestion
+# process without their own connection to the PACMAN. The segment is a small
+# header followed by the snapshot arrays. Writes are guarded by a sequence
+# number (a seqlock): the writer makes it odd, copies the arrays in, then
+# makes it even again. A reader copies the arrays out and keeps the copy
+# only if it saw the same even sequence number before and after. That only
+# holds with a single writer, so a writer holds an exclusive lock on
+# LOCK_DIR/<name>.lock for as long as it is open; a second one refuses to
+# start, while a segment whose writer died (releasing the lock) is reused.
+#
+#   python snapshot_bus.py [name]     print the latest published snapshot
+
+import fcntl
+from multiprocessing import resource_tracker, shared_memory
+import os
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+
+from counters import CounterSnapshot, CONFIG_FIELDS, DATA_FIELDS
+from counters import INGEST_FIELDS, NUM_IO_CHANNELS, WORD_TYPES
+
+MAGIC = 0x5041434d4f4e0001      # 'PACMON' + layout version 1
+HEADER_WORDS = 8                # magic, seq, num_tiles, num_io_channels, time
+
+_MAGIC, _SEQ, _TILES, _CHANNELS, _TIME = range(5)
+
+LOCK_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+# Segments written by this process, whose resource tracker entry is the
+# writer's to keep
+_writing = set()
+
+
+def _layout(num_tiles: int, num_io_channels: int):
+    "(name, shape) of each array after the header, all int64"
+    return (('word_types', (num_tiles, len(WORD_TYPES))),
+            ('data', (num_tiles, num_io_channels, len(DATA_FIELDS))),
+            ('config', (num_tiles, num_io_channels, len(CONFIG_FIELDS))),
+            ('ingest', (num_tiles, len(INGEST_FIELDS))))
+
+
+def _segment_size(num_tiles: int, num_io_channels: int) -> int:
+    words = HEADER_WORDS + sum(int(np.prod(shape)) for _, shape
+                               in _layout(num_tiles, num_io_channels))
+    return 8 * words
+
+
+def _views(buf, num_tiles: int, num_io_channels: int):
+    "The header as uint64 words and the arrays, all viewing `buf`"
+    header = np.ndarray(HEADER_WORDS, dtype=np.uint64, buffer=buf)
+    arrays, offset = {}, 8 * HEADER_WORDS
+    for name, shape in _layout(num_tiles, num_io_channels):
+        arrays[name] = np.ndarray(shape, dtype=np.int64, buffer=buf,
+                                  offset=offset)
+        offset += arrays[name].nbytes
+    return header, arrays
+
+
+def _lock(name: str):
+    "(fd, path) of the writer lock of `name`, held until the fd is closed"
+    path = os.path.join(LOCK_DIR, f'{name}.lock')
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            owner = os.read(fd, 32).decode().strip() or '?'
+            os.close(fd)
+            raise FileExistsError(f'snapshot bus {name!r} already has a writer '
+                                  f'(pid {owner}, lock {path})') from None
+        try:
+            current = os.stat(path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            os.ftruncate(fd, 0)
+            os.write(fd, f'{os.getpid()}\n'.encode())
+            return fd, path
+        # a closing writer removed the file after we opened it
+        os.close(fd)
+
+
+class SnapshotWriter:
+    """Owns the segment `name`; raises FileExistsError if another writer
+    has it open. A segment left behind by a process that died is reused if it
+    has the same shape."""
+
+    def __init__(self, name='pacmon', num_tiles=1,
+                 num_io_channels=NUM_IO_CHANNELS):
+        self.name = name
+        self._lock_fd, self._lock_path = _lock(name)
+        size = _segment_size(num_tiles, num_io_channels)
+        try:
+            try:
+                self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                self.shm = shared_memory.SharedMemory(name)
+                if self.shm.size < size:
+                    self.shm.close()
+                    raise
+        except BaseException:
+            self._unlock()
+            raise
+        self.header, self.arrays = _views(self.shm.buf, num_tiles,
+                                          num_io_channels)
+        self._time = self.header[_TIME:_TIME + 1].view(np.float64)
+        self.header[_SEQ] = 0
+        self.header[_TILES] = num_tiles
+        self.header[_CHANNELS] = num_io_channels
+        self.header[_MAGIC] = MAGIC
+        self.published = 0
+        _writing.add(name)
+
+    def publish(self, snap: CounterSnapshot):
+        header = self.header
+        header[_SEQ] += 1          # odd: write in progress
+        for name, array in self.arrays.items():
+            array[...] = getattr(snap, name)
+        self._time[0] = snap.time
+        header[_SEQ] += 1          # even: consistent again
+        self.published += 1
+
+    def close(self, unlink=True):
+        self.header = self.arrays = self._time = None
+        self.shm.close()
+        _writing.discard(self.name)
+        if unlink:
+            self.shm.unlink()
+        self._unlock()
+
+    def _unlock(self):
+        # removed while still locked, so no other writer can hold a lock on
+        # the old file
+        os.unlink(self._lock_path)
+        os.close(self._lock_fd)
+
+
+class SnapshotReader:
+    """Attaches to a SnapshotWriter's segment. read() copies the latest
+    snapshot into arrays owned by the reader, which are reused by the next
+    read(), and never blocks the writer."""
+
+    def __init__(self, name='pacmon', timeout=1.):
+        self.name = name
+        self.timeout = timeout
+        self.shm = shared_memory.SharedMemory(name)
+        # Attaching registers the segment with this process's resource
+        # tracker, which would unlink it when the reader exits
+        if name not in _writing:
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        header = np.ndarray(HEADER_WORDS, dtype=np.uint64, buffer=self.shm.buf)
+        if header[_MAGIC] != MAGIC:
+            self.shm.close()
+            raise ValueError(f'shared memory segment {name!r} is not a '
+                             'snapshot bus (or is still being created)')
+        self.num_tiles = int(header[_TILES])
+        self.num_io_channels = int(header[_CHANNELS])
+        self.header, self.arrays = _views(self.shm.buf, self.num_tiles,
+                                          self.num_io_channels)
+        self._time = self.header[_TIME:_TIME + 1].view(np.float64)
+        self._out = {name: np.empty_like(array)
+                     for name, array in self.arrays.items()}
+        self.torn = 0               # reads retried because the writer was busy
+
+    @property
+    def seq(self) -> int:
+        "Changes whenever a snapshot is published; poll it to skip re-reading"
+        return int(self.header[_SEQ])
+
+    def read(self) -> Optional[CounterSnapshot]:
+        "The latest snapshot, or None if nothing has been published yet"
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            before = int(self.header[_SEQ])
+            if before == 0:
+                return None
+            if before & 1:
+                self.torn += 1
+                time.sleep(1e-4)
+                continue
+            for name, array in self.arrays.items():
+                self._out[name][...] = array
+            t = float(self._time[0])
+            if int(self.header[_SEQ]) == before:
+                return CounterSnapshot(time=t, **self._out)
+            self.torn += 1
+        raise TimeoutError(f'no consistent snapshot of {self.name!r} within '
+                           f'{self.timeout} s')
+
+    def close(self):
+        self.header = self.arrays = self._time = None
+        self.shm.close()
+
+
+def main():
+    reader = SnapshotReader(sys.argv[1] if len(sys.argv) > 1 else 'pacmon')
+    snap = reader.read()
+    if snap is None:
+        print('nothing published yet')
+        return
+    print(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snap.time)))
+    for tile in range(reader.num_tiles):
+        print(f'tile {tile}', dict(zip(WORD_TYPES, snap.word_types[tile].tolist())),
+              dict(zip(INGEST_FIELDS, snap.ingest[tile].tolist())))
+        for chan in snap.active_channels(tile).tolist():
+            print(chan, dict(zip(DATA_FIELDS, snap.data[tile, chan].tolist())),
+                  dict(zip(CONFIG_FIELDS, snap.config[tile, chan].tolist())))
+
+
+if __name__ == '__main__':
+    main()
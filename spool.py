@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Bounded on-disk spool of line-protocol batches that could not be written to
+# InfluxDB, plus a rate-limited replayer that drains it once Influx is back.
+# Every line carries an explicit timestamp, so replaying a segment twice (e.g.
+# after a crash mid-backfill) just overwrites the same points.
+
+import contextlib
+from dataclasses import dataclass
+import os
+import time
+from typing import Callable, List, Optional
+
+SEGMENT_SUFFIX = '.lp'
+
+
+@dataclass
+class SpoolStats:
+    appended_lines: int = 0
+    evicted_segments: int = 0
+    evicted_bytes: int = 0
+
+
+class Spool:
+    "Append-only segment files with a total size cap and oldest-first eviction"
+
+    def __init__(self, directory: str, segment_bytes=16 << 20, max_bytes=1 << 30):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.stats = SpoolStats()
+
+        os.makedirs(directory, exist_ok=True)
+        # Pick up segments left behind by a previous run
+        self.segments = sorted(f for f in os.listdir(directory)
+                               if f.endswith(SEGMENT_SUFFIX))
+        self.sizes = {f: os.path.getsize(self._path(f)) for f in self.segments}
+        self._next_seq = (int(self.segments[-1][:-len(SEGMENT_SUFFIX)]) + 1
+                          if self.segments else 0)
+        self._active = None     # name of the segment being appended to
+        self._file = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(self.sizes.values())
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _roll(self):
+        if self._file:
+            self._file.close()
+        self._file = None
+        self._active = None
+
+    def _open_segment(self):
+        name = f'{self._next_seq:012d}{SEGMENT_SUFFIX}'
+        self._next_seq += 1
+        self._file = open(self._path(name), 'ab')
+        self._active = name
+        self.segments.append(name)
+        self.sizes[name] = 0
+
+    def append(self, lines: List[str]):
+        data = ('\n'.join(lines) + '\n').encode()
+        if self._file is None or self.sizes[self._active] >= self.segment_bytes:
+            self._roll()
+            self._open_segment()
+        self._file.write(data)
+        self._file.flush()
+        self.sizes[self._active] += len(data)
+        self.stats.appended_lines += len(lines)
+        self._evict()
+
+    def _evict(self):
+        while self.size_bytes > self.max_bytes and len(self.segments) > 1:
+            name = self.segments[0]
+            if name == self._active:
+                break
+            self.stats.evicted_segments += 1
+            self.stats.evicted_bytes += self.sizes[name]
+            self.remove(name)
+
+    def oldest(self) -> Optional[str]:
+        "Name of the oldest complete segment; closes the active one if needed"
+        if not self.segments:
+            return None
+        if self.segments[0] == self._active:
+            self._roll()
+        return self.segments[0]
+
+    def read(self, name: str) -> List[str]:
+        with open(self._path(name), 'rb') as f:
+            return f.read().decode().splitlines()
+
+    def remove(self, name: str):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(name))
+        if name in self.sizes:
+            self.segments.remove(name)
+            del self.sizes[name]
+
+    def close(self):
+        self._roll()
+
+
+class Backfill:
+    "Drains a Spool through `send` in batches, at most `max_lines_per_s`"
+
+    def __init__(self, spool: Spool, send: Callable[[List[str]], None],
+                 batch_lines=5000, max_lines_per_s=50_000):
+        self.spool = spool
+        self.send = send
+        self.batch_lines = batch_lines
+        self.max_lines_per_s = max_lines_per_s
+        self.sent_lines = 0
+
+        self._segment: Optional[str] = None
+        self._lines: List[str] = []
+        self._pos = 0
+        self._next_time = 0.
+
+    @property
+    def pending(self) -> bool:
+        return self._segment is not None or len(self.spool) > 0
+
+    def step(self) -> int:
+        """Send at most one batch, if the rate limit allows. Returns the number
+        of lines sent; exceptions from `send` propagate and the batch is
+        retried on the next call."""
+        now = time.monotonic()
+        if now < self._next_time:
+            return 0
+
+        if self._segment is None:
+            self._segment = self.spool.oldest()
+            if self._segment is None:
+                return 0
+            self._lines = self.spool.read(self._segment)
+            self._pos = 0
+
+        batch = self._lines[self._pos:self._pos + self.batch_lines]
+        if batch:
+            self.send(batch)
+        self._pos += len(batch)
+        self.sent_lines += len(batch)
+        self._next_time = now + len(batch) / self.max_lines_per_s
+
+        if self._pos >= len(self._lines):
+            self.spool.remove(self._segment)
+            self._segment = None
+            self._lines = []
+        return len(batch)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Multi-tile monitor: one decode worker process per PACMAN endpoint (or group
+# of endpoints). Workers send cumulative counter snapshots to the supervisor,
+# which merges them into a single snapshot for one InfluxWriter, tagging each
+# tile with its tile_id. Crashed workers are restarted; their last reported
+# counts are carried over so the published totals stay monotonic, and the
+# restart count of each worker is published as supervisor_workers lines.
+
+import argparse
+from dataclasses import dataclass
+import multiprocessing as mp
+import queue
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import zmq
+
+from counters import CounterSnapshot, CounterStore, INGEST_FIELDS
+from decode import decode_msg
+from monitor_pacman import default_influx_writer
+from rates import RollingRates
+from util import get_data_socket, stop_processes
+
+
+def worker_main(group: int, generation: int, urls: List[str],
+                out_queue: mp.Queue, stop: mp.Event, interval: float):
+    store = CounterStore(num_tiles=len(urls))
+    poller = zmq.Poller()
+    tiles = {}
+    for tile, url in enumerate(urls):
+        socket = get_data_socket(url)
+        poller.register(socket, zmq.POLLIN)
+        tiles[socket] = tile
+
+    last = time.monotonic()
+    while not stop.is_set():
+        for socket, _ in poller.poll(timeout=100):
+            store.record(decode_msg(socket.recv()), tile=tiles[socket])
+
+        now = time.monotonic()
+        if now - last >= interval:
+            out_queue.put((group, generation, store.snapshot()))
+            last = now
+
+
+def empty_snapshot(num_tiles: int) -> CounterSnapshot:
+    return CounterStore(num_tiles=num_tiles).snapshot()
+
+
+@dataclass
+class Worker:
+    group: int
+    tiles: List[int]            # indices into Supervisor.tile_ids
+    urls: List[str]
+    process: mp.Process = None
+    restarts: int = 0
+
+
+class Supervisor:
+    def __init__(self, endpoints: List[Tuple[int, str]], writer=None,
+                 group_size=1, interval=1.):
+        self.tile_ids = [tile_id for tile_id, _ in endpoints]
+        self.writer = writer
+        self.interval = interval
+
+        # spawn, not fork: crashed workers are restarted while the Influx
+        # writer thread and ZMQ contexts are alive, and a forked child would
+        # inherit them in whatever state they were in
+        self.ctx = mp.get_context('spawn')
+        self.queue = self.ctx.Queue()
+        self.stop_event = self.ctx.Event()
+
+        self.workers = []
+        for group, first in enumerate(range(0, len(endpoints), group_size)):
+            tiles = list(range(first, min(first + group_size, len(endpoints))))
+            urls = [endpoints[tile][1] for tile in tiles]
+            self.workers.append(Worker(group, tiles, urls))
+
+        num_tiles = len(endpoints)
+        self.latest = empty_snapshot(num_tiles)  # as reported by live workers
+        self.offset = empty_snapshot(num_tiles)  # from workers that died
+        self.rates: Dict[int, Tuple[float, float]] = {}  # tile_id -> msgs/s, words/s
+        self._prev = None
+        self.rolling = RollingRates(interval=interval)
+
+    def _spawn(self, worker: Worker):
+        worker.process = self.ctx.Process(
+            target=worker_main, name=f'pacmon-worker-{worker.group}',
+            args=(worker.group, worker.restarts, worker.urls, self.queue,
+                  self.stop_event, self.interval),
+            daemon=True)
+        worker.process.start()
+
+    def start(self):
+        for worker in self.workers:
+            self._spawn(worker)
+        return self
+
+    def stop(self, timeout=2.):
+        self.stop_event.set()
+        stop_processes([worker.process for worker in self.workers],
+                       self.collect, timeout)
+
+    def check_workers(self, verbose=False):
+        for worker in self.workers:
+            if worker.process.is_alive():
+                continue
+            if verbose:
+                print(f'worker {worker.group} ({", ".join(worker.urls)}) exited '
+                      f'with {worker.process.exitcode}, restarting', file=sys.stderr)
+            for name in ('word_types', 'data', 'config', 'ingest'):
+                offset, latest = getattr(self.offset, name), getattr(self.latest, name)
+                offset[worker.tiles] += latest[worker.tiles]
+                latest[worker.tiles] = 0
+            worker.restarts += 1
+            self._spawn(worker)
+
+    def collect(self, timeout=0.):
+        "Merge snapshots from the workers into self.latest"
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                group, generation, snap = self.queue.get(
+                    timeout=max(0., deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            worker = self.workers[group]
+            if generation != worker.restarts:
+                continue        # sent by a worker that has since been replaced
+            tiles = worker.tiles
+            for name in ('word_types', 'data', 'config', 'ingest'):
+                getattr(self.latest, name)[tiles] = getattr(snap, name)
+            self.latest.time = max(self.latest.time, snap.time)
+
+    def snapshot(self) -> CounterSnapshot:
+        return CounterSnapshot(
+            time=time.time(),
+            word_types=self.offset.word_types + self.latest.word_types,
+            data=self.offset.data + self.latest.data,
+            config=self.offset.config + self.latest.config,
+            ingest=self.offset.ingest + self.latest.ingest)
+
+    def update_rates(self, snap: CounterSnapshot):
+        if self._prev is not None:
+            dt = snap.time - self._prev.time
+            delta = snap.ingest - self._prev.ingest
+            if dt > 0:
+                msgs = delta[:, INGEST_FIELDS.index('messages')] / dt
+                words = delta[:, INGEST_FIELDS.index('words')] / dt
+                self.rates = {tile_id: (msgs[i], words[i])
+                              for i, tile_id in enumerate(self.tile_ids)}
+        self._prev = snap
+
+    def print_rates(self):
+        print('  '.join(f'tile {tile_id}: {msgs:.0f} msg/s {words:.0f} words/s'
+                        for tile_id, (msgs, words) in self.rates.items()),
+              file=sys.stderr)
+
+    def lines(self, ts: int) -> List[str]:
+        "Line protocol: supervisor_workers, the worker serving each tile"
+        return [f'supervisor_workers,tile_id={self.tile_ids[tile]} '
+                f'group={worker.group}i,restarts={worker.restarts}i,'
+                f'alive={str(worker.process.is_alive()).lower()} {ts}'
+                for worker in self.workers for tile in worker.tiles]
+
+    def run(self, verbose=False):
+        while True:
+            self.collect(timeout=self.interval)
+            self.check_workers(verbose)
+            snap = self.snapshot()
+            self.update_rates(snap)
+            self.rolling.update(snap)
+            if self.writer is not None:
+                ts = int(snap.time * 1e9)
+                self.writer.submit(snap, self.rolling.lines(ts, self.tile_ids)
+                                   + self.lines(ts))
+            if verbose:
+                self.print_rates()
+
+
+def parse_endpoint(arg: str) -> Tuple[int, str]:
+    tile_id, url = arg.split('=', 1)
+    return int(tile_id), url
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monitor several PACMANs')
+    parser.add_argument('endpoints', nargs='+', type=parse_endpoint,
+                        metavar='TILE_ID=URL',
+                        help='e.g. 3=tcp://pacman32.local:5556')
+    parser.add_argument('--group-size', type=int, default=1,
+                        help='endpoints handled by each worker process')
+    parser.add_argument('--interval', type=float, default=1.,
+                        help='seconds between snapshots')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print rates and worker restarts to stderr')
+    args = parser.parse_args()
+
+    tile_ids = [tile_id for tile_id, _ in args.endpoints]
+    writer = default_influx_writer()
+    writer.tile_ids = tile_ids
+    supervisor = Supervisor(args.endpoints, writer,
+                            group_size=args.group_size, interval=args.interval)
+    supervisor.start()
+    writer.start()
+    try:
+        supervisor.run(verbose=args.verbose)
+    finally:
+        supervisor.stop()
+        writer.stop()
+
+
+if __name__ == '__main__':
+    main()
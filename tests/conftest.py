@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from capture import CaptureWriter
+from format import Msg, MsgType, WordType
+
+
+def random_msg(num_words, seed=0):
+    rng = random.Random(seed)
+    words = []
+    for _ in range(num_words):
+        if rng.random() < 0.9:
+            words.append({'type': WordType.Data,
+                          'content': {'io_channel': rng.randint(1, 32),
+                                      'timestamp': rng.getrandbits(32),
+                                      'packet': rng.getrandbits(64).to_bytes(8, 'little')}})
+        else:
+            words.append({'type': WordType.Sync,
+                          'content': {'type': ord('S'), 'clk_source': 0,
+                                      'timestamp': rng.getrandbits(32)}})
+    return Msg.build({'type': MsgType.Data, 'timestamp': 1,
+                      'num_words': len(words), 'words': words})
+
+
+def wait_for(cond, timeout=5.):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+class ListWriter:
+    "Stands in for InfluxWriter"
+
+    def __init__(self):
+        self.submitted = []
+
+    def start(self):
+        return self
+
+    def submit(self, snap, extra_lines=(), block=False, evict=True):
+        self.submitted.append((snap, list(extra_lines), block))
+        return True
+
+
+def make_capture(tmp_path, num_msgs=50, spacing_ns=100_000_000):
+    writer = CaptureWriter(str(tmp_path), chunk_bytes=4096)
+    raws = [random_msg(n, seed=n) for n in range(num_msgs)]
+    t0 = 1_700_000_000 * 10**9
+    for i, raw in enumerate(raws):
+        writer.write(raw, recv_ns=t0 + i * spacing_ns)
+    writer.close()
+    return writer.paths, raws, t0
+
+
+class FakeInflux:
+    "Local stand-in for the InfluxDB v2 write endpoint"
+
+    def __init__(self):
+        self.requests = []      # (query params, body) of accepted writes
+        self.fail = False       # respond 503 while set
+        self.delay = 0.         # seconds to stall each request
+        self.hits = 0
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                fake.hits += 1
+                if fake.delay:
+                    threading.Event().wait(fake.delay)
+                if fake.fail:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                query = parse_qs(urlparse(self.path).query)
+                fake.requests.append((query, body.decode()))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def lines(self):
+        return [line for _, body in self.requests for line in body.split('\n')]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_influx():
+    fake = FakeInflux()
+    yield fake
+    fake.close()
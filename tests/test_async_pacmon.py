@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+import time
+
+import zmq
+
+from async_pacmon import AsyncPacmon
+from counters import CounterStore
+from decode import decode_msg
+
+from conftest import ListWriter, random_msg
+
+
+def bind_pub(ctx):
+    pub = ctx.socket(zmq.PUB)
+    pub.bind('tcp://127.0.0.1:*')
+    return pub, pub.getsockopt(zmq.LAST_ENDPOINT).decode()
+
+
+def test_flushes_without_traffic():
+    ctx = zmq.Context()
+    pub, endpoint = bind_pub(ctx)
+    writer = ListWriter()
+    monitor = AsyncPacmon(endpoint, influx_writer=writer, interval=0.05,
+                          heartbeat_interval=0.1)
+    try:
+        monitor.run(duration=0.5)
+    finally:
+        pub.close(linger=0)
+        ctx.term()
+
+    snaps = [snap for snap, _, _ in writer.submitted if snap is not None]
+    # on schedule (plus the final flush) although nothing was published
+    assert 8 <= len(snaps) <= 12
+    assert monitor.heartbeats >= 4
+    heartbeats = [lines[0] for snap, lines, _ in writer.submitted if snap is None]
+    assert heartbeats[0].startswith('pacmon_heartbeat,host=')
+    assert 'seconds_since_message=-1.000' in heartbeats[0]
+
+
+def test_counts_data_and_streams():
+    ctx = zmq.Context()
+    pub, endpoint = bind_pub(ctx)
+    echo, echo_endpoint = bind_pub(ctx)
+    raws = [random_msg(20 + i, seed=i) for i in range(30)]
+    echoed = []
+    writer = ListWriter()
+    monitor = AsyncPacmon(endpoint, influx_writer=writer, interval=0.1)
+    monitor.add_stream('echo', echo_endpoint, handler=lambda raw: echoed.append(bytes(raw)))
+
+    def publish():
+        time.sleep(0.3)         # let the subscriptions connect
+        for raw in raws:
+            pub.send(raw)
+            echo.send(raw)
+        deadline = time.time() + 5
+        while monitor.source.received < len(raws) and time.time() < deadline:
+            time.sleep(0.01)
+        monitor.stop()
+
+    thread = threading.Thread(target=publish)
+    thread.start()
+    try:
+        monitor.run(duration=10)
+    finally:
+        thread.join()
+        pub.close(linger=0)
+        echo.close(linger=0)
+        ctx.term()
+
+    expected = CounterStore()
+    for raw in raws:
+        expected.record(decode_msg(raw))
+    snap = writer.submitted[-1][0]
+    assert (snap.data == expected.snapshot().data).all()
+    assert echoed == raws
+    stream_line = [line for line in writer.submitted[-1][1] if line.startswith('stream,')]
+    assert stream_line[0].startswith(f'stream,name=echo messages=30i,'
+                                     f'words={sum(range(20, 50))}i,')
+
+
+def test_stop_cancels_tasks():
+    ctx = zmq.Context()
+    pub, endpoint = bind_pub(ctx)
+    monitor = AsyncPacmon(endpoint, influx_writer=ListWriter(), interval=10.)
+
+    async def stop_soon():
+        task = asyncio.create_task(monitor.main())
+        await asyncio.sleep(0.1)
+        monitor.stop()
+        await asyncio.wait_for(task, timeout=2)
+
+    try:
+        start = time.perf_counter()
+        asyncio.run(stop_soon())
+        assert time.perf_counter() - start < 1
+    finally:
+        pub.close(linger=0)
+        ctx.term()
+    assert monitor.flushes == 1     # the final one
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import os
+
+import pytest
+
+from capture import CaptureReader, CaptureWriter, INDEX_SUFFIX
+
+
+def messages(n):
+    return [bytes([i % 256]) * (8 + 16 * (i % 5)) for i in range(n)]
+
+
+@pytest.mark.parametrize('compress_level', [None, 1])
+def test_roundtrip(tmp_path, compress_level):
+    msgs = messages(1000)
+    writer = CaptureWriter(str(tmp_path), chunk_bytes=4096,
+                           compress_level=compress_level)
+    for i, raw in enumerate(msgs):
+        writer.write(raw, recv_ns=1000 * i)
+    writer.close()
+    assert len(writer.paths) == 1
+
+    with CaptureReader(writer.paths[0]) as reader:
+        assert len(reader) == len(msgs)
+        assert len(reader.chunks) > 5
+        assert bytes(reader[0]) == msgs[0]
+        assert bytes(reader[777]) == msgs[777]
+        assert bytes(reader[999]) == msgs[999]
+        assert reader.recv_ns(500) == 500_000
+        with pytest.raises(IndexError):
+            reader[1000]
+
+        assert reader.find_time(0) == 0
+        assert reader.find_time(123_456) == 124
+        assert reader.find_time(10**9) == 1000
+
+        got = [(t, bytes(raw)) for t, raw in reader.messages(200_000, 300_000)]
+        assert got == [(1000 * i, msgs[i]) for i in range(200, 300)]
+        assert len(list(reader.messages())) == 1000
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    msgs = messages(300)
+    writer = CaptureWriter(str(tmp_path), chunk_bytes=1024, compress_level=6)
+    for i, raw in enumerate(msgs):
+        writer.write(raw, recv_ns=i)
+    writer.close()
+    path = writer.paths[0]
+    os.remove(path[:-len('.pmcap')] + INDEX_SUFFIX)
+
+    # a chunk that was cut off mid-write is ignored
+    with open(path, 'ab') as f:
+        f.write(b'CHNK' + b'\xff' * 20)
+
+    with CaptureReader(path) as reader:
+        assert len(reader) == 300
+        assert [bytes(raw) for _, raw in reader.messages()] == msgs
+
+
+def test_file_rotation(tmp_path):
+    writer = CaptureWriter(str(tmp_path), chunk_bytes=1000, max_file_bytes=5000)
+    msgs = messages(500)
+    for raw in msgs:
+        writer.write(raw)
+    writer.close()
+    assert len(writer.paths) > 1
+
+    got = []
+    for path in writer.paths:
+        with CaptureReader(path) as reader:
+            got += [bytes(raw) for _, raw in reader.messages()]
+    assert got == msgs
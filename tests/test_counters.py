@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from counters import CounterStore, DecodeSampler, DATA_FIELDS, CONFIG_FIELDS
+from counters import WORD_TYPES
+from decode import decode_msg
+from format import Msg, WordType, PACKET_TYPE_MAP
+from util import parity64
+
+from conftest import random_msg
+
+
+def reference_counts(raw):
+    "Per-word counting as originally done in Pacmon.record_type/record_statuses"
+    word_types = dict.fromkeys(WORD_TYPES, 0)
+    data, config = {}, {}
+    for word in Msg.parse(raw).words:
+        if word.type is not WordType.Data:
+            word_types[word.type] += 1
+            continue
+        packet = word.content.packet
+        packet_type = PACKET_TYPE_MAP[packet[0] & 3]
+        word_types[packet_type] += 1
+
+        valid = parity64(packet)
+        ds = packet[7] & 0x40 == 0x40
+        is_read = packet_type == WordType.Read
+        is_write = packet_type == WordType.Write
+        is_config = is_read or is_write
+
+        d = data.setdefault(word.content.io_channel, dict.fromkeys(DATA_FIELDS, 0))
+        c = config.setdefault(word.content.io_channel, dict.fromkeys(CONFIG_FIELDS, 0))
+        d['total'] += 1
+        d['valid_parity' if valid else 'invalid_parity'] += 1
+        d['downstream' if ds else 'upstream'] += 1
+        c['total'] += is_config
+        c['invalid_parity'] += is_config and not valid
+        c['ds_read'] += is_read and ds
+        c['ds_write'] += is_write and ds
+        c['us_read'] += is_read and not ds
+        c['us_write'] += is_write and not ds
+    return word_types, data, config
+
+
+def test_record_matches_reference():
+    store = CounterStore(num_tiles=2)
+    raws = [random_msg(n, seed=n) for n in (0, 1, 50, 1000)]
+    for raw in raws:
+        store.record(decode_msg(raw), tile=1)
+
+    snap = store.snapshot()
+    assert not snap.word_types[0].any()
+    assert not snap.data[0].any()
+
+    word_types = dict.fromkeys(WORD_TYPES, 0)
+    data, config = {}, {}
+    for raw in raws:
+        wt, d, c = reference_counts(raw)
+        for k, v in wt.items():
+            word_types[k] += v
+        for chan, fields in d.items():
+            acc = data.setdefault(chan, dict.fromkeys(DATA_FIELDS, 0))
+            for k, v in fields.items():
+                acc[k] += v
+        for chan, fields in c.items():
+            acc = config.setdefault(chan, dict.fromkeys(CONFIG_FIELDS, 0))
+            for k, v in fields.items():
+                acc[k] += v
+
+    assert dict(zip(WORD_TYPES, snap.word_types[1].tolist())) == word_types
+    assert sorted(snap.active_channels(1).tolist()) == sorted(data)
+    for chan in data:
+        assert dict(zip(DATA_FIELDS, snap.data[1, chan].tolist())) == data[chan]
+        assert dict(zip(CONFIG_FIELDS, snap.config[1, chan].tolist())) == config[chan]
+
+
+def test_snapshot_is_a_copy():
+    store = CounterStore()
+    store.record(decode_msg(random_msg(10)))
+    snap = store.snapshot()
+    before = snap.data.copy()
+    store.record(decode_msg(random_msg(10)))
+    assert np.array_equal(snap.data, before)
+    assert store.snapshot().data.sum() > before.sum()
+
+
+def test_header_scan_matches_record():
+    full, split = CounterStore(), CounterStore()
+    for seed in range(5):
+        raw = random_msg(300, seed=seed)
+        full.record(decode_msg(raw))
+        header = split.record_header(raw)
+        assert int(header['num_words']) == 300
+        split.record_packets(decode_msg(raw))
+    full, split = full.snapshot(), split.snapshot()
+    for name in ('word_types', 'data', 'config', 'ingest'):
+        assert np.array_equal(getattr(full, name), getattr(split, name))
+    assert not split.estimated(0)
+
+
+def test_sampled_counts_are_scaled():
+    store = CounterStore()
+    raw = random_msg(100)
+    msg = decode_msg(raw)
+    store.record_header(raw, decoded=False)
+    store.record_header(raw, decoded=False)
+    store.record_header(raw)
+    store.record_packets(msg, weight=3)
+    snap = store.snapshot()
+
+    reference = CounterStore()
+    reference.record(msg)
+    reference = reference.snapshot()
+    assert np.array_equal(snap.word_types, 3 * reference.word_types)
+    assert np.array_equal(snap.data, 3 * reference.data)
+    assert snap.ingest[0].tolist() == [3, 300, 3 * len(raw), 2]
+    assert snap.estimated(0)
+
+    # only an interval in which messages were skipped is estimated
+    store.record_header(raw)
+    store.record_packets(msg)
+    later = store.snapshot()
+    assert later.estimated(0) and not later.estimated(0, prev=snap)
+    store.record_header(raw, decoded=False)
+    assert store.snapshot().estimated(0, prev=later)
+
+
+def test_decode_sampler():
+    sampler = DecodeSampler(threshold=100, max_ratio=8, adjust_every=10)
+    weights = [sampler.weight(backlog=0) for _ in range(50)]
+    assert weights == [1] * 50 and sampler.ratio == 1
+
+    # overloaded: the ratio climbs to the cap, and the weights of the decoded
+    # messages always add up to the messages seen
+    weights += [sampler.weight(backlog=1000) for _ in range(100)]
+    assert sampler.ratio == 8
+    assert sum(weights) + sampler._pending == sampler.seen == 150
+    assert weights[-8:].count(0) == 7
+
+    weights += [sampler.weight(backlog=0) for _ in range(100)]
+    assert sampler.ratio == 1
+    assert sum(weights) == 250
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import curses
+
+from counters import CounterStore
+from dashboard import COLUMN_WIDTH, CellRenderer, Dashboard, frame_cells, table_cells
+from decode import decode_msg
+
+from conftest import random_msg
+
+
+class FakeWindow:
+    def __init__(self, height=80, width=120):
+        self.size = (height, width)
+        self.writes = []
+
+    def getmaxyx(self):
+        return self.size
+
+    def addstr(self, row, col, text):
+        self.writes.append((row, col, text))
+
+    def noutrefresh(self):
+        pass
+
+    def erase(self):
+        pass
+
+
+def make_snapshot(num_msgs=1):
+    store = CounterStore()
+    for seed in range(num_msgs):
+        store.record(decode_msg(random_msg(200, seed=seed)))
+    return store.snapshot()
+
+
+def test_frame_cells():
+    snap = make_snapshot()
+    channels = snap.active_channels(0).tolist()
+    cells = frame_cells(snap, start=0., show_data=True, show_config=False)
+    text = '\n'.join(cells.values())
+    assert 'Data packets per I/O channel:' in text
+    assert 'Config packets' not in text
+    assert f'| {snap.word_types[0, 0]}' in cells.values()
+    rows = {}
+    for (row, col), value in sorted(cells.items()):
+        rows.setdefault(row, []).append(value)
+    for chan in channels:
+        total = snap.data[0, chan, 0]
+        assert any(values[:2] == [f'| {chan}', f'| {total}'] for values in rows.values())
+
+    cells = frame_cells(snap, start=0., show_data=False, show_config=True)
+    text = '\n'.join(cells.values())
+    assert 'Data packets' not in text and 'Config packets' in text
+    assert 'waiting' in '\n'.join(frame_cells(None, start=0.).values())
+
+
+def test_values_fit_their_column():
+    snap = make_snapshot()
+    for name in ('word_types', 'data', 'config'):
+        getattr(snap, name)[...] *= 10**12
+    cells = frame_cells(snap, start=0., show_data=True, show_config=True)
+    for (row, col), text in cells.items():
+        if text.startswith('| '):
+            assert len(text) <= COLUMN_WIDTH, text
+            assert (row, col + COLUMN_WIDTH) in cells
+    snap.data[0, snap.active_channels(0)[0], 0] = 12_345_678_901_234
+    cells = frame_cells(snap, start=0., show_data=True)
+    assert '| 12.3T' in cells.values()
+
+    cells, _ = table_cells(0, 'title', ('a', 'b', 'c'),
+                           [[1, 123456789012345, 'a very long string value']])
+    assert [cells[(4, 1 + i * COLUMN_WIDTH)] for i in range(3)] == [
+        '| 1', '| 123.5T', '| a very long s']
+
+
+def test_only_changed_cells_are_written(monkeypatch):
+    monkeypatch.setattr(curses, 'doupdate', lambda: None)
+    window = FakeWindow()
+    renderer = CellRenderer(window)
+    renderer.render({(0, 0): 'abc', (1, 0): 'long text', (2, 0): 'same'})
+    assert len(window.writes) == 3
+
+    window.writes.clear()
+    renderer.render({(0, 0): 'abd', (2, 0): 'same'})
+    # the changed cell, and blanks over the vanished one
+    assert sorted(window.writes) == [(0, 0, 'abd'), (1, 0, ' ' * 9)]
+
+    window.writes.clear()
+    renderer.render({(0, 0): 'x', (2, 0): 'same'})
+    assert window.writes == [(0, 0, 'x  ')]
+
+    window.writes.clear()
+    renderer.render({(0, 0): 'x', (2, 0): 'same'})
+    assert window.writes == []
+
+
+def test_keys_toggle_tables():
+    dashboard = Dashboard(lambda: make_snapshot(), tile_ids=[3, 4])
+    assert dashboard.show_data and not dashboard.show_config
+    assert dashboard.key(ord('c'))
+    assert dashboard.key(ord('d'))
+    assert not dashboard.show_data and dashboard.show_config
+    dashboard.key(ord('t'))
+    assert dashboard.tile == 1
+    dashboard.key(ord('t'))
+    assert dashboard.tile == 0
+    assert not dashboard.key(ord('q'))
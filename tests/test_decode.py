@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from decode import decode_msg, WORD_TYPE_NAMES
+from format import Msg, MsgType, WordType
+
+
+def sample_words():
+    return [
+        {'type': WordType.Data,
+         'content': {'io_channel': 3, 'timestamp': 4321,
+                     'packet': bytes.fromhex('0123456789abcdef')}},
+        {'type': WordType.Trig,
+         'content': {'type': 2, 'timestamp': 0xdeadbeef}},
+        {'type': WordType.Sync,
+         'content': {'type': ord('S'), 'clk_source': 1, 'timestamp': 77}},
+        {'type': WordType.Ping, 'content': {}},
+        {'type': WordType.Write, 'content': {'write1': 10, 'write2': 20}},
+        {'type': WordType.Read, 'content': {'read1': 30, 'read2': 40}},
+        {'type': WordType.Error, 'content': {'err': 5}},
+        {'type': WordType.Data,
+         'content': {'io_channel': 32, 'timestamp': 2**32 - 1,
+                     'packet': bytes.fromhex('ffffffffffffffff')}},
+    ]
+
+
+def build(words):
+    return Msg.build({'type': MsgType.Data,
+                      'timestamp': 1234,
+                      'num_words': len(words),
+                      'words': words})
+
+
+def test_decode_matches_construct():
+    raw = build(sample_words())
+    ref = Msg.parse(raw)
+    msg = decode_msg(raw)
+
+    assert msg.type == ord('D')
+    assert msg.timestamp == ref.timestamp
+    assert msg.num_words == ref.num_words == len(msg.word_type)
+
+    for i, word in enumerate(ref.words):
+        assert WORD_TYPE_NAMES[msg.word_type[i]] == word.type
+        content = word.content
+        if word.type == WordType.Data:
+            assert msg.io_channel[i] == content.io_channel
+            assert msg.word_timestamp[i] == content.timestamp
+            assert msg.packet[i] == int.from_bytes(content.packet, 'little')
+        elif word.type in (WordType.Trig, WordType.Sync):
+            assert msg.words['sub_type'][i] == content.type
+            assert msg.word_timestamp[i] == content.timestamp
+            if word.type == WordType.Sync:
+                assert msg.words['clk_source'][i] == content.clk_source
+        elif word.type == WordType.Write:
+            assert msg.words['value1'][i] == content.write1
+            assert msg.words['value2'][i] == content.write2
+        elif word.type == WordType.Read:
+            assert msg.words['value1'][i] == content.read1
+            assert msg.words['value2'][i] == content.read2
+        elif word.type == WordType.Error:
+            assert msg.words['err'][i] == content.err
+
+        if word.type != WordType.Data:
+            assert msg.io_channel[i] == 0
+            assert msg.packet[i] == 0
+
+
+def test_decode_empty():
+    msg = decode_msg(build([]))
+    assert msg.num_words == 0
+    assert msg.packet.dtype == np.uint64
+    assert len(msg.packet) == 0
+
+
+def test_decode_truncated():
+    raw = build(sample_words())
+    with pytest.raises(ValueError):
+        decode_msg(raw[:-1])
+    with pytest.raises(ValueError):
+        decode_msg(raw[:5])
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+import io
+import json
+
+import numpy as np
+import pytest
+
+from decode import DATA, SYNC, decode_msg
+from dump import compile_filter, dump
+import kernels
+
+from conftest import random_msg
+
+
+def test_filter_matches_loop():
+    msg = decode_msg(random_msg(500, seed=1))
+    mask = compile_filter('io_channel in (3, 7) and not parity_ok '
+                          'or word_type == Sync and 0 < timestamp < 2**31')
+    expected = []
+    for word_type, io_channel, timestamp, packet in zip(
+            msg.word_type.tolist(), msg.io_channel.tolist(),
+            msg.word_timestamp.tolist(), msg.packet.tolist()):
+        parity_ok = kernels.parity_ok(np.array([packet], dtype=np.uint64))[0]
+        expected.append((word_type == DATA and io_channel in (3, 7) and not parity_ok)
+                        or (word_type == SYNC and 0 < timestamp < 2**31))
+    assert mask(msg).tolist() == expected
+    assert any(expected)
+
+
+def test_packet_fields_only_match_data_words():
+    msg = decode_msg(random_msg(200, seed=2))
+    is_data = msg.word_type == DATA
+    assert np.array_equal(compile_filter('not parity_ok or parity_ok')(msg), is_data)
+    assert np.array_equal(compile_filter('io_channel < 9 or not io_channel < 9')(msg),
+                          is_data)
+    # unknown and false is false, so its negation matches every word
+    assert compile_filter('not (adc > 9000 and word_type == Data)')(msg).all()
+    assert compile_filter('msg_timestamp == 1')(msg).all()
+
+
+@pytest.mark.parametrize('expression', ['__import__("os")', 'nope == 1',
+                                        'io_channel.real', 'io_channel ==',
+                                        '[x for x in io_channel]',
+                                        'io_channel is 1', 'io_channel is not 1'])
+def test_bad_filters(expression):
+    with pytest.raises(ValueError):
+        compile_filter(expression)
+
+
+def test_dump_formats():
+    raw = random_msg(300, seed=3)
+    msg = decode_msg(raw)
+    mask = compile_filter('packet_type == Write and downstream')
+    selected = np.flatnonzero(mask(msg))
+
+    out = io.StringIO()
+    assert dump([raw, raw], mask, 'json', out=out) == (2, 2 * len(selected))
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert all(r['packet_type'] == 'Write' and r['downstream'] for r in records)
+    assert [int(r['packet'], 16) for r in records[:len(selected)]] == \
+        msg.packet[selected].tolist()
+
+    out = io.StringIO()
+    assert dump([raw], mask, 'hex', limit=2, out=out) == (1, 2)
+    lines = out.getvalue().splitlines()
+    assert bytes.fromhex(lines[0]) == raw[8 + 16 * selected[0]:8 + 16 * (selected[0] + 1)]
+
+    out = io.StringIO()
+    dump([raw], mask, 'line', out=out)
+    assert all(' Write ' in line and line.endswith(' ds')
+               for line in out.getvalue().splitlines())
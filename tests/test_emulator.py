@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import threading
+
+import numpy as np
+import zmq
+
+from counters import CounterStore, DATA_FIELDS, WORD_TYPES
+from decode import decode_msg, SYNC, TRIG
+from emulator import Emulator, EmulatorConfig, MessageEncoder, echo_message
+from format import Msg
+import kernels
+
+
+def test_encoder_is_valid_and_follows_config():
+    config = EmulatorConfig(words_per_msg=20_000, io_channels=[3, 4],
+                            io_channel_weights=[3, 1],
+                            packet_type_fractions=(0.5, 0, 0.25, 0.25),
+                            parity_error_fraction=0.1, downstream_fraction=0.2,
+                            trig_interval=0.5, sync_interval=1., seed=1,
+                            bank_words=1 << 12)
+    encoder = MessageEncoder(config)
+
+    raw = encoder.message(now=100.)
+    ref = Msg.parse(raw)
+    msg = decode_msg(raw)
+    assert ref.num_words == msg.num_words == 20_002
+    assert ref.timestamp == 100
+    assert ref.words[-2].type == 'Trig' and ref.words[-1].type == 'Sync'
+    assert msg.word_type[-2:].tolist() == [TRIG, SYNC]
+
+    store = CounterStore()
+    store.record(msg)
+    snap = store.snapshot()
+    data = dict(zip(DATA_FIELDS, snap.data[0].sum(axis=0).tolist()))
+    assert snap.active_channels(0).tolist() == [3, 4]
+    assert 0.7 < snap.data[0, 3, 0] / data['total'] < 0.8
+    assert 0.08 < data['invalid_parity'] / data['total'] < 0.12
+    assert 0.17 < data['downstream'] / data['total'] < 0.23
+    word_types = dict(zip(WORD_TYPES, snap.word_types[0].tolist()))
+    assert word_types['Error'] == 0
+    assert 0.45 < word_types['Data'] / data['total'] < 0.55
+
+    # Trig/Sync cadence follows the time passed in
+    assert len(encoder.words(10, now=100.2)) == 10
+    assert len(encoder.words(10, now=100.6)) == 11
+    assert len(encoder.words(10, now=101.1)) == 12
+
+
+def test_echo_message():
+    config = EmulatorConfig(words_per_msg=1000, downstream_fraction=0.5,
+                            packet_type_fractions=(0, 0, 1, 0), seed=2)
+    raw = MessageEncoder(config).message(now=5.)
+    echo = Msg.parse(echo_message(raw))
+    assert echo.type == 'Request'
+    assert 400 < echo.num_words < 600
+    packets = np.array([int.from_bytes(w.content.packet, 'little') for w in echo.words],
+                       dtype=np.uint64)
+    assert kernels.downstream(packets).all()
+
+
+def test_emulator_publishes():
+    emulator = Emulator(EmulatorConfig(words_per_s=1e6, words_per_msg=100),
+                        data_bind='tcp://127.0.0.1:*')
+    endpoint = emulator.data_socket.getsockopt(zmq.LAST_ENDPOINT).decode()
+    ctx = zmq.Context()
+    sub = ctx.socket(zmq.SUB)
+    sub.setsockopt(zmq.SUBSCRIBE, b'')
+    sub.setsockopt(zmq.RCVTIMEO, 5000)
+    sub.connect(endpoint)
+    thread = threading.Thread(target=emulator.run, args=(1.,))
+    thread.start()
+    try:
+        msg = decode_msg(sub.recv())
+        assert msg.num_words >= 100
+    finally:
+        thread.join()
+        sub.close(linger=0)
+        ctx.term()
+        emulator.close()
+    # paced close to the requested rate
+    assert 0.8e6 < emulator.sent_words < 1.2e6
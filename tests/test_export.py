@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from decode import DATA, decode_msg
+from export import COLUMNS, ColumnBatcher, ColumnFileWriter, export
+import kernels
+
+from conftest import random_msg
+
+
+def test_batches_are_bounded_and_complete():
+    raws = [random_msg(n, seed=n) for n in (70, 0, 130, 45)]
+    batches = []
+    batcher = ColumnBatcher(lambda batch: batches.append(
+        {name: column.copy() for name, column in batch.items()}), batch_rows=64)
+    for i, raw in enumerate(raws):
+        batcher.add(decode_msg(raw), recv_ns=1000 + i)
+    batcher.flush()
+
+    assert [len(batch['msg']) for batch in batches] == [64, 64, 64, 53]
+    columns = {name: np.concatenate([batch[name] for batch in batches])
+               for name, _ in COLUMNS}
+    msgs = [decode_msg(raw) for raw in raws]
+    assert batcher.messages == 4
+    assert np.array_equal(columns['msg'], np.repeat(np.arange(4), [70, 0, 130, 45]))
+    assert np.array_equal(columns['recv_ns'] - 1000, columns['msg'])
+    assert np.array_equal(columns['packet'], np.concatenate([m.packet for m in msgs]))
+    assert np.array_equal(columns['word_timestamp'],
+                          np.concatenate([m.word_timestamp for m in msgs]))
+
+    is_data = columns['word_type'] == DATA
+    packets = columns['packet'][is_data]
+    assert np.array_equal(columns['parity_ok'][is_data], kernels.parity_ok(packets))
+    assert np.array_equal(columns['packet_type'][is_data], kernels.packet_type(packets))
+    assert not columns['downstream'][~is_data].any()
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_file_round_trip(tmp_path, fmt):
+    pa = pytest.importorskip('pyarrow')
+    raws = [random_msg(200, seed=seed) for seed in range(5)]
+    writer = ColumnFileWriter(str(tmp_path), fmt=fmt, file_rows=300)
+    assert export(((i, raw) for i, raw in enumerate(raws)), writer,
+                  batch_rows=128) == 5
+    assert writer.rows == 1000 and len(writer.paths) > 1
+
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pa.concat_tables([pq.read_table(path, columns=['msg', 'packet'])
+                                  for path in writer.paths])
+    else:
+        table = pa.concat_tables([pa.ipc.open_file(path).read_all()
+                                  for path in writer.paths])
+    assert table.column('packet').to_numpy().tolist() == \
+        np.concatenate([decode_msg(raw).packet for raw in raws]).tolist()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import os
+
+import numpy as np
+
+from capture import CaptureReader
+from flight_recorder import FlightRecorder
+from monitor_pacman import Pacmon
+from replay import ReplaySource
+
+from conftest import ListWriter, make_capture, random_msg
+
+
+def held(recorder):
+    return [bytes(raw) for _, raw in recorder._messages(0)]
+
+
+def test_ring_is_bounded_by_bytes_and_age(tmp_path):
+    recorder = FlightRecorder(str(tmp_path), capacity_bytes=10_000, seconds=5.)
+    raws = [random_msg(1 + n % 20, seed=n) for n in range(200)]
+    for n, raw in enumerate(raws):
+        recorder.record(raw, 100. + n * 0.01)
+        assert recorder.bytes <= 10_000
+        assert recorder.bytes == sum(len(raw) for raw in held(recorder))
+        # the most recent messages, in order
+        assert held(recorder) == raws[n + 1 - recorder.count:n + 1]
+    assert recorder.count < 200
+
+    recorder.record(raws[0], 110.)
+    recorder.record(raws[1], 114.5)
+    assert held(recorder) == [raws[0], raws[1]]
+
+    recorder.record(bytes(20_000), 107.)
+    assert recorder.too_big == 1
+    assert recorder.count == 2
+
+
+def test_ring_is_bounded_by_messages(tmp_path):
+    recorder = FlightRecorder(str(tmp_path), capacity_bytes=1 << 20, max_messages=10)
+    raws = [random_msg(1, seed=n) for n in range(25)]
+    for n, raw in enumerate(raws):
+        recorder.record(raw, 100. + n * 0.01)
+    assert held(recorder) == raws[15:]
+    assert recorder.recv_ns.nbytes + recorder.offset.nbytes + recorder.length.nbytes == 160
+
+
+def test_dumps_are_pruned(tmp_path):
+    recorder = FlightRecorder(str(tmp_path), post_seconds=0., cooldown=0., max_dumps=2)
+    (tmp_path / 'other.pmcap').write_bytes(b'')
+    for n in range(4):
+        recorder.record(random_msg(2, seed=n), 100. + n)
+        recorder.trigger('test')
+        recorder.check(100. + n)
+        recorder.flush()
+        os.utime(recorder.last_path, (n, n))
+    assert recorder.dumps == 4
+    kept = sorted(path.name for path in tmp_path.iterdir())
+    assert len(kept) == 5 and 'other.pmcap' in kept
+    assert os.path.basename(recorder.last_path) in kept
+
+
+def test_trigger_dumps_window(tmp_path):
+    recorder = FlightRecorder(str(tmp_path), seconds=1., post_seconds=0.5)
+    raws = [random_msg(4, seed=n) for n in range(40)]
+    for n, raw in enumerate(raws[:20]):
+        recorder.record(raw, 100. + n * 0.25)
+        assert recorder.check(100. + n * 0.25) is None
+    recorder.trigger('test')
+    assert recorder.check(105.) == 'test'
+    for n, raw in enumerate(raws[20:]):
+        recorder.record(raw, 105. + n * 0.25)
+    recorder.wait(5)
+    assert recorder.dumps == 1
+    assert not recorder.frozen
+    assert '/trigger-test-' in recorder.last_path
+
+    with CaptureReader(recorder.last_path) as reader:
+        got = [(t, bytes(raw)) for t, raw in reader.messages()]
+    # from one second before the trigger to the end of the window
+    assert [raw for _, raw in got] == raws[16:22]
+    assert got[0][0] == 104 * 10**9
+
+
+def test_triggers_and_cooldown(tmp_path):
+    recorder = FlightRecorder(str(tmp_path), post_seconds=1., cooldown=60.,
+                              min_words=100, error_threshold=5)
+    words = np.array([[1000, 50]])
+    fine = np.array([[0.01, 0.5]])  # channel 1 has too few words to count
+    bad = np.array([[0.2, 0.]])
+    assert recorder.check(0., fine, words, errors=0, gaps=0) is None
+    assert recorder.check(1., fine, words, errors=4, gaps=0) is None
+    assert recorder.check(2., bad, words, errors=4, gaps=0) == 'parity'
+    recorder.flush()
+    assert recorder.dumps == 1
+
+    # automatic triggers wait out the cooldown, a manual one does not
+    assert recorder.check(10., bad, words, errors=20, gaps=3) is None
+    assert recorder.suppressed == 1
+    recorder.trigger('signal')
+    assert recorder.check(11., fine, words, errors=20, gaps=3) == 'signal'
+    # a manual trigger during the post-trigger window waits for the next dump
+    recorder.trigger('http')
+    assert recorder.check(11.5, fine, words, errors=20, gaps=3) is None
+    recorder.flush()
+    assert recorder.check(12., fine, words, errors=20, gaps=3) == 'http'
+    recorder.flush()
+    assert recorder.dumps == 3
+    assert recorder.check(80., fine, words, errors=30, gaps=3) == 'errors'
+    recorder.flush()
+    assert recorder.check(150., fine, words, errors=30, gaps=4) == 'gaps'
+
+
+def test_pacmon_recorder(tmp_path):
+    paths, raws, t0 = make_capture(tmp_path / 'capture')
+    writer = ListWriter()
+    pacmon = Pacmon(source=ReplaySource(paths), influx_writer=writer,
+                    recorder_dir=str(tmp_path / 'recorder'))
+    assert pacmon.poke() == 'flight recorder triggered\n'
+    pacmon.run()
+
+    recorder = pacmon.recorder
+    assert recorder.dumps == 1
+    assert recorder.recorded + recorder.skipped == len(raws)
+    with CaptureReader(recorder.last_path) as reader:
+        got = [bytes(raw) for _, raw in reader.messages()]
+    # triggered at the first flush, 1.1 s in, and written 2 s later
+    assert got == raws[:len(got)]
+    assert 31 <= len(got) < len(raws)
+    lines = [line for _, extra, _ in writer.submitted for line in extra]
+    assert any(line.startswith('flight_recorder messages=') for line in lines)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import time
+
+from counters import CounterStore
+from decode import decode_msg
+from influx_writer import InfluxWriter, snapshot_lines
+
+from conftest import random_msg, wait_for
+
+
+def test_snapshot_lines():
+    store = CounterStore(num_tiles=2)
+    store.record(decode_msg(random_msg(100)), tile=1)
+    snap = store.snapshot()
+    lines = snapshot_lines(snap, tile_ids=[5, 7])
+    ts = str(int(snap.time * 1e9))
+
+    assert all(line.endswith(' ' + ts) for line in lines)
+    assert lines[0].startswith('word_types,tile_id=5 Data=0i,')
+    assert lines[1].startswith('ingest,tile_id=5 messages=0i,words=0i,bytes=0i,undecoded=0i ')
+    assert lines[2].startswith('word_types,tile_id=7 ')
+    assert lines[3].startswith('ingest,tile_id=7 messages=1i,words=100i,bytes=1608i,undecoded=0i ')
+    num_chans = len(snap.active_channels(1))
+    assert len(lines) == 4 + 2 * num_chans
+    assert sum(line.startswith('data_statuses,') for line in lines) == num_chans
+    assert all('tile_id=7' in line for line in lines[2:])
+
+
+def test_one_request_per_snapshot(fake_influx):
+    store = CounterStore()
+    writer = InfluxWriter(fake_influx.url, 'token', 'org', 'bucket').start()
+    store.record(decode_msg(random_msg(200)))
+    writer.submit(store.snapshot())
+    writer.submit(store.snapshot())
+    wait_for(lambda: writer.stats.written == 2)
+    writer.stop()
+
+    assert len(fake_influx.requests) == 2
+    query, body = fake_influx.requests[0]
+    assert query['bucket'] == ['bucket']
+    assert query['precision'] == ['ns']
+    measurements = {line.split(',')[0].split(' ')[0] for line in body.split('\n')}
+    assert measurements == {'word_types', 'ingest', 'data_statuses',
+                            'config_statuses', 'influx_writer'}
+
+
+def test_submit_never_blocks(fake_influx):
+    fake_influx.delay = 0.5
+    store = CounterStore()
+    writer = InfluxWriter(fake_influx.url, 'token', 'org', 'bucket',
+                          max_queue=2).start()
+    start = time.perf_counter()
+    for _ in range(20):
+        writer.submit(store.snapshot())
+    assert time.perf_counter() - start < 0.1
+    assert writer.stats.dropped >= 17
+    assert writer.queue.qsize() <= 2
+    writer.stop(timeout=0.)
+
+
+def test_failures_are_counted(fake_influx):
+    fake_influx.fail = True
+    writer = InfluxWriter(fake_influx.url, 'token', 'org', 'bucket').start()
+    writer.submit(CounterStore().snapshot())
+    wait_for(lambda: writer.stats.failed == 1)
+    writer.stop()
+    assert writer.stats.written == 0
+    assert writer.last_error is not None
+
+
+def test_submit_without_evicting(fake_influx):
+    writer = InfluxWriter(fake_influx.url, 'token', 'org', 'bucket', max_queue=2)
+    snaps = [CounterStore().snapshot(t=float(t)) for t in range(2)]
+    for snap in snaps:
+        assert writer.submit(snap)
+    assert not writer.submit(None, ['pacmon_heartbeat received=0i 1'], evict=False)
+    assert writer.stats.skipped == 1 and writer.stats.dropped == 0
+    assert [writer.queue.get_nowait()[0] for _ in range(2)] == snaps
+    assert writer.submit(None, ['pacmon_heartbeat received=0i 1'], evict=False)
+    writer.client.close()
+
+
+def test_lines_without_snapshot(fake_influx):
+    writer = InfluxWriter(fake_influx.url, 'token', 'org', 'bucket').start()
+    writer.submit(None, ['pacmon_heartbeat received=0i 1'])
+    wait_for(lambda: writer.stats.written == 1)
+    writer.stop()
+    assert fake_influx.requests[0][1] == 'pacmon_heartbeat received=0i 1'
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from instrument import Histogram, Instruments, StatusServer, sample_stacks
+from monitor_pacman import Pacmon
+from replay import ReplaySource
+
+from conftest import ListWriter, make_capture
+
+
+def test_histogram():
+    h = Histogram()
+    for value in [1] * 90 + [1000] * 9 + [10**6]:
+        h.add(value)
+    assert h.count == 100
+    assert h.total == 90 + 9000 + 10**6
+    assert h.max == 10**6
+    assert h.quantile(0.5) == 1
+    assert h.quantile(0.95) == 1023
+    assert h.quantile(1.) == (1 << 20) - 1
+
+    since = list(h.buckets)
+    h.add(5000)
+    assert h.quantile(0.5, since) == 8191
+
+
+def test_lines_and_rates():
+    inst = Instruments()
+    inst.lines(10 * 10**9)
+    for _ in range(20):
+        inst.stages['parse'].add(2000)
+        inst.message(num_words=100, num_bytes=1608, lag=0.25)
+    lines = inst.lines(12 * 10**9)
+
+    assert lines[0] == ('pacmon_stage,stage=parse count=20i,total_ns=40000i,'
+                        'max_ns=2000i,p50_ns=2047i,p99_ns=2047i 12000000000')
+    health = lines[-1]
+    assert health.startswith('pacmon_health messages=20i,words=2000i,bytes=32160i,')
+    assert 'messages_per_s=10.0,words_per_s=1000.0,bytes_per_s=16080.0' in health
+    assert 'lag=0.25,max_lag_ns=250000000i' in health
+
+
+def test_status_server():
+    inst = Instruments()
+    inst.message(num_words=3, num_bytes=56, lag=0.)
+    server = StatusServer(inst, port=0).start()
+    try:
+        with urlopen(f'http://127.0.0.1:{server.port}/', timeout=5) as response:
+            text = response.read().decode()
+    finally:
+        server.stop()
+    assert 'messages 1\n' in text
+    assert 'words 3\n' in text
+
+
+def test_status_server_actions():
+    calls = []
+
+    def action():
+        calls.append(1)
+        return 'done\n'
+
+    server = StatusServer(Instruments(), port=0, actions={'/poke': action}).start()
+    url = f'http://127.0.0.1:{server.port}'
+    try:
+        with urlopen(Request(url + '/poke', method='POST'), timeout=5) as response:
+            assert response.read() == b'done\n'
+        with pytest.raises(HTTPError) as e:
+            urlopen(Request(url + '/other', method='POST'), timeout=5)
+        assert e.value.code == 404
+    finally:
+        server.stop()
+    assert calls == [1]
+
+
+def test_sample_stacks():
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy_loop)
+    thread.start()
+    try:
+        stacks = sample_stacks(thread.ident, duration=0.1)
+    finally:
+        stop.set()
+        thread.join()
+    assert sum(stacks.values()) > 10
+    assert all('test_instrument.py:busy_loop' in stack for stack in stacks)
+
+
+def test_pacmon_instruments(tmp_path):
+    paths, raws, _ = make_capture(tmp_path)
+    writer = ListWriter()
+    pacmon = Pacmon(source=ReplaySource(paths), influx_writer=writer)
+    pacmon.run()
+
+    inst = pacmon.instruments
+    assert inst.messages == len(raws)
+    assert inst.bytes == sum(len(raw) for raw in raws)
+    assert inst.stages['parse'].count == inst.stages['count'].count == len(raws)
+    assert inst.stages['flush'].count == len(writer.submitted)
+    extra_lines = writer.submitted[-1][1]
+    assert any(line.startswith('pacmon_stage,stage=count ') for line in extra_lines)
+    assert any(line.startswith('pacmon_health ') for line in extra_lines)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import random
+
+import numpy as np
+
+import kernels
+from util import parity64
+
+
+def random_packets(n, seed=0):
+    rng = random.Random(seed)
+    return [rng.getrandbits(64) for _ in range(n)]
+
+
+def test_parity_matches_parity64():
+    packets = random_packets(1000) + [0, 2**64 - 1, 1 << 63, 1]
+    expected = [parity64(p.to_bytes(8, 'big')) for p in packets]
+    got = kernels.parity_ok(np.array(packets, dtype=np.uint64))
+    assert got.tolist() == [bool(e) for e in expected]
+
+
+def test_decode_packets():
+    packets = random_packets(1000)
+    fields = kernels.decode_packets(np.array(packets, dtype=np.uint64))
+
+    def bits(p, lo, width):
+        return (p >> lo) & ((1 << width) - 1)
+
+    for i, p in enumerate(packets):
+        packet = p.to_bytes(8, 'little')
+        assert fields.packet_type[i] == packet[0] & 3
+        assert fields.downstream[i] == (packet[7] & 0x40 == 0x40)
+        assert fields.chip_id[i] == bits(p, 2, 8)
+        assert fields.channel_id[i] == bits(p, 10, 6)
+        assert fields.timestamp[i] == bits(p, 16, 31)
+        assert fields.adc[i] == bits(p, 48, 8)
+
+
+def test_empty():
+    fields = kernels.decode_packets(np.array([], dtype=np.uint64))
+    assert len(fields.parity_ok) == 0
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from decode import decode_msg
+from emulator import EmulatorConfig, MessageEncoder
+import kernels
+from monitor_pacman import Pacmon
+from occupancy import ADC_BINS, OccupancyStore
+from replay import ReplaySource
+
+from conftest import ListWriter, make_capture
+
+
+def make_msg(num_words, seed=0):
+    encoder = MessageEncoder(EmulatorConfig(seed=seed, bank_words=1 << 12,
+                                            io_channels=(1, 2, 3, 40),
+                                            sync_interval=None))
+    return decode_msg(encoder.encode(encoder.words(num_words, now=0.), now=0.))
+
+
+def test_record_matches_loop():
+    msg = make_msg(3000)
+    store = OccupancyStore(num_io_channels=33)
+    store.record(msg)
+
+    hits = np.zeros(store.shape, dtype=np.int64)
+    adc_sum = np.zeros(store.shape, dtype=np.int64)
+    out_of_range = 0
+    for io_channel, packet in zip(msg.io_channel.tolist(), msg.packet.tolist()):
+        if io_channel >= 33:
+            out_of_range += 1
+            continue
+        p = np.array([packet], dtype=np.uint64)
+        if kernels.packet_type(p)[0] != 0 or not kernels.parity_ok(p)[0]:
+            continue
+        key = (io_channel, kernels.chip_id(p)[0], kernels.channel_id(p)[0])
+        hits[key] += 1
+        adc_sum[key] += kernels.adc(p)[0]
+
+    assert np.array_equal(store.hits.reshape(store.shape), hits)
+    assert np.array_equal(store.adc_sum.reshape(store.shape), adc_sum)
+    assert store.out_of_range == out_of_range > 0
+    assert store.adc_spectrum.sum() == hits.sum()
+    assert store.chip_hits().sum() == hits.sum()
+    key = np.unravel_index(np.argmax(hits), store.shape)
+    assert store.spectrum(*key).sum() == hits[key]
+    assert len(store.spectrum(*key)) == ADC_BINS
+    assert store.nbytes == 33 * 256 * 64 * 8 * (4 + ADC_BINS)
+
+
+def test_top_n_lines():
+    store = OccupancyStore(top_n=3)
+    msg = make_msg(500)
+    for _ in range(4):
+        store.record(msg)
+    lines = store.lines(1000, dt=2.)
+    assert len(lines) == 3
+    hits = [int(line.split('hits=')[1].split('i')[0]) for line in lines]
+    assert hits == sorted(hits, reverse=True)
+    assert hits[0] == store.hits.max()
+    assert 'rank=1i' in lines[0] and 'rate=' in lines[0]
+
+    # only hits since the previous call count
+    assert store.lines(2000) == []
+    store.record(msg)
+    assert int(store.lines(3000)[0].split('hits=')[1].split('i')[0]) == hits[0] // 4
+
+
+def test_weighted_and_estimated():
+    msg = make_msg(500)
+    once, weighted = OccupancyStore(top_n=1), OccupancyStore(top_n=1)
+    once.record(msg)
+    weighted.record(msg, weight=3)
+    assert np.array_equal(weighted.hits, 3 * once.hits)
+    assert np.array_equal(weighted.adc_spectrum, 3 * once.adc_spectrum)
+    assert weighted.out_of_range == 3 * once.out_of_range
+
+    exact = once.lines(1000)[0]
+    estimate = weighted.lines(1000, estimated=True)[0]
+    assert exact.endswith(',estimated=false 1000')
+    assert estimate.endswith(',estimated=true 1000')
+    # the mean ADC is unchanged by the weight
+    assert exact.split('mean_adc=')[1].split(',')[0] == estimate.split('mean_adc=')[1].split(',')[0]
+
+
+def test_pacmon_tile_id(tmp_path):
+    paths, _, _ = make_capture(tmp_path)
+    writer = ListWriter()
+    writer.tile_ids = [7]
+    pacmon = Pacmon(source=ReplaySource(paths), influx_writer=writer)
+    pacmon.run()
+    lines = [line for _, extra, _ in writer.submitted for line in extra]
+    hot = [line for line in lines if line.startswith('hot_channels,')]
+    assert hot and all(',tile_id=7 ' in line for line in hot)
+    assert not any('tile_id=0' in line for line in lines)
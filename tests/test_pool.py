@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import time
+
+import numpy as np
+
+from counters import CounterStore
+from decode import decode_msg
+from pool import DecodePool
+
+from conftest import random_msg
+
+
+def test_pool_matches_single_process():
+    raws = [random_msg(n, seed=n) for n in range(1, 60)]
+    expected = CounterStore(num_tiles=2)
+    pool = DecodePool(3, num_tiles=2, interval=0.05).start()
+    try:
+        for i, raw in enumerate(raws):
+            expected.record(decode_msg(raw), tile=i % 2)
+            pool.submit(raw, tile=i % 2)
+        expected = expected.snapshot()
+
+        deadline = time.time() + 10
+        while True:
+            pool.collect(timeout=0.05)
+            snap = pool.snapshot()
+            if snap.ingest[:, 0].sum() == len(raws):
+                break
+            assert time.time() < deadline, 'workers never caught up'
+    finally:
+        pool.stop()
+
+    assert len(pool.latest) == 3
+    for name in ('word_types', 'data', 'config', 'ingest'):
+        assert np.array_equal(getattr(snap, name), getattr(expected, name))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from counters import CounterStore
+from decode import decode_msg
+from rates import RollingRates
+
+from conftest import random_msg
+
+
+def snapshots(num_intervals, msgs_per_interval=3):
+    store = CounterStore()
+    snaps = [store.snapshot(t=0.)]
+    for k in range(1, num_intervals + 1):
+        for i in range(msgs_per_interval):
+            store.record(decode_msg(random_msg(50, seed=k * 100 + i)))
+        snaps.append(store.snapshot(t=float(k)))
+    return snaps
+
+
+def test_windows_match_differences():
+    snaps = snapshots(15)
+    rolling = RollingRates(windows=(1, 4, 10))
+    for k, snap in enumerate(snaps):
+        rolling.update(snap)
+        for i, span in enumerate(rolling.spans):
+            if k == 0:
+                continue
+            start = snaps[max(0, k - span)]
+            dt = snap.time - start.time
+            for name in ('word_types', 'data', 'config', 'ingest'):
+                expected = getattr(snap, name) - getattr(start, name)
+                assert np.array_equal(rolling.counts(name, i), expected)
+                assert np.allclose(rolling.rates(name, i), expected / dt)
+
+
+def test_counter_reset():
+    snaps = snapshots(4)
+    rolling = RollingRates(windows=(10,))
+    for snap in snaps[:3]:
+        rolling.update(snap)
+    before = rolling.counts('data', 0).copy()
+    # the process restarted: counts start from zero again
+    restarted = snaps[1]
+    restarted.time = 3.
+    rolling.update(restarted)
+    assert (rolling.counts('data', 0) >= before).all()
+    assert np.array_equal(rolling.counts('data', 0) - before, snaps[1].data)
+
+
+def test_lines():
+    snaps = snapshots(2)
+    rolling = RollingRates(windows=(1, 10))
+    assert rolling.lines(0) == []
+    for snap in snaps:
+        rolling.update(snap)
+    lines = rolling.lines(2_000_000_000, tile_ids=[7])
+
+    data = snaps[-1].data[0] - snaps[-2].data[0]
+    active = np.flatnonzero(data[:, 0] + (snaps[-1].config[0] - snaps[-2].config[0])[:, 0])
+    per_window = 2 + 2 * len(active)
+    assert len([line for line in lines if 'window=1s' in line]) == per_window
+    assert lines[0].startswith('word_type_rates,tile_id=7,window=1s Data=')
+    chan = active[0]
+    line = next(line for line in lines
+                if line.startswith(f'data_rates,io_channel={chan},tile_id=7,window=1s '))
+    fields = dict(field.split('=') for field in line.split(' ')[1].split(','))
+    assert float(fields['total']) == data[chan, 0]
+    assert np.isclose(float(fields['invalid_parity_fraction']),
+                      data[chan, 2] / data[chan, 0])
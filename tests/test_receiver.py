@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import time
+
+import zmq
+
+from decode import decode_msg
+from receiver import Receiver, Ring
+
+from conftest import random_msg, wait_for
+
+
+def test_ring():
+    ring = Ring(3)
+    assert ring.get(timeout=0) is None
+    for i in range(5):
+        ring.put(i)
+    assert len(ring) == 3
+    assert ring.overflows == 2
+    assert [ring.get(0), ring.get(0)] == [0, 1]
+    ring.put(5)
+    assert [ring.get(0), ring.get(0), ring.get(0)] == [2, 5, None]
+    assert ring.max_occupancy == 3
+
+
+def test_receiver_accounting():
+    ctx = zmq.Context()
+    pub = ctx.socket(zmq.PUB)
+    port = pub.bind_to_random_port('tcp://127.0.0.1')
+    receiver = Receiver(f'tcp://127.0.0.1:{port}', capacity=4, rcvhwm=1000).start()
+    assert receiver.socket.getsockopt(zmq.RCVHWM) == 1000
+    raw = random_msg(10)
+    try:
+        # wait out the slow-joiner period, then empty the ring
+        while receiver.received == 0:
+            pub.send(raw)
+            time.sleep(0.01)
+        time.sleep(0.05)
+        while receiver.get(timeout=0) is not None:
+            pass
+        before = receiver.stats()
+        assert before.processed == before.received - before.overflows
+
+        for _ in range(20):
+            pub.send(raw)
+        wait_for(lambda: receiver.received == before.received + 20)
+
+        msg = decode_msg(receiver.get(timeout=1))
+        assert msg.num_words == 10
+
+        stats = receiver.stats()
+        assert stats.overflows == before.overflows + 16
+        assert stats.occupancy == 3
+        assert stats.max_occupancy == 4
+        assert stats.processed == before.processed + 1
+        assert stats.bytes == stats.received * len(raw)
+        line = receiver.stats_line(123)
+        assert line.startswith('receiver received=') and line.endswith(' 123')
+    finally:
+        receiver.stop()
+        pub.close(linger=0)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from decode import DATA, WORD_DTYPE, decode_msg
+from emulator import MessageEncoder
+from register_mirror import RegisterMirror
+
+READ, WRITE = 3, 2
+
+
+def config_packet(packet_type, chip, register, value, downstream=False, parity=True):
+    packet = packet_type | (chip << 2) | (register << 10) | (value << 18)
+    if downstream:
+        packet |= 1 << 62
+    if (bin(packet).count('1') % 2 == 0) == parity:
+        packet |= 1 << 63
+    return packet
+
+
+def make_msg(packets):
+    "packets: (io_channel, packet) pairs"
+    words = np.zeros(len(packets), WORD_DTYPE)
+    for word, (io_channel, packet) in zip(words, packets):
+        word['type'] = DATA
+        word['io_channel'] = io_channel
+        word['packet'] = packet
+    return decode_msg(MessageEncoder.encode(words, now=0.))
+
+
+def test_record_and_diff(tmp_path):
+    mirror = RegisterMirror(num_io_channels=4)
+    mirror.record(make_msg([
+        (1, config_packet(READ, 10, 0, 16)),
+        (1, config_packet(READ, 10, 1, 7)),
+        (1, config_packet(READ, 10, 1, 8)),         # later read wins
+        (2, config_packet(READ, 3, 5, 99)),
+        (2, config_packet(READ, 3, 6, 1, downstream=True)),
+        (2, config_packet(READ, 3, 7, 1, parity=False)),
+        (2, config_packet(WRITE, 3, 8, 1)),
+        (9, config_packet(READ, 3, 5, 99)),         # out of range
+    ]), now=50.)
+    assert mirror.reads == 4 and mirror.out_of_range == 1
+    table = mirror.value.reshape(mirror.shape)
+    assert table[1, 10, 0] == 16 and table[1, 10, 1] == 8 and table[2, 3, 5] == 99
+    assert np.count_nonzero(mirror.last_seen) == mirror.registers == 3
+
+    expected_path = tmp_path / 'expected.txt'
+    expected_path.write_text('# io_channel chip register value\n'
+                             '1 10 0 16\n1, 10, 1, 9\n2 3 5 99\n2 3 6 1\n')
+    expected = mirror.load_expected(str(expected_path))
+    diff = mirror.diff(expected)
+    assert diff.checked == 4 and not diff.ok
+    assert [a.tolist() for a in mirror.unravel(diff.mismatched)] == [[1], [10], [1]]
+    assert diff.expected.tolist() == [9] and diff.actual.tolist() == [8]
+    assert [a.tolist() for a in mirror.unravel(diff.never_read)] == [[2], [3], [6]]
+
+    lines = mirror.lines(1000, expected, estimated=True, ratio=2)
+    assert lines[0] == ('config_mirror,tile_id=0 reads=4i,registers=3i,out_of_range=1i,'
+                        'estimated=true,sample_ratio=2i 1000')
+    assert lines[1:] == [
+        'config_diff,io_channel=1,tile_id=0 checked=2i,mismatched=1i,never_read=0i 1000',
+        'config_diff,io_channel=2,tile_id=0 checked=2i,mismatched=0i,never_read=1i 1000']
+
+    # saved as named, with no .npz appended and no temporary file left
+    path = str(tmp_path / 'mirror')
+    mirror.save(path)
+    mirror.save(path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['expected.txt', 'mirror']
+    loaded = RegisterMirror.load(path)
+    assert loaded.shape == mirror.shape and loaded.registers == 3
+    assert np.array_equal(loaded.value, mirror.value)
+    assert np.array_equal(loaded.last_seen, mirror.last_seen)
+    assert loaded.diff(expected).mismatched.tolist() == diff.mismatched.tolist()
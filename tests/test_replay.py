@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import socket
+import threading
+import time
+
+import numpy as np
+import zmq
+
+from counters import CounterStore
+from decode import decode_msg
+from monitor_pacman import Pacmon
+from replay import ReplaySource, paced, republish
+
+from conftest import ListWriter, make_capture
+
+
+def test_replay_into_pacmon(tmp_path):
+    paths, raws, t0 = make_capture(tmp_path)
+    writer = ListWriter()
+    pacmon = Pacmon(source=ReplaySource(paths), influx_writer=writer)
+    start = time.perf_counter()
+    pacmon.run()
+    # 5 s of recorded traffic, replayed as fast as possible
+    assert time.perf_counter() - start < 1
+
+    expected = CounterStore()
+    for raw in raws:
+        expected.record(decode_msg(raw))
+    expected = expected.snapshot()
+
+    snaps = [snap for snap, _, _ in writer.submitted]
+    assert all(block for _, _, block in writer.submitted)
+    # one flush per recorded second, stamped with recorded time
+    assert len(snaps) == 5
+    assert snaps[0].time > t0 / 1e9 + 1
+    assert snaps[-1].time == (t0 + 49 * 100_000_000) / 1e9
+    assert np.array_equal(snaps[-1].data, expected.data)
+    assert np.array_equal(snaps[-1].word_types, expected.word_types)
+    assert writer.submitted[-1][1][0].startswith('replay replayed=50i,')
+
+
+def test_paced():
+    msgs = [(i * 10_000_000, b'') for i in range(11)]
+    start = time.perf_counter()
+    assert len(list(paced(msgs, speed=2.))) == 11
+    elapsed = time.perf_counter() - start
+    assert 0.05 <= elapsed < 0.2
+
+
+def test_republish(tmp_path):
+    paths, raws, _ = make_capture(tmp_path, num_msgs=20, spacing_ns=1_000_000)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        endpoint = f'tcp://127.0.0.1:{sock.getsockname()[1]}'
+
+    ctx = zmq.Context()
+    sub = ctx.socket(zmq.SUB)
+    sub.setsockopt(zmq.SUBSCRIBE, b'')
+    sub.setsockopt(zmq.RCVTIMEO, 5000)
+    sub.connect(endpoint)
+    sent = []
+    thread = threading.Thread(
+        target=lambda: sent.append(republish(paths, endpoint, speed=1., wait=0.5)))
+    thread.start()
+    try:
+        received = [sub.recv() for _ in raws]
+    finally:
+        thread.join()
+        sub.close(linger=0)
+        ctx.term()
+    assert sent == [20]
+    assert received == raws
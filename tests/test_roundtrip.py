@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from decode import DATA, WORD_DTYPE, decode_msg
+from emulator import MessageEncoder
+from roundtrip import NUM_LATENCY_BUCKETS, RoundTripTracker
+
+WRITE, READ = 2, 3
+
+
+def config_packet(packet_type, chip, register, downstream):
+    packet = packet_type | (chip << 2) | (register << 10)
+    if downstream:
+        packet |= 1 << 62
+    if bin(packet).count('1') % 2 == 0:
+        packet |= 1 << 63
+    return packet
+
+
+def make_msg(packets):
+    "packets: (io_channel, packet_type, chip, register, downstream) tuples"
+    words = np.zeros(len(packets), WORD_DTYPE)
+    for word, (io_channel, *fields) in zip(words, packets):
+        word['type'] = DATA
+        word['io_channel'] = io_channel
+        word['packet'] = config_packet(*fields)
+    return decode_msg(MessageEncoder.encode(words, now=0.))
+
+
+def test_match_and_timeout():
+    tracker = RoundTripTracker(timeout=1., tick=0.1)
+    tracker.record(make_msg([(1, READ, 5, 10, True), (1, READ, 5, 10, True),
+                             (2, WRITE, 7, 3, True)]), now=100.)
+    assert tracker.outstanding == 3
+    # the first read is answered; a reply nobody asked for
+    tracker.record(make_msg([(1, READ, 5, 10, False), (3, READ, 1, 1, False)]),
+                   now=100.002)
+    assert tracker.outstanding == 2
+    assert tracker.counts[1].tolist() == [2, 1, 0, 0, 0]
+    assert tracker.counts[3].tolist() == [0, 0, 0, 1, 0]
+    # 2000 us
+    assert np.flatnonzero(tracker.latency_hist[1]).tolist() == [11]
+
+    tracker.advance(100.9)
+    assert tracker.outstanding == 2
+    tracker.advance(101.2)
+    assert tracker.outstanding == 0
+    assert tracker.counts[1, 2] == 1 and tracker.counts[2, 2] == 1
+    # a late reply is unsolicited
+    tracker.record(make_msg([(2, WRITE, 7, 3, False)]), now=101.3)
+    assert tracker.counts[2].tolist() == [1, 0, 1, 1, 0]
+
+
+def test_bounded_and_lines():
+    tracker = RoundTripTracker(timeout=0.5, tick=0.1, max_outstanding=100)
+    storm = [(4, WRITE, chip, reg, True) for chip in range(20) for reg in range(10)]
+    tracker.record(make_msg(storm), now=10.)
+    assert tracker.outstanding == 100 and len(tracker.pending) == 100
+    assert tracker.counts[4].tolist() == [200, 0, 0, 0, 100]
+
+    replies = [(4, WRITE, chip, reg, False) for chip in range(10) for reg in range(10)]
+    tracker.record(make_msg(replies), now=10.05)
+    lines = tracker.lines(int(10.05e9), estimated=True, ratio=8)
+    assert lines[0].startswith('config_roundtrip,io_channel=4,tile_id=0 '
+                               'requests=200i,replies=100i,timeouts=0i,'
+                               'unsolicited=0i,dropped=100i,p50_us=65535i')
+    assert lines[0].endswith(',estimated=true,sample_ratio=8i 10050000000')
+    assert lines[-1].startswith('config_outstanding,tile_id=0 outstanding=0i')
+    assert tracker.latency_hist.shape[1] == NUM_LATENCY_BUCKETS
+
+    # answered requests have left the wheel
+    assert not any(tracker.wheel)
+    tracker.advance(20.)
+    assert tracker.counts[4, 2] == 0
+    assert tracker.lines(int(21e9)) == ['config_outstanding,tile_id=0 outstanding=0i 21000000000']
+
+
+def test_wheel_bounded_under_answered_storm():
+    tracker = RoundTripTracker(timeout=1., tick=0.01, max_outstanding=1000)
+    requests = make_msg([(5, READ, chip, reg, True)
+                         for chip in range(100) for reg in range(10)])
+    replies = make_msg([(5, READ, chip, reg, False)
+                        for chip in range(100) for reg in range(10)])
+    for n in range(200):
+        now = 50. + n * 1e-4
+        tracker.record(requests, now)
+        assert sum(len(slot) for slot in tracker.wheel) <= tracker.max_outstanding
+        tracker.record(replies, now)
+    assert sum(len(slot) for slot in tracker.wheel) == tracker.outstanding == 0
+    assert tracker.counts[5].tolist() == [200_000, 200_000, 0, 0, 0]
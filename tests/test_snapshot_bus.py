@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from counters import CounterStore
+from decode import decode_msg
+from snapshot_bus import SnapshotReader, SnapshotWriter
+
+from conftest import random_msg
+
+
+def bus_name():
+    return f'pacmon-test-{os.getpid()}-{threading.get_ident()}'
+
+
+def test_publish_and_read():
+    store = CounterStore(num_tiles=2)
+    store.record(decode_msg(random_msg(200)), tile=1)
+    writer = SnapshotWriter(bus_name(), num_tiles=2)
+    try:
+        reader = SnapshotReader(writer.name)
+        assert reader.read() is None
+        snap = store.snapshot(t=123.5)
+        writer.publish(snap)
+        assert reader.seq == 2
+        got = reader.read()
+        assert got.time == 123.5
+        for name in ('word_types', 'data', 'config', 'ingest'):
+            assert np.array_equal(getattr(got, name), getattr(snap, name))
+        assert got.active_channels(1).tolist() == snap.active_channels(1).tolist()
+        reader.close()
+    finally:
+        writer.close()
+
+
+def test_reads_are_consistent_while_writing():
+    writer = SnapshotWriter(bus_name())
+    store = CounterStore()
+    msg = decode_msg(random_msg(50))
+    snaps = []
+    for _ in range(4):
+        store.record(msg)
+        snaps.append(store.snapshot(t=float(len(snaps))))
+    expected = {snap.time: snap for snap in snaps}
+    writer.publish(snaps[0])
+    reader = SnapshotReader(writer.name)
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            writer.publish(snaps[i % len(snaps)])
+            i += 1
+            time.sleep(0)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        for _ in range(500):
+            got = reader.read()
+            assert np.array_equal(got.data, expected[got.time].data)
+            assert np.array_equal(got.ingest, expected[got.time].ingest)
+    finally:
+        stop.set()
+        thread.join()
+        reader.close()
+        writer.close()
+
+
+def test_single_writer():
+    writer = SnapshotWriter(bus_name())
+    try:
+        with pytest.raises(FileExistsError, match=f'pid {os.getpid()}'):
+            SnapshotWriter(writer.name)
+        writer.publish(CounterStore().snapshot(t=5.))
+    finally:
+        # as if the writer died: the segment stays, the lock is released
+        writer.close(unlink=False)
+
+    again = SnapshotWriter(writer.name)
+    try:
+        reader = SnapshotReader(again.name)
+        assert reader.seq == 0
+        again.publish(CounterStore().snapshot(t=6.))
+        assert reader.read().time == 6.
+        reader.close()
+    finally:
+        again.close()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import time
+
+from counters import CounterStore
+from influx_writer import InfluxWriter
+from spool import Backfill, Spool
+
+from conftest import wait_for
+
+
+def lines(n, start=0):
+    return [f'm,tag=a value={i}i {i}' for i in range(start, start + n)]
+
+
+def test_segments_roll_and_evict(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=100, max_bytes=500)
+    for i in range(50):
+        spool.append(lines(1, i))
+    assert len(spool) > 1
+    assert spool.size_bytes <= 500 + 100
+    assert spool.stats.evicted_segments > 0
+    spool.close()
+
+    # Oldest data was evicted, newest survives
+    reopened = Spool(str(tmp_path), segment_bytes=100, max_bytes=500)
+    assert len(reopened) == len(spool)
+    remaining = []
+    while (name := reopened.oldest()) is not None:
+        remaining += reopened.read(name)
+        reopened.remove(name)
+    assert remaining == lines(len(remaining), 50 - len(remaining))
+
+
+def test_backfill_rate_limit(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(lines(100))
+    sent = []
+    backfill = Backfill(spool, sent.extend, batch_lines=10, max_lines_per_s=1000)
+
+    assert backfill.step() == 10
+    assert backfill.step() == 0     # limited until 10 ms have passed
+    time.sleep(0.011)
+    assert backfill.step() == 10
+    while backfill.pending:
+        backfill.step()
+    assert sent == lines(100)
+    assert len(spool) == 0
+
+
+def test_backfill_retries_failed_batch(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(lines(5))
+    sent = []
+
+    def send(batch):
+        if not sent:
+            sent.append(None)
+            raise ConnectionError
+        sent.extend(batch)
+
+    backfill = Backfill(spool, send, max_lines_per_s=1e9)
+    try:
+        backfill.step()
+    except ConnectionError:
+        pass
+    backfill.step()
+    assert sent[1:] == lines(5)
+
+
+def test_writer_spools_and_backfills(tmp_path, fake_influx):
+    store = CounterStore()
+    spool = Spool(str(tmp_path))
+    writer = InfluxWriter(fake_influx.url, 'token', 'org', 'bucket',
+                          spool=spool).start()
+
+    fake_influx.fail = True
+    for _ in range(3):
+        writer.submit(store.snapshot())
+    wait_for(lambda: writer.stats.failed >= 3)
+    assert writer.stats.spooled_lines > 0
+    assert len(spool) == 1
+    assert not fake_influx.requests
+
+    fake_influx.fail = False
+    writer.submit(store.snapshot())
+    wait_for(lambda: not writer.backfill.pending)
+    writer.stop()
+
+    assert writer.stats.backfilled_lines == writer.stats.spooled_lines
+    # live batch first, then the backfill
+    assert len(fake_influx.requests) == 2
+    assert len(fake_influx.lines()) == 4 * 3
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import time
+
+import zmq
+
+from format import Msg, MsgType, WordType
+from influx_writer import InfluxWriter
+from supervisor import Supervisor
+
+
+def data_msg(io_channel, num_words):
+    word = {'type': WordType.Data,
+            'content': {'io_channel': io_channel, 'timestamp': 0,
+                        'packet': bytes(7) + b'\x80'}}
+    return Msg.build({'type': MsgType.Data, 'timestamp': 0,
+                      'num_words': num_words, 'words': [word] * num_words})
+
+
+def test_supervisor_merges_tiles():
+    ctx = zmq.Context()
+    pubs, endpoints = [], []
+    for tile_id in (10, 11, 12):
+        pub = ctx.socket(zmq.PUB)
+        port = pub.bind_to_random_port('tcp://127.0.0.1')
+        pubs.append(pub)
+        endpoints.append((tile_id, f'tcp://127.0.0.1:{port}'))
+
+    supervisor = Supervisor(endpoints, group_size=2, interval=0.05).start()
+    assert [w.tiles for w in supervisor.workers] == [[0, 1], [2]]
+    try:
+        deadline = time.time() + 10
+        while True:
+            # tile i publishes on io_channel i+1, i+1 words per message
+            for i, pub in enumerate(pubs):
+                pub.send(data_msg(i + 1, i + 1))
+            supervisor.collect(timeout=0.05)
+            snap = supervisor.snapshot()
+            if (snap.ingest[:, 0] > 5).all():
+                break
+            assert time.time() < deadline, 'workers never reported'
+
+        for i in range(3):
+            assert snap.active_channels(i).tolist() == [i + 1]
+            messages, words = snap.ingest[i, :2]
+            assert words == messages * (i + 1)
+            assert snap.word_types[i, 0] == words
+
+        # Kill a worker; its counts must be carried over after the restart
+        before = snap.data.copy()
+        supervisor.workers[1].process.kill()
+        supervisor.workers[1].process.join()
+        supervisor.check_workers()
+        assert supervisor.workers[1].restarts == 1
+        for _ in range(20):
+            for i, pub in enumerate(pubs):
+                pub.send(data_msg(i + 1, i + 1))
+            supervisor.collect(timeout=0.05)
+        after = supervisor.snapshot()
+        assert (after.data >= before).all()
+        assert after.data[2].sum() > before[2].sum()
+
+        supervisor.update_rates(snap)
+        supervisor.update_rates(after)
+        assert set(supervisor.rates) == {10, 11, 12}
+    finally:
+        supervisor.stop()
+        for pub in pubs:
+            pub.close(linger=0)
+        ctx.term()
+
+
+def test_restart_while_writer_runs(fake_influx):
+    ctx = zmq.Context()
+    pub = ctx.socket(zmq.PUB)
+    port = pub.bind_to_random_port('tcp://127.0.0.1')
+    writer = InfluxWriter(fake_influx.url, 'token', 'org', 'bucket').start()
+    supervisor = Supervisor([(1, f'tcp://127.0.0.1:{port}')], writer,
+                            interval=0.05).start()
+    try:
+        worker = supervisor.workers[0]
+        worker.process.kill()
+        worker.process.join()
+        supervisor.check_workers()
+        assert worker.restarts == 1 and worker.process.is_alive()
+        assert supervisor.lines(5) == [
+            'supervisor_workers,tile_id=1 group=0i,restarts=1i,alive=true 5']
+
+        # the restarted worker, started with the writer thread running, counts
+        deadline = time.time() + 10
+        while supervisor.snapshot().ingest[0, 0] < 5:
+            pub.send(data_msg(1, 2))
+            supervisor.collect(timeout=0.05)
+            assert time.time() < deadline, 'restarted worker never reported'
+        assert worker.process.is_alive()
+    finally:
+        supervisor.stop()
+        writer.stop()
+        pub.close(linger=0)
+        ctx.term()
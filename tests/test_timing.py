@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from decode import DATA, SYNC, WORD_DTYPE, decode_msg
+from emulator import MessageEncoder
+from timing import NUM_GAP_BUCKETS, TimingAnalyzer, signed_diff
+
+
+def make_msg(words, header_ts=0):
+    "words: (type, io_channel, timestamp) tuples"
+    array = np.zeros(len(words), WORD_DTYPE)
+    for word, (word_type, io_channel, ts) in zip(array, words):
+        word['type'] = word_type
+        if word_type == DATA:
+            word['io_channel'] = io_channel
+            word['data_timestamp'] = ts
+        else:
+            word['sub_type'] = word_type
+            word['trig_timestamp'] = ts
+    return decode_msg(MessageEncoder.encode(array, now=header_ts))
+
+
+def test_signed_diff():
+    assert signed_diff(np.array([5]), np.array([3])).tolist() == [2]
+    assert signed_diff(np.array([3]), np.array([5])).tolist() == [-2]
+    assert signed_diff(np.array([2]), np.array([(1 << 32) - 3])).tolist() == [5]
+
+
+def test_rollover_backwards_gap():
+    timing = TimingAnalyzer(gap_ticks=1000)
+    top = (1 << 32) - 10
+    timing.record(make_msg([(DATA, 1, 100), (DATA, 2, top), (DATA, 1, 200)]), now=0.)
+    # channel 2 rolls over; channel 1 jumps back, then a gap
+    timing.record(make_msg([(DATA, 2, 5), (DATA, 1, 150), (DATA, 1, 5000)]), now=1.)
+
+    assert dict(zip(('words', 'rollovers', 'backwards', 'gaps'),
+                    timing.counts[1].tolist())) == \
+        {'words': 4, 'rollovers': 0, 'backwards': 1, 'gaps': 1}
+    assert timing.counts[2].tolist() == [2, 1, 0, 0]
+    assert timing.max_gap[1] == 4850 and timing.max_gap[2] == 15
+    hist = timing.gap_hist.reshape(-1, NUM_GAP_BUCKETS)
+    # 100 -> 200 (bucket 7), 150 -> 5000 (bucket 13), and the backwards step
+    # in bucket 0
+    assert np.flatnonzero(hist[1]).tolist() == [0, 7, 13]
+
+    timing.discontinuity()
+    timing.record(make_msg([(DATA, 1, 10)]), now=2.)
+    assert timing.counts[1, 2] == 1     # no backwards step across the reset
+
+
+def test_sync_cadence():
+    period = 1000
+    timing = TimingAnalyzer(sync_ticks=period)
+    times = [0, 1000, 2000, 4000, 4500, 5500, 6800]
+    timing.record(make_msg([(SYNC, 0, t) for t in times]), now=0.)
+    syncs = dict(zip(('syncs', 'on_time', 'early', 'late', 'missed'),
+                     timing.sync.tolist()))
+    # 2000 -> 4000 skips one Sync; 4500 is early; 6800 is late
+    assert syncs == {'syncs': 7, 'on_time': 4, 'early': 1, 'late': 1, 'missed': 1}
+
+
+def test_lines_and_stalls():
+    timing = TimingAnalyzer(gap_ticks=10, stall_after=5.)
+    timing.record(make_msg([(DATA, 3, 0), (DATA, 3, 100), (DATA, 4, 0)],
+                           header_ts=10), now=100.)
+    lines = timing.lines(101 * 10**9, tile_id=2, estimated=True, ratio=4)
+    assert lines[0] == ('timing,io_channel=3,tile_id=2 words=2i,rollovers=0i,'
+                        'backwards=0i,gaps=1i,max_gap_ticks=100i,stalled=false,'
+                        'estimated=true,sample_ratio=4i 101000000000')
+    assert lines[1] == ('timing_gaps,io_channel=3,tile_id=2 b7=1i,estimated=true,'
+                        'sample_ratio=4i 101000000000')
+    assert lines[2].startswith('timing,io_channel=4,tile_id=2 words=1i,')
+    assert lines[-1].startswith('sync_timing,tile_id=2 syncs=0i,')
+    assert lines[-1].endswith(',estimated=true,sample_ratio=4i 101000000000')
+
+    # channel 4 keeps going, channel 3 goes quiet
+    timing.record(make_msg([(DATA, 4, 5)], header_ts=9), now=106.)
+    lines = timing.lines(107 * 10**9)
+    assert lines[0].startswith('timing,io_channel=3,tile_id=0 words=0i,')
+    assert 'stalled=true,estimated=false,sample_ratio=1i' in lines[0]
+    assert 'header_backwards=1i' in lines[-1]
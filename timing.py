@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# Timestamp continuity per io_channel. For each message the Data word
+# timestamps are grouped by io_channel (one stable sort) and differenced
+# against the previous word on the same channel, modulo 2**32, carrying the
+# last timestamp of each channel across messages. From the signed
+# differences we count 32-bit rollovers, backwards jumps and gaps beyond a
+# threshold, and fill a log2 histogram of the differences. Sync words are
+# checked against the expected cadence and channels that go quiet are
+# reported as stalled. All state is fixed-size arrays indexed by io_channel.
+
+from typing import List
+
+import numpy as np
+
+from counters import NUM_IO_CHANNELS
+from decode import DATA, SYNC, DecodedMsg, PACMAN_CLOCK_HZ
+
+TIMING_FIELDS = ('words', 'rollovers', 'backwards', 'gaps')
+SYNC_FIELDS = ('syncs', 'on_time', 'early', 'late', 'missed')
+NUM_GAP_BUCKETS = 33            # bucket k: differences in [2**(k-1), 2**k) ticks
+
+_WRAP = 1 << 32
+_HALF = 1 << 31
+
+
+def signed_diff(ts: np.ndarray, prev: np.ndarray) -> np.ndarray:
+    "ts - prev for 32-bit timestamps, as the shortest signed distance"
+    return (ts - prev + _HALF) % _WRAP - _HALF
+
+
+class TimingAnalyzer:
+    def __init__(self, num_io_channels=NUM_IO_CHANNELS,
+                 gap_ticks=PACMAN_CLOCK_HZ, sync_ticks=PACMAN_CLOCK_HZ,
+                 sync_tolerance=0.01, stall_after=10.):
+        self.num_io_channels = num_io_channels
+        self.gap_ticks = gap_ticks
+        self.sync_ticks = sync_ticks
+        self.sync_tolerance = sync_tolerance
+        self.stall_after = stall_after
+
+        self.last_ts = np.full(num_io_channels, -1, dtype=np.int64)
+        self.last_seen = np.full(num_io_channels, np.nan)  # source time, seconds
+        self.counts = np.zeros((num_io_channels, len(TIMING_FIELDS)), dtype=np.int64)
+        self.max_gap = np.zeros(num_io_channels, dtype=np.int64)   # this interval
+        self.gap_hist = np.zeros(num_io_channels * NUM_GAP_BUCKETS, dtype=np.int64)
+        self.sync = np.zeros(len(SYNC_FIELDS), dtype=np.int64)
+        self.last_sync = -1
+        self.last_header = -1
+        self.header_backwards = 0
+        self._prev_counts = self.counts.copy()
+        self._prev_hist = self.gap_hist.copy()
+        self._prev_sync = self.sync.copy()
+
+    def discontinuity(self):
+        "Forget the last timestamps, e.g. after messages were skipped"
+        self.last_ts[:] = -1
+        self.last_sync = -1
+
+    def record(self, msg: DecodedMsg, now: float):
+        if msg.timestamp < self.last_header:
+            self.header_backwards += 1
+        self.last_header = msg.timestamp
+
+        word_type = msg.word_type
+        is_data = word_type == DATA
+        if is_data.any():
+            self._record_data(msg.io_channel[is_data],
+                              msg.word_timestamp[is_data].astype(np.int64), now)
+        is_sync = word_type == SYNC
+        if is_sync.any():
+            self._record_sync(msg.word_timestamp[is_sync].astype(np.int64))
+
+    def _record_data(self, chans: np.ndarray, ts: np.ndarray, now: float):
+        order = np.argsort(chans, kind='stable')
+        chans, ts = chans[order].astype(np.intp), ts[order]
+        n = len(ts)
+        first = np.ones(n, dtype=bool)
+        first[1:] = chans[1:] != chans[:-1]
+        starts = np.flatnonzero(first)
+        ends = np.append(starts[1:], n) - 1
+        group_chans = chans[starts]
+
+        prev = np.empty(n, dtype=np.int64)
+        prev[1:] = ts[:-1]
+        prev[starts] = self.last_ts[group_chans]
+        known = prev >= 0
+        diff = signed_diff(ts, prev)
+        rollover = known & (ts < prev) & (diff >= 0)
+        backwards = known & (diff < 0)
+        gap = known & (diff > self.gap_ticks)
+
+        self.counts[group_chans, 0] += ends - starts + 1
+        # the other events are rare; skip their bookkeeping when absent
+        for field, event in enumerate((rollover, backwards, gap), 1):
+            if event.any():
+                np.add.at(self.counts[:, field], chans[event], 1)
+
+        forward = np.where(known & (diff > 0), diff, 0)
+        _, bucket = np.frexp(forward.astype(np.float64))
+        codes = chans[known] * NUM_GAP_BUCKETS + np.minimum(bucket[known],
+                                                            NUM_GAP_BUCKETS - 1)
+        np.add.at(self.gap_hist, codes, 1)
+        self.max_gap[group_chans] = np.maximum(self.max_gap[group_chans],
+                                               np.maximum.reduceat(forward, starts))
+
+        self.last_ts[group_chans] = ts[ends]
+        self.last_seen[group_chans] = now
+
+    def _record_sync(self, ts: np.ndarray):
+        prev = np.empty(len(ts), dtype=np.int64)
+        prev[0] = self.last_sync
+        prev[1:] = ts[:-1]
+        self.last_sync = int(ts[-1])
+        self.sync[0] += len(ts)
+        known = prev >= 0
+        if not known.any():
+            return
+        # consecutive Syncs should be a whole number of periods apart
+        periods = signed_diff(ts[known], prev[known]) / self.sync_ticks
+        aligned = np.abs(periods - np.rint(periods)) <= self.sync_tolerance
+        elapsed = np.floor(periods + self.sync_tolerance)
+        self.sync[1] += np.count_nonzero(aligned & (elapsed >= 1))
+        self.sync[2] += np.count_nonzero(periods < 1 - self.sync_tolerance)
+        self.sync[3] += np.count_nonzero(~aligned & (periods > 1))
+        self.sync[4] += int(np.sum(np.maximum(elapsed - 1, 0)))
+
+    def stalled(self, now: float) -> np.ndarray:
+        "io_channels seen before but silent for more than stall_after seconds"
+        with np.errstate(invalid='ignore'):
+            return np.flatnonzero(now - self.last_seen > self.stall_after)
+
+    def lines(self, ts: int, tile_id=0, estimated=False, ratio=1) -> List[str]:
+        """timing lines (per-interval counts per active or stalled io_channel),
+        timing_gaps (the interval's non-empty log2 buckets, b<k> counting
+        differences in [2**(k-1), 2**k) ticks) and sync_timing, each saying
+        whether messages went undecoded in the interval and the decode
+        sampling ratio"""
+        counts = self.counts - self._prev_counts
+        hist = (self.gap_hist - self._prev_hist).reshape(self.num_io_channels,
+                                                         NUM_GAP_BUCKETS)
+        sync = self.sync - self._prev_sync
+        self._prev_counts = self.counts.copy()
+        self._prev_hist = self.gap_hist.copy()
+        self._prev_sync = self.sync.copy()
+
+        stalled = set(self.stalled(ts / 1e9).tolist())
+        sampling = f'estimated={str(estimated).lower()},sample_ratio={ratio}i'
+        lines = []
+        for chan in sorted(set(np.flatnonzero(counts[:, 0]).tolist()) | stalled):
+            tags = f'io_channel={chan},tile_id={tile_id}'
+            fields = ','.join(f'{name}={value}i' for name, value
+                              in zip(TIMING_FIELDS, counts[chan].tolist()))
+            lines.append(f'timing,{tags} {fields},max_gap_ticks={self.max_gap[chan]}i,'
+                         f'stalled={str(chan in stalled).lower()},{sampling} {ts}')
+            buckets = np.flatnonzero(hist[chan])
+            if len(buckets):
+                fields = ','.join(f'b{k}={hist[chan, k]}i' for k in buckets.tolist())
+                lines.append(f'timing_gaps,{tags} {fields},{sampling} {ts}')
+        fields = ','.join(f'{name}={value}i'
+                          for name, value in zip(SYNC_FIELDS, sync.tolist()))
+        lines.append(f'sync_timing,tile_id={tile_id} {fields},'
+                     f'header_backwards={self.header_backwards}i,{sampling} {ts}')
+        self.max_gap[:] = 0
+        return lines
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import time
+
 import zmq
 
 from format import Msg
@@ -15,7 +17,20 @@ def parity64(data: bytes) -> int:
     x ^= x >> 1
     return x & 1
 
-def get_data_socket() -> zmq.Socket:
+def stop_processes(processes, collect, timeout=2.):
+    "Wait for processes to exit, terminating any still alive after timeout"
+    # Keep reading while the workers exit, so none block flushing a
+    # final snapshot into a full pipe
+    deadline = time.monotonic() + timeout
+    while (any(proc.is_alive() for proc in processes)
+           and time.monotonic() < deadline):
+        collect(timeout=0.05)
+    for proc in processes:
+        if proc.is_alive():
+            proc.terminate()
+
+def get_data_socket(url='tcp://pacman32.local:5556', rcvhwm=None,
+                    rcvbuf=None) -> zmq.Socket:
     ctx = zmq.Context()
     socket = ctx.socket(zmq.SUB)
     socket_opts = [
@@ -23,9 +38,14 @@ def get_data_socket() -> zmq.Socket:
         (zmq.RCVTIMEO, 1000*11),
         (zmq.SNDTIMEO, 1000*11)
     ]
+    # Must be set before connecting to take effect
+    if rcvhwm is not None:
+        socket_opts.append((zmq.RCVHWM, rcvhwm))
+    if rcvbuf is not None:
+        socket_opts.append((zmq.RCVBUF, rcvbuf))
     for opt in socket_opts:
         socket.setsockopt(*opt)
-    socket.connect('tcp://pacman32.local:5556')
+    socket.connect(url)
     socket.setsockopt(zmq.SUBSCRIBE, b'')
     return socket
 